@@ -1,22 +1,52 @@
-from typing import Tuple, Optional
+import os
+from datetime import datetime, timezone
+from typing import List, Tuple, Optional
+from pathlib import Path
+from logging import Logger
 
 import wrf
-import math
+import xarray as xr
 
 from netCDF4 import Dataset
 
 from app.path_config import PathConfig
+from library.cache.DatasetPool import DatasetPool
 from library.models.WRFData import WRFData
-from library.utils import Singleton
+from library.models.PointData import GridPointIndex, meteogram, soundings
+from library.cache.LRUCache import LRUCache
+from library.WrfOutWatcher import is_in_progress
 
 import app.map.constants as Constants
 from app.map.models import CTFVariable, CTVariable
 
 
-class WrfOutManager(metaclass=Singleton):
+# nearest grid point lookups per domain, shared by every manager
+_point_indexes = LRUCache(max_items=8)
 
-    def __init__(self, path_config: PathConfig) -> None:
+
+def create_dataset_pool(path_config: PathConfig, max_open_files: int = 4, max_open_bytes: Optional[int] = None,
+                        diagnostic_cache_bytes: Optional[int] = None, logger: Logger = None) -> DatasetPool:
+    return DatasetPool(max_open_files=max_open_files, max_bytes=max_open_bytes,
+                       diagnostic_cache_bytes=diagnostic_cache_bytes,
+                       isobaric_store_folder=path_config.WRF_ISOBARIC_FOLDER_PATH,
+                       logger=logger)
+
+
+class WrfOutManager:
+    """
+    Dataset of a single request, job or render worker. Managers are cheap, the open files live in the
+    dataset pool which is shared between them, see FlaskApp.wrf_manager.
+    """
+
+    def __init__(self, path_config: PathConfig, max_open_files: int = 4, max_open_bytes: Optional[int] = None,
+                 diagnostic_cache_bytes: Optional[int] = None, dataset_pool: Optional[DatasetPool] = None,
+                 logger: Logger = None) -> None:
         self.path_config = path_config
+        self.logger = logger
+        self.dataset_pool = dataset_pool or create_dataset_pool(path_config, max_open_files=max_open_files,
+                                                                max_open_bytes=max_open_bytes,
+                                                                diagnostic_cache_bytes=diagnostic_cache_bytes,
+                                                                logger=logger)
         self._dataset: Dataset = None
         self.data: WRFData = None
 
@@ -25,27 +55,55 @@ class WrfOutManager(metaclass=Singleton):
 
     def read_dataset(self, from_file: str) -> None:
         file_path = self.path_config.WRF_OUTPUT_FOLDER_PATH.joinpath(from_file)
+        self.close_dataset()
         try:
-            print('Creating dataset from file: ', file_path)
-            self._dataset = Dataset(file_path, mode='r')
-            self.data = WRFData(self._dataset)
+            # datasets stay open in the pool, reading the same file again is a dictionary lookup
+            self.data = self.dataset_pool.acquire(file_path, in_progress=is_in_progress(file_path))
+            self._dataset = self.data.ds
 
         except Exception as e:
             print(str(e))
 
     def close_dataset(self) -> bool:
-        success = False
-        try:
-            self._dataset.close()
-            self._dataset = None
-            self.data = None
-            self._current_time_idx = 0
-            self._time_map = None
-            success = True
-            print('Closed Dataset!')
-        except Exception as e:
-            print(f'Exception closing netCDF4 dataset.\n{e}')
-            return success
+        # the pool owns the netCDF4 handle, only give back the lease here
+        if self.data is not None:
+            self.dataset_pool.release(self.data)
+        self._dataset = None
+        self.data = None
+        self._current_time_idx = 0
+        self._time_map = None
+        return True
+
+    def file_exists(self, file_name: str) -> bool:
+        file_path = self.path_config.WRF_OUTPUT_FOLDER_PATH.joinpath(file_name)
+        return file_path.parent == self.path_config.WRF_OUTPUT_FOLDER_PATH and file_path.exists()
+
+    def get_file_modified_time(self, file_name: str) -> datetime:
+        file_path = self.path_config.WRF_OUTPUT_FOLDER_PATH.joinpath(file_name)
+        return datetime.fromtimestamp(os.stat(file_path).st_mtime, tz=timezone.utc)
+
+    def get_file_version(self, file_name: str) -> str:
+        file_path = self.path_config.WRF_OUTPUT_FOLDER_PATH.joinpath(file_name)
+        return str(os.stat(file_path).st_mtime_ns)
+
+    def is_file_in_progress(self, file_name: str) -> bool:
+        return is_in_progress(self.path_config.WRF_OUTPUT_FOLDER_PATH.joinpath(file_name))
+
+    def get_frame_version(self, file_name: str, timeidx: int) -> str:
+        """
+        Version of a single time step. Frames of a file wrf.exe is still writing do not change when the
+        next ones are appended, they keep their version while the file's mtime moves on.
+        """
+        file_path = self.path_config.WRF_OUTPUT_FOLDER_PATH.joinpath(file_name)
+        if is_in_progress(file_path):
+            return f"in-progress:{os.stat(file_path).st_ino}:{timeidx}"
+        return str(os.stat(file_path).st_mtime_ns)
+
+    def invalidate_files(self, file_paths: [Path]) -> None:
+        for file_path in file_paths:
+            closed = self.dataset_pool.invalidate(file_path)
+            if closed and self.logger is not None:
+                self.logger.info(f"Invalidated {closed} open dataset(s) for {file_path}")
 
     def extract_projection_and_bounds(self) -> {}:
         return {
@@ -55,9 +113,28 @@ class WrfOutManager(metaclass=Singleton):
             "x-limit": self.data.cartopy_xlim
         }
 
+    def get_domain_key(self) -> tuple:
+        # identical for every file and time step of the same domain configuration
+        return (self.data.map_proj, self.data.cen_lat, self.data.cen_lon, self.data.dx, self.data.dy,
+                self.data.x_grid_count, self.data.y_grid_count)
+
     def load_base_variables(self) -> None:
         self.data.load_base_variables()
 
+    def get_point_index(self) -> GridPointIndex:
+        def build() -> GridPointIndex:
+            self.load_base_variables()
+            lats, lons = self.get_latitudes_and_longitudes()
+            return GridPointIndex(lats, lons, grid_spacing_m=max(self.data.dx, self.data.dy))
+
+        return _point_indexes.get_or_create(self.get_domain_key(), build)
+
+    def get_meteogram(self, south_north: int, west_east: int):
+        return meteogram(self.data, south_north, west_east)
+
+    def get_soundings(self, points: List[Tuple[int, int]], timeidx: int = 0) -> list:
+        return soundings(self.data, points, timeidx)
+
     def get_figure_size(self) -> Tuple[float, float]:
         # TODO: calculate from x, y grid count and dx, dy
         x = self.data.x_grid_count
@@ -75,76 +152,42 @@ class WrfOutManager(metaclass=Singleton):
     def get_10m_winds(self, timeidx: int = 0):
         return self.data.surface_winds(timeidx=timeidx)
 
-    def get_winds(self, key: str, timeidx: int = 0):
-        if key == Constants.FIELD_KEY_GEO500:
-            ua, va = self.data.extract_variable("uvmet", units="km h-1", timeidx=timeidx)
-
-            u_500 = self.data.interpolate_to_pressure_level(ua, pressure_units="hPa", level_to_interpolate=500.,
-                                                            timeidx=timeidx)
-            v_500 = self.data.interpolate_to_pressure_level(va, pressure_units="hPa", level_to_interpolate=500.,
-                                                            timeidx=timeidx)
-            return wrf.to_np(u_500), wrf.to_np(v_500)
-        elif key == Constants.FIELD_KEY_WS300:
-            # ua = self.data.extract_variable("ua", units="km h-1", timeidx=timeidx)
-            ua, va = self.data.extract_variable("uvmet", units="km h-1", timeidx=timeidx)
-
-            u_300 = self.data.interpolate_to_pressure_level(ua, pressure_units="hPa", level_to_interpolate=300.,
-                                                            timeidx=timeidx)
-            v_300 = self.data.interpolate_to_pressure_level(va, pressure_units="hPa", level_to_interpolate=300.,
-                                                            timeidx=timeidx)
-            return wrf.to_np(u_300), wrf.to_np(v_300)
+    def get_isobaric_field(self, var_name: str, level: float, timeidx: int = 0) -> xr.DataArray:
+        # all upper air maps read from the same batch interpolated fields, see WRFData.isobaric_fields
+        return self.data.isobaric_fields(timeidx=timeidx)[var_name].sel(level=level)
 
-        elif key == Constants.FIELD_KEY_TEMP850:
-            ua = self.data.extract_variable("ua", units="km h-1", timeidx=timeidx)
-            va = self.data.extract_variable("va", units="km h-1", timeidx=timeidx)
-
-            u_850 = self.data.interpolate_to_pressure_level(ua, pressure_units="hPa", level_to_interpolate=850.,
-                                                            timeidx=timeidx)
-            v_850 = self.data.interpolate_to_pressure_level(va, pressure_units="hPa", level_to_interpolate=850.,
-                                                            timeidx=timeidx)
-            return wrf.to_np(u_850), wrf.to_np(v_850)
-
-        elif key == Constants.FIELD_KEY_RH700:
-            ua = self.data.extract_variable("ua", units="km h-1", timeidx=timeidx)
-            va = self.data.extract_variable("va", units="km h-1", timeidx=timeidx)
-
-            u_700 = self.data.interpolate_to_pressure_level(ua, pressure_units="hPa", level_to_interpolate=700.,
-                                                            timeidx=timeidx)
-            v_700 = self.data.interpolate_to_pressure_level(va, pressure_units="hPa", level_to_interpolate=700.,
-                                                            timeidx=timeidx)
-            return wrf.to_np(u_700), wrf.to_np(v_700)
+    def get_winds(self, key: str, timeidx: int = 0):
+        wind_levels = {
+            Constants.FIELD_KEY_GEO500: 500.,
+            Constants.FIELD_KEY_WS300: 300.,
+            Constants.FIELD_KEY_TEMP850: 850.,
+            Constants.FIELD_KEY_RH700: 700.,
+        }
+        if key in wind_levels:
+            level = wind_levels[key]
+            u_wind = self.get_isobaric_field("u", level=level, timeidx=timeidx)
+            v_wind = self.get_isobaric_field("v", level=level, timeidx=timeidx)
+            return wrf.to_np(u_wind), wrf.to_np(v_wind)
 
         else:
             return self.data.surface_winds(timeidx=timeidx)
 
     def get_contour_data(self, key: str, timeidx: int) -> Optional[CTVariable]:
         ct_var: CTVariable = Constants.get_contour_variable(key)
-        if key == Constants.FIELD_KEY_GEO500:
-            # extract 500 mb heights
-            height = self.data.extract_variable(var_name="z", units="dm", timeidx=timeidx)
-            contour_data = self.data.interpolate_to_pressure_level(height, level_to_interpolate=500.,
-                                                                   pressure_units="mb", timeidx=timeidx)
+        if key == Constants.FIELD_KEY_GEO500 or key == Constants.FIELD_KEY_THICKNESS:
+            # 500 mb heights in dm
+            contour_data = self.get_isobaric_field("z", level=500., timeidx=timeidx) / 10.
 
         elif key == Constants.FIELD_KEY_TEMP850:
-            temp = self.data.extract_variable(var_name="tc", timeidx=timeidx)
-            contour_data = self.data.interpolate_to_pressure_level(temp, level_to_interpolate=850., timeidx=timeidx)
+            contour_data = self.get_isobaric_field("tc", level=850., timeidx=timeidx)
 
         elif key == Constants.FIELD_KEY_RH700:
-            # extract 700 mb heights
-            height = self.data.extract_variable(var_name="z", units="m", timeidx=timeidx)
-            contour_data = self.data.interpolate_to_pressure_level(height, level_to_interpolate=700.,
-                                                                   pressure_units="hPa", timeidx=timeidx)
-
-        elif key == Constants.FIELD_KEY_THICKNESS:
-            # extract 500 mb heights
-            height = self.data.extract_variable(var_name="z", units="dm", timeidx=timeidx)
-            contour_data = self.data.interpolate_to_pressure_level(height, level_to_interpolate=500.,
-                                                                   pressure_units="mb", timeidx=timeidx)
+            # 700 mb heights in m
+            contour_data = self.get_isobaric_field("z", level=700., timeidx=timeidx)
 
         elif key == Constants.FIELD_KEY_RH850:
             rh = self.data.extract_variable("rh", timeidx=timeidx)
-            rh_850 = self.data.interpolate_to_pressure_level(rh, pressure_units="hPa", level_to_interpolate=850,
-                                                             timeidx=timeidx)
+            rh_850 = self.get_isobaric_field("rh", level=850., timeidx=timeidx)
             contour_data = rh_850.fillna(rh[0, :, :])
 
         else:
@@ -167,63 +210,39 @@ class WrfOutManager(metaclass=Singleton):
 
         elif key == Constants.FIELD_KEY_TEMP850:
             temp = self.data.extract_variable(var_name="tc", timeidx=timeidx)
-            p = self.data.extract_variable(var_name="p", units="hPa", timeidx=timeidx)
-            temp_850 = wrf.interplevel(temp, p, desiredlev=850.0)
+            temp_850 = self.get_isobaric_field("tc", level=850., timeidx=timeidx)
             xr_variable = temp_850.fillna(temp[0, :, :])
 
-        elif key == Constants.FIELD_KEY_THICKNESS or key == Constants.FIELD_KEY_GEO500:
-            height = self.data.extract_variable("z", timeidx=timeidx, units="dm")
-            terrain = self.data.extract_variable("ter", timeidx=timeidx, units="dm")
-
-            ht_500 = self.data.interpolate_to_pressure_level(height, pressure_units="hPa", level_to_interpolate=500,
-                                                             timeidx=timeidx)
-            ht_1000 = self.data.interpolate_to_pressure_level(height, pressure_units="hPa", level_to_interpolate=1000,
-                                                              timeidx=timeidx).fillna(0)
-            virtual_temp = self.data.extract_variable("tv", timeidx=timeidx, units="K").mean(dim="bottom_top")
-            Rd = 287.05  # Specific gas constant for dry air in J/kg·K
-            g = 9.81  # Acceleration due to gravity in m/s^2
-
-            delta_h = (Rd * virtual_temp / g) * math.log(1000 / 500)
-            # ht_1000 = ht_1000.fillna(terrain)
-            thickness_500 = ht_500 - ht_1000
-
-            if key == Constants.FIELD_KEY_GEO500:
-                # pvo_500 = self.data.interpolate_to_pressure_level(
-                #     self.data.extract_variable(var_name="pvo", timeidx=timeidx),
-                #     pressure_units="mb", level_to_interpolate=500.,
-                #     timeidx=timeidx)
-                xr_variable = self.data.interpolate_to_pressure_level(
-                    self.data.extract_variable(var_name="avo", timeidx=timeidx),
-                    pressure_units="mb", level_to_interpolate=500.,
-                    timeidx=timeidx)
-                #
-                # # RVO = PVO * thickess - AVO
-                #
-                # # Conversion factor for absolute vorticity to SI units (1e-5/s to 1/s)
-                # abs_vorticity_conversion = 1e-5
-                # avo_500_si = avo_500 * abs_vorticity_conversion
-                #
-                # # Convert potential vorticity from PVU to SI units (10^6 m^2 s^-1 K kg^-1 to 1/s)
-                # pv_conversion_factor = 1e-6
-                # pvo_500_si = pvo_500 * pv_conversion_factor
-                # xr_variable = pvo_500_si * thickness_500 - avo_500_si
-                # xr_variable = avo_500
-                # wspd = self.data.extract_variable("wspd_wdir", units="kts")[0, :]
-                # xr_variable = self.data.interpolate_to_pressure_level(wspd, pressure_units="mb",
-                #                                                       level_to_interpolate=500,
-                #                                                       timeidx=timeidx)
-
-            else:
-                xr_variable = thickness_500
+        elif key == Constants.FIELD_KEY_THICKNESS:
+            # heights in dm
+            ht_500 = self.get_isobaric_field("z", level=500., timeidx=timeidx) / 10.
+            ht_1000 = self.get_isobaric_field("z", level=1000., timeidx=timeidx).fillna(0) / 10.
+            xr_variable = ht_500 - ht_1000
+
+        elif key == Constants.FIELD_KEY_GEO500:
+            # pvo_500 = self.data.interpolate_to_pressure_level(
+            #     self.data.extract_variable(var_name="pvo", timeidx=timeidx),
+            #     pressure_units="hPa", level_to_interpolate=500.,
+            #     timeidx=timeidx)
+            xr_variable = self.get_isobaric_field("avo", level=500., timeidx=timeidx)
+            #
+            # # RVO = PVO * thickess - AVO
+            #
+            # # Conversion factor for absolute vorticity to SI units (1e-5/s to 1/s)
+            # abs_vorticity_conversion = 1e-5
+            # avo_500_si = avo_500 * abs_vorticity_conversion
+            #
+            # # Convert potential vorticity from PVU to SI units (10^6 m^2 s^-1 K kg^-1 to 1/s)
+            # pv_conversion_factor = 1e-6
+            # pvo_500_si = pvo_500 * pv_conversion_factor
+            # xr_variable = pvo_500_si * thickness_500 - avo_500_si
 
         elif key == Constants.FIELD_KEY_WS300:
-            wspd, wdir = self.data.extract_variable("uvmet_wspd_wdir", units="km h-1", timeidx=timeidx)
-            xr_variable = self.data.interpolate_to_pressure_level(wspd, pressure_units="hPa", level_to_interpolate=300,
-                                                                  timeidx=timeidx)
+            xr_variable = self.get_isobaric_field("wspd", level=300., timeidx=timeidx)
+
         elif key == Constants.FIELD_KEY_RH700:
             rh = self.data.extract_variable("rh", timeidx=timeidx)
-            rh_700 = self.data.interpolate_to_pressure_level(rh, pressure_units="hPa", level_to_interpolate=700,
-                                                                  timeidx=timeidx)
+            rh_700 = self.get_isobaric_field("rh", level=700., timeidx=timeidx)
             xr_variable = rh_700.fillna(rh[0, :, :])
         else:
             xr_variable = self.data.extract_variable(var_name=key, timeidx=timeidx)
@@ -238,6 +257,12 @@ class WrfOutManager(metaclass=Singleton):
     def extract_variables(self) -> dict:
         return self.data.built_in_variables()
 
+    def cache_stats(self) -> dict:
+        return {
+            "datasets": self.dataset_pool.stats,
+            "diagnostics": self.data.diagnostic_cache_stats if self.data is not None else None
+        }
+
     def summarize_dataset(self) -> dict:
         return self.data.raw_summary
 
@@ -1,14 +1,21 @@
 from flask import Flask
-from flask import render_template
+from flask import render_template, g
 from flask_session import Session
 
 from app.config import Config
 from app.path_config import PathConfig
-from app.WrfOutManager import WrfOutManager
+from app.WrfOutManager import WrfOutManager, create_dataset_pool
+from app.map.render_service import RenderService
+from library.cache.DatasetPool import DatasetPool
+from library.JobEngine import JobEngine
+from library.cache.RenderCache import RenderCache
 
 
 class FlaskApp(Flask):
-    wrf_manager: WrfOutManager
+    dataset_pool: DatasetPool
+    render_cache: RenderCache
+    render_service: RenderService
+    job_engine: JobEngine
 
     def __init__(self, *flask_args, **flask_kwargs) -> None:
         # noinspection PyArgumentList
@@ -20,9 +27,45 @@ class FlaskApp(Flask):
 
         _path_config: PathConfig = self.config.get("PATH_CONFIG")
         _path_config.create_folders(logger=self.logger)
-        self.wrf_manager = WrfOutManager(
-            path_config=_path_config
+        # open wrfouts shared by every request, each request reads them through its own wrf_manager
+        self.dataset_pool = create_dataset_pool(
+            _path_config,
+            max_open_files=self.config.get("WRFOUT_POOL_MAX_FILES"),
+            max_open_bytes=self.config.get("WRFOUT_POOL_MAX_BYTES"),
+            diagnostic_cache_bytes=self.config.get("WRFOUT_DIAGNOSTIC_CACHE_BYTES"),
+            logger=self.logger
         )
+        self.teardown_appcontext(self._release_wrf_manager)
+        self.render_cache = RenderCache(
+            folder=_path_config.RENDER_CACHE_FOLDER_PATH,
+            max_bytes=self.config.get("RENDER_CACHE_MAX_BYTES"),
+            logger=self.logger
+        )
+        self.render_service = RenderService(
+            path_config=_path_config,
+            render_cache=self.render_cache,
+            workers=self.config.get("RENDER_SERVICE_WORKERS"),
+            logger=self.logger
+        )
+        self.job_engine = JobEngine(
+            folder=_path_config.JOBS_FOLDER_PATH,
+            max_concurrent=self.config.get("JOB_MAX_CONCURRENT"),
+            logger=self.logger
+        )
+
+    @property
+    def wrf_manager(self) -> WrfOutManager:
+        """ WrfOutManager of the current app context (request, job or cli command). """
+        if "wrf_manager" not in g:
+            g.wrf_manager = WrfOutManager(path_config=self.config.get("PATH_CONFIG"), dataset_pool=self.dataset_pool,
+                                          logger=self.logger)
+        return g.wrf_manager
+
+    @staticmethod
+    def _release_wrf_manager(_) -> None:
+        wrf_manager = g.pop("wrf_manager", None)
+        if wrf_manager is not None:
+            wrf_manager.close_dataset()
 
 
 def create_flask_app() -> FlaskApp:
@@ -37,9 +80,9 @@ def create_flask_app() -> FlaskApp:
         return render_template('index.html')
 
     with app.app_context():
-        from app.run_wrf import run_wrf_bp, routes as _
+        from app.run_wrf import run_wrf_bp, jobs as _, routes as _
         from app.file_selection import file_selection_bp, routes as _
-        from app.map import map_bp, routes as _
+        from app.map import map_bp, routes as _, cli as _
 
     app.register_blueprint(run_wrf_bp)
     app.register_blueprint(file_selection_bp)
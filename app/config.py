@@ -7,6 +7,30 @@ _debug = os.environ.get('DEBUG', False)
 _host = os.environ.get('HOST', '127.0.0.1')
 _port = os.environ.get('PORT', '5000')
 _schema = os.environ.get("SCHEMA", "http")
+_max_open_wrfouts = os.environ.get("WRFOUT_POOL_MAX_FILES", "4")
+_max_open_wrfout_bytes = os.environ.get("WRFOUT_POOL_MAX_BYTES", str(8 * 1024 ** 3))  # 8 GB of wrfout files
+_diagnostic_cache_bytes = os.environ.get("WRFOUT_DIAGNOSTIC_CACHE_BYTES", str(512 * 1024 ** 2))  # per open file
+_postprocess_isobaric = os.environ.get("WRF_POSTPROCESS_ISOBARIC", "False")
+_render_cache_bytes = os.environ.get("RENDER_CACHE_MAX_BYTES", str(2 * 1024 ** 3))
+_render_workers = os.environ.get("RENDER_WORKERS", str(max(1, (os.cpu_count() or 2) // 2)))
+_render_service_workers = os.environ.get("RENDER_SERVICE_WORKERS", "2")
+_render_latency_budget = os.environ.get("RENDER_LATENCY_BUDGET_SECONDS", "8")
+_map_prefetch_steps = os.environ.get("MAP_PREFETCH_STEPS", "2")
+_render_after_run = os.environ.get("RENDER_AFTER_RUN", "False")
+_wrf_split_output = os.environ.get("WRF_SPLIT_OUTPUT", "False")
+_wrf_watch_output = os.environ.get("WRF_WATCH_OUTPUT", "True")
+_wrf_watch_seconds = os.environ.get("WRF_WATCH_POLL_SECONDS", "30")
+_wrf_watch_render_workers = os.environ.get("WRF_WATCH_RENDER_WORKERS", "1")
+_job_max_concurrent = os.environ.get("JOB_MAX_CONCURRENT", "1")
+_geogrid_cache_entries = os.environ.get("GEOGRID_CACHE_MAX_ENTRIES", "8")
+_wrf_omp_threads = os.environ.get("WRF_OMP_THREADS", "1")
+_gfs_base_url = os.environ.get("GFS_BASE_URL", "https://www.ftp.ncep.noaa.gov/data/nccf/com/gfs/prod")
+_gfs_download_workers = os.environ.get("GFS_DOWNLOAD_WORKERS", "4")
+_gfs_download_retries = os.environ.get("GFS_DOWNLOAD_RETRIES", "5")
+_gfs_resolution = os.environ.get("GFS_RESOLUTION", "1p00")
+_gfs_subset = os.environ.get("GFS_SUBSET", "False")
+_gfs_archive_bytes = os.environ.get("GFS_ARCHIVE_MAX_BYTES", str(20 * 1024 ** 3))
+_gfs_archive_days = os.environ.get("GFS_ARCHIVE_MAX_AGE_DAYS", "14")
 
 
 class Config:
@@ -21,3 +45,57 @@ class Config:
     SESSION_REFRESH_EACH_REQUEST = False
 
     PATH_CONFIG = PathConfig()
+
+    # open wrfout datasets kept in memory between requests
+    WRFOUT_POOL_MAX_FILES = int(_max_open_wrfouts)
+    WRFOUT_POOL_MAX_BYTES = int(_max_open_wrfout_bytes)
+    # memory ceiling of computed diagnostics (p, z, tv...) per open dataset
+    WRFOUT_DIAGNOSTIC_CACHE_BYTES = int(_diagnostic_cache_bytes)
+
+    # write upper air fields on standard pressure levels next to each new wrfout
+    WRF_POSTPROCESS_ISOBARIC = _postprocess_isobaric.lower() in ("1", "true", "yes")
+
+    # size cap of the rendered map images on disk
+    RENDER_CACHE_MAX_BYTES = int(_render_cache_bytes)
+    # processes of the batch renderer, `flask map render <wrfout>`
+    RENDER_WORKERS = int(_render_workers)
+    # processes drawing the maps asked for by the web pages
+    RENDER_SERVICE_WORKERS = int(_render_service_workers)
+    # an image request waits this long for its map, then answers 202 and the page polls for it
+    RENDER_LATENCY_BUDGET_SECONDS = float(_render_latency_budget)
+    # time steps before and after the viewed one rendered in the background, 0 disables
+    MAP_PREFETCH_STEPS = int(_map_prefetch_steps)
+    # render every time step and field of the new wrfouts when a run finishes
+    RENDER_AFTER_RUN = _render_after_run.lower() in ("1", "true", "yes")
+
+    # one wrfout per output time (frames_per_outfile = 1) in a run folder instead of one file for the whole run
+    WRF_SPLIT_OUTPUT = _wrf_split_output.lower() in ("1", "true", "yes")
+
+    # show wrfout files in the file selection while wrf.exe is still writing them
+    WRF_WATCH_OUTPUT = _wrf_watch_output.lower() in ("1", "true", "yes")
+    WRF_WATCH_POLL_SECONDS = float(_wrf_watch_seconds)
+    # render processes for the new time steps of a running model, they compete with wrf.exe for cores, 0 disables
+    WRF_WATCH_RENDER_WORKERS = int(_wrf_watch_render_workers)
+
+    # pipeline jobs running at the same time, runs share the WPS and WRF/run folders so keep it 1
+    # unless each job works in its own folders
+    JOB_MAX_CONCURRENT = int(_job_max_concurrent)
+
+    # geogrid outputs of this many distinct domains are kept
+    GEOGRID_CACHE_MAX_ENTRIES = int(_geogrid_cache_entries)
+
+    # OpenMP threads per MPI process, only for WRF builds configured with dm+sm
+    WRF_OMP_THREADS = int(_wrf_omp_threads)
+
+    # gfs source, can point to a mirror or a local http server with the nomads folder layout
+    GFS_BASE_URL = _gfs_base_url
+    # parallel gfs file downloads, the nomads server limits connections per ip
+    GFS_DOWNLOAD_WORKERS = int(_gfs_download_workers)
+    GFS_DOWNLOAD_RETRIES = int(_gfs_download_retries)
+    # 1p00, 0p50 or 0p25
+    GFS_RESOLUTION = _gfs_resolution
+    # fetch only the records of Vtable.GFS with byte range requests instead of whole files
+    GFS_SUBSET = _gfs_subset.lower() in ("1", "true", "yes")
+    # downloaded gfs files kept in GFS_BACKUP_FOLDER for later runs
+    GFS_ARCHIVE_MAX_BYTES = int(_gfs_archive_bytes)
+    GFS_ARCHIVE_MAX_AGE_DAYS = float(_gfs_archive_days)
@@ -1,4 +1,5 @@
 import os
+from pathlib import Path
 
 from flask import current_app
 from flask_wtf import FlaskForm
@@ -7,6 +8,7 @@ from wtforms.validators import DataRequired
 
 from app import FlaskApp
 from app.path_config import PathConfig
+from library.WrfOutWatcher import is_in_progress
 
 current_app: FlaskApp = current_app
 path_config: PathConfig = current_app.config.get("PATH_CONFIG")
@@ -22,7 +24,22 @@ class SelectFileForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        available_files = os.listdir(path_config.WRF_OUTPUT_FOLDER_PATH)
-        self.selected_file.choices = sorted(available_files)
-        self.selected_file_select_field.choices = sorted(available_files)
+        # hidden names are links and files being replaced
+        available_files = sorted(name for name in os.listdir(path_config.WRF_OUTPUT_FOLDER_PATH)
+                                 if not name.startswith("."))
+        choices = [(file_name, self._label(path_config.WRF_OUTPUT_FOLDER_PATH.joinpath(file_name)))
+                   for file_name in available_files]
+        self.selected_file.choices = choices
+        self.selected_file_select_field.choices = choices
 
+
+    @staticmethod
+    def _label(path: Path) -> str:
+        label = path.name
+        if path.is_dir():
+            # run folder of per-time files, see library.models.WrfOutRun
+            label += f" ({len(os.listdir(path))} dosya)"
+        # files of a running model, see library.WrfOutWatcher
+        if is_in_progress(path):
+            label += " (model çalışıyor)"
+        return label
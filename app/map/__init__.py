@@ -5,6 +5,7 @@ map_bp = Blueprint(
     import_name=__name__,
     template_folder="templates",
     static_folder="static",
-    url_prefix="/map"
+    url_prefix="/map",
+    cli_group="map"
 )
 
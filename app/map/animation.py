@@ -0,0 +1,151 @@
+import shutil
+import subprocess
+from pathlib import Path
+from logging import Logger
+from typing import Optional, List, Tuple
+
+from PIL import Image
+
+from app.WrfOutManager import WrfOutManager
+from app.map.batch import render_wrfout
+from app.map.models import MapRenderRequest
+from app.map.renderer import render_cache_key
+from library.cache.RenderCache import RenderCache
+
+ANIMATION_MIMETYPES = {"gif": "image/gif", "webp": "image/webp", "mp4": "video/mp4"}
+MIN_FPS = 1
+MAX_FPS = 30
+
+
+def select_time_indexes(time_count: int, start: int = 0, end: Optional[int] = None, stride: int = 1) -> List[int]:
+    return list(range(time_count))[start:end:max(1, stride)]
+
+
+def animation_frames(file_name: str, field: str, wrf_manager: WrfOutManager, render_cache: RenderCache,
+                     fmt: str = "gif", start: int = 0, end: Optional[int] = None, stride: int = 1, fps: int = 2,
+                     should_plot_slp: bool = True, should_plot_wind: bool = True
+                     ) -> Tuple[str, List[Tuple[MapRenderRequest, str]]]:
+    """ Cache key of the animation and the (render request, cache key) of each of its frames. """
+    if fmt not in ANIMATION_MIMETYPES:
+        raise ValueError(f"Unsupported animation format: {fmt}")
+    if not MIN_FPS <= fps <= MAX_FPS:
+        raise ValueError(f"fps must be between {MIN_FPS} and {MAX_FPS}.")
+
+    wrf_manager.read_dataset(file_name)
+    try:
+        timeidxs = select_time_indexes(len(wrf_manager.data.available_times), start=start, end=end, stride=stride)
+        if not timeidxs:
+            raise ValueError(f"No time steps selected from {file_name} with {start=} {end=} {stride=}")
+
+        source_path = wrf_manager.path_config.WRF_OUTPUT_FOLDER_PATH.joinpath(file_name)
+        animation_key = render_cache.key_for(
+            source_path, animation=field, timeidxs=tuple(timeidxs), fps=fps,
+            should_plot_slp=should_plot_slp, should_plot_wind=should_plot_wind,
+            figure_size=wrf_manager.get_figure_size()
+        )
+        frames = []
+        for timeidx in timeidxs:
+            render_request = MapRenderRequest(file_name=file_name, timeidx=timeidx, colour_fill_data=field,
+                                              should_plot_slp=should_plot_slp, should_plot_wind=should_plot_wind)
+            frames.append((render_request, render_cache_key(render_cache, wrf_manager, render_request)))
+    finally:
+        wrf_manager.close_dataset()
+    return animation_key, frames
+
+
+def export_animation(file_name: str, field: str, wrf_manager: WrfOutManager, render_cache: RenderCache,
+                     fmt: str = "gif", start: int = 0, end: Optional[int] = None, stride: int = 1, fps: int = 2,
+                     should_plot_slp: bool = True, should_plot_wind: bool = True, workers: Optional[int] = None,
+                     logger: Logger = None) -> Path:
+    """
+    Animation of one field over the time steps of a wrfout, cached next to the rendered frames.
+
+    Missing frames are rendered in parallel by the batch renderer (each worker keeps its base map and
+    only swaps the data layers), frames are then read back from the cache one by one while encoding.
+    The web app renders the frames on its render service instead, see map.routes.animation.
+    """
+    animation_key, frames = animation_frames(
+        file_name, field, wrf_manager, render_cache, fmt=fmt, start=start, end=end, stride=stride, fps=fps,
+        should_plot_slp=should_plot_slp, should_plot_wind=should_plot_wind
+    )
+    animation_path = render_cache.get(animation_key, fmt=fmt)
+    if animation_path is not None:
+        return animation_path
+
+    render_wrfout(file_name, wrf_manager=wrf_manager, render_cache=render_cache, workers=workers,
+                  fields=[field], timeidxs=[render_request.timeidx for render_request, _ in frames],
+                  should_plot_slp=should_plot_slp, should_plot_wind=should_plot_wind, logger=logger)
+
+    frame_paths = []
+    for render_request, frame_key in frames:
+        frame_path = render_cache.get(frame_key)
+        if frame_path is None:
+            raise RuntimeError(f"Frame {render_request.timeidx} of {file_name} {field} could not be rendered.")
+        frame_paths.append(frame_path)
+    return encode_animation(animation_key, frame_paths, render_cache, fmt=fmt, fps=fps)
+
+
+def encode_animation(animation_key: str, frame_paths: List[Path], render_cache: RenderCache, fmt: str = "gif",
+                     fps: int = 2) -> Path:
+    """ Encodes rendered frames into the render cache under animation_key. """
+    tmp_path = render_cache.temporary_path_for(animation_key, fmt=fmt)
+    try:
+        if shutil.which("ffmpeg") is not None:
+            _encode_with_ffmpeg(frame_paths, tmp_path, fmt=fmt, fps=fps)
+        elif fmt == "mp4":
+            raise RuntimeError("ffmpeg is required for mp4 animations.")
+        else:
+            _encode_with_pillow(frame_paths, tmp_path, fmt=fmt, fps=fps)
+    except Exception:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+
+    return render_cache.put_file(animation_key, tmp_path, fmt=fmt)
+
+
+def _encode_with_pillow(frame_paths: List[Path], target_path: Path, fmt: str, fps: int) -> None:
+    # Image.open only reads the header, pixels are decoded when the encoder reaches the frame.
+    # Pillow still holds on to decoded frames until the file is written, ffmpeg is preferred when available.
+    frames = [Image.open(frame_path) for frame_path in frame_paths]
+    try:
+        frames[0].save(
+            target_path, format=fmt.upper(), save_all=True, append_images=frames[1:],
+            duration=int(1000 / fps), loop=0
+        )
+    finally:
+        for frame in frames:
+            frame.close()
+
+
+def _encode_with_ffmpeg(frame_paths: List[Path], target_path: Path, fmt: str, fps: int) -> None:
+    """
+    Frames are piped to ffmpeg one file at a time, this process never holds more than one frame.
+    """
+    output_args = {
+        # yuv420p needs even dimensions
+        "mp4": ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2"],
+        "gif": ["-filter_complex", "split[frames][copy];[copy]palettegen[palette];[frames][palette]paletteuse",
+                "-loop", "0"],
+        "webp": ["-c:v", "libwebp_anim", "-lossless", "0", "-loop", "0"],
+    }[fmt]
+
+    process = subprocess.Popen([
+        shutil.which("ffmpeg"), "-y", "-loglevel", "error",
+        "-f", "image2pipe", "-framerate", str(fps), "-i", "-",
+        *output_args,
+        "-f", fmt, target_path.as_posix()
+    ], stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    try:
+        for frame_path in frame_paths:
+            with open(frame_path, "rb") as frame_file:
+                shutil.copyfileobj(frame_file, process.stdin)
+        process.stdin.close()
+    except BrokenPipeError:
+        pass
+    # -loglevel error keeps stderr small, reading it after the frames can not dead lock
+    stderr = process.stderr.read()
+    process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed encoding {target_path.name}: {stderr.decode('utf-8')}")
@@ -0,0 +1,123 @@
+import os
+import logging
+import time
+import multiprocessing
+from logging import Logger
+from typing import Optional, List, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import app.map.constants as Constants
+
+from app.path_config import PathConfig
+from app.WrfOutManager import WrfOutManager
+from app.map.models import MapRenderRequest
+from app.map.renderer import get_or_render_map, render_cache_key
+from library.cache.RenderCache import RenderCache
+from library.plotting.CartopyMPLPlotter import CartopyMplPlotter
+
+_logger = logging.getLogger(__name__)
+
+# state of a render worker process, matplotlib figures are not shared between processes
+_worker: dict = {}
+
+
+def default_worker_count() -> int:
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def init_render_worker(path_config: PathConfig, render_cache_folder: str, render_cache_bytes: int,
+                       max_open_files: int = 2) -> None:
+    wrf_manager = WrfOutManager(path_config=path_config, max_open_files=max_open_files)
+    _worker["wrf_manager"] = wrf_manager
+    _worker["plotter"] = CartopyMplPlotter(wrf_data_manager=wrf_manager)
+    _worker["render_cache"] = RenderCache(folder=render_cache_folder, max_bytes=render_cache_bytes)
+
+
+def render_in_worker(render_requests: List[MapRenderRequest], fmt: str = "png") -> List[Tuple[MapRenderRequest, float]]:
+    """
+    Renders the requests into the render cache, requests of the same time step should be sent together
+    so they share the diagnostics of the worker's dataset.
+    """
+    wrf_manager: WrfOutManager = _worker["wrf_manager"]
+    timings = []
+    for render_request in render_requests:
+        st = time.perf_counter()
+        wrf_manager.read_dataset(render_request.file_name)
+        get_or_render_map(_worker["render_cache"], wrf_manager, _worker["plotter"], render_request, fmt=fmt)
+        wrf_manager.close_dataset()
+        timings.append((render_request, time.perf_counter() - st))
+    return timings
+
+
+def create_render_pool(path_config: PathConfig, render_cache: RenderCache, workers: int) -> ProcessPoolExecutor:
+    # spawn instead of fork, forked children would share the parent's open netCDF/HDF5 handles
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_render_worker,
+        initargs=(path_config, str(render_cache.folder), render_cache.max_bytes)
+    )
+
+
+def render_wrfout(file_name: str, wrf_manager: WrfOutManager, render_cache: RenderCache,
+                  workers: Optional[int] = None, fields: Optional[List[str]] = None,
+                  timeidxs: Optional[List[int]] = None, should_plot_slp: bool = True, should_plot_wind: bool = True,
+                  fmt: str = "png", logger: Logger = None) -> dict:
+    """
+    Renders every (time step, field) image of a wrfout into the render cache with a process pool.
+    Images already in the cache are skipped, an interrupted batch continues where it stopped.
+    """
+    workers = workers or default_worker_count()
+    fields = fields or list(Constants.SURFACE_PLOT_VARIABLES.keys())
+
+    wrf_manager.read_dataset(file_name)
+    if timeidxs is None:
+        timeidxs = [timeidx for timeidx, _ in wrf_manager.data.available_times]
+
+    pending = {}
+    skipped = 0
+    for timeidx in timeidxs:
+        for field in fields:
+            render_request = MapRenderRequest(
+                file_name=file_name, timeidx=timeidx, colour_fill_data=field,
+                should_plot_slp=should_plot_slp, should_plot_wind=should_plot_wind
+            )
+            key = render_cache_key(render_cache, wrf_manager, render_request, fmt=fmt)
+            if render_cache.get(key, fmt=fmt) is not None:
+                skipped += 1
+                continue
+            pending.setdefault(timeidx, []).append(render_request)
+    wrf_manager.close_dataset()
+
+    _log(logger, f"Rendering {sum(len(group) for group in pending.values())} frames of {file_name} "
+                 f"with {workers} workers, {skipped} already rendered.")
+
+    st = time.perf_counter()
+    timings = []
+    failed = []
+    if pending:
+        with create_render_pool(wrf_manager.path_config, render_cache, workers) as pool:
+            futures = {pool.submit(render_in_worker, group, fmt): group for group in pending.values()}
+            for future in as_completed(futures):
+                try:
+                    for render_request, seconds in future.result():
+                        timings.append((render_request, seconds))
+                        _log(logger, f"Rendered {render_request.colour_fill_data} t={render_request.timeidx} "
+                                     f"in {seconds:.2f}s")
+                except Exception as e:
+                    failed.extend(futures[future])
+                    _log(logger, f"Exception occurred rendering {file_name}, details:\n{e}")
+
+    elapsed = time.perf_counter() - st
+    _log(logger, f"Rendered {len(timings)} frames of {file_name} in {elapsed:.1f}s, {len(failed)} failed.")
+    return {
+        "rendered": len(timings),
+        "skipped": skipped,
+        "failed": len(failed),
+        "elapsed_seconds": elapsed,
+        "frame_seconds": [seconds for _, seconds in timings]
+    }
+
+
+def _log(logger: Optional[Logger], message: str) -> None:
+    (logger or _logger).info(message)
@@ -0,0 +1,61 @@
+import shutil
+
+import click
+
+from flask import current_app
+
+from app import FlaskApp
+from app.map import map_bp
+from app.map.batch import render_wrfout
+from app.map.animation import export_animation, ANIMATION_MIMETYPES
+
+current_app: FlaskApp
+
+
+@map_bp.cli.command("render")
+@click.argument("file_name")
+@click.option("--workers", type=int, default=None, help="Render processes, defaults to RENDER_WORKERS.")
+@click.option("--field", "fields", multiple=True, help="Fields to render, all surface plot fields by default.")
+@click.option("--no-slp", is_flag=True, default=False, help="Do not draw sea level pressure contours.")
+@click.option("--no-wind", is_flag=True, default=False, help="Do not draw wind barbs.")
+@click.option("--format", "fmt", type=click.Choice(["png", "webp"]), default="png")
+def render(file_name: str, workers: int, fields: tuple, no_slp: bool, no_wind: bool, fmt: str) -> None:
+    """ Render every time step and field of FILE_NAME into the map image cache. """
+    result = render_wrfout(
+        file_name,
+        wrf_manager=current_app.wrf_manager,
+        render_cache=current_app.render_cache,
+        workers=workers or current_app.config.get("RENDER_WORKERS"),
+        fields=list(fields) or None,
+        should_plot_slp=not no_slp,
+        should_plot_wind=not no_wind,
+        fmt=fmt
+    )
+    click.echo(f"rendered: {result['rendered']} skipped: {result['skipped']} failed: {result['failed']} "
+               f"in {result['elapsed_seconds']:.1f}s")
+
+
+@map_bp.cli.command("animate")
+@click.argument("file_name")
+@click.argument("field")
+@click.option("--format", "fmt", type=click.Choice(list(ANIMATION_MIMETYPES)), default="gif")
+@click.option("--start", type=int, default=0, help="First time index.")
+@click.option("--end", type=int, default=None, help="Time index to stop before, all time steps by default.")
+@click.option("--stride", type=int, default=1, help="Use every n-th time step.")
+@click.option("--fps", type=int, default=2)
+@click.option("--workers", type=int, default=None, help="Render processes, defaults to RENDER_WORKERS.")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="Copy the animation to this path.")
+def animate(file_name: str, field: str, fmt: str, start: int, end: int, stride: int, fps: int, workers: int,
+            output: str) -> None:
+    """ Animate FIELD over the time steps of FILE_NAME. """
+    animation_path = export_animation(
+        file_name, field,
+        wrf_manager=current_app.wrf_manager,
+        render_cache=current_app.render_cache,
+        fmt=fmt, start=start, end=end, stride=stride, fps=fps,
+        workers=workers or current_app.config.get("RENDER_WORKERS")
+    )
+    if output:
+        shutil.copyfile(animation_path, output)
+        animation_path = output
+    click.echo(f"animation: {animation_path}")
@@ -1,3 +1,5 @@
+from copy import copy
+
 from .models import CTFVariable, CTVariable, Cmap
 
 from library.plotting.nclcmaps import get_ncl_cmap
@@ -175,8 +177,11 @@ SURFACE_PLOT_VARIABLES = {
 
 
 def get_contourf_variable(key: str) -> CTFVariable:
-    return SURFACE_PLOT_VARIABLES.get(key)
+    # callers fill in data_to_plot, every request gets its own copy of the definition
+    variable = SURFACE_PLOT_VARIABLES.get(key)
+    return copy(variable) if variable is not None else None
 
 
 def get_contour_variable(key: str) -> CTVariable:
-    return CONTOUR_VARIABLES.get(key)
+    variable = CONTOUR_VARIABLES.get(key)
+    return copy(variable) if variable is not None else None
@@ -89,3 +89,12 @@ class CTFVariable:
             return np.arange(self.cmap.vmin, self.cmap.vmax + 1, self.cmap.interval)
         else:
             return self.cmap.bounds
+
+
+@dataclass(frozen=True)
+class MapRenderRequest:
+    file_name: str
+    timeidx: int
+    colour_fill_data: str
+    should_plot_slp: bool = True
+    should_plot_wind: bool = True
@@ -0,0 +1,25 @@
+import io
+import csv
+import math
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+
+
+def json_values(values: np.ndarray) -> list:
+    """ Plain floats for jsonify, NaN (below ground, missing) becomes null. """
+    return [None if math.isnan(value) else round(value, 3) for value in np.asarray(values, dtype=float).tolist()]
+
+
+def meteogram_csv(times: List[datetime], series: Dict[str, np.ndarray]) -> str:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["time"] + list(series))
+    for timeidx, time in enumerate(times):
+        writer.writerow([time.isoformat()] + [_csv_value(values[timeidx]) for values in series.values()])
+    return output.getvalue()
+
+
+def _csv_value(value: float) -> str:
+    return "" if math.isnan(value) else f"{value:.3f}"
@@ -0,0 +1,67 @@
+import threading
+from typing import List
+
+from app.WrfOutManager import WrfOutManager
+from app.map.models import MapRenderRequest
+from app.map.renderer import render_cache_key
+from app.map.render_service import RenderService, PRIORITY_BACKGROUND
+from library.cache.LRUCache import LRUCache
+
+
+def adjacent_time_indexes(timeidx: int, time_count: int, steps: int) -> List[int]:
+    """ t+1..t+steps first, viewers mostly step forward, then t-1..t-steps. """
+    forward = [timeidx + step for step in range(1, steps + 1)]
+    backward = [timeidx - step for step in range(1, steps + 1)]
+    return [idx for idx in forward + backward if 0 <= idx < time_count]
+
+
+class Prefetcher:
+    """
+    Queues the images of the time steps next to the one a viewer looks at as background renders.
+
+    Each viewer (browser session) has one set of prefetched keys for its file and field. Switching to
+    another file or field cancels the renders of the previous set that did not start yet.
+    """
+
+    def __init__(self, render_service: RenderService, steps: int = 2, max_viewers: int = 256) -> None:
+        self.render_service = render_service
+        self.steps = steps
+        self._lock = threading.Lock()
+        self._viewers = LRUCache(max_items=max_viewers)  # viewer id -> ((file name, field), [keys])
+
+    def prefetch(self, viewer_id: str, wrf_manager: WrfOutManager, render_request: MapRenderRequest,
+                 fmt: str = "png") -> int:
+        """ wrf_manager must have the dataset of the request loaded. Returns the renders queued. """
+        if self.steps <= 0:
+            return 0
+
+        target = (render_request.file_name, render_request.colour_fill_data)
+        with self._lock:
+            previous_target, keys = self._viewers.get(viewer_id, (None, []))
+            if previous_target != target:
+                for key in keys:
+                    self.render_service.cancel(key)
+                keys = []
+
+            queued = 0
+            for timeidx in adjacent_time_indexes(render_request.timeidx, len(wrf_manager.data.available_times),
+                                                 self.steps):
+                adjacent_request = MapRenderRequest(
+                    file_name=render_request.file_name, timeidx=timeidx,
+                    colour_fill_data=render_request.colour_fill_data,
+                    should_plot_slp=render_request.should_plot_slp,
+                    should_plot_wind=render_request.should_plot_wind
+                )
+                key = render_cache_key(self.render_service.render_cache, wrf_manager, adjacent_request, fmt=fmt)
+                if key in keys or self.render_service.render_cache.get(key, fmt=fmt) is not None:
+                    continue
+                self.render_service.submit(adjacent_request, key, fmt=fmt, priority=PRIORITY_BACKGROUND)
+                keys.append(key)
+                queued += 1
+
+            self._viewers.put(viewer_id, (target, self._pending(keys)))
+        return queued
+
+    def _pending(self, keys: List[str]) -> List[str]:
+        # finished renders need no cancelling, keeps the list short while a viewer steps through a file
+        return [key for key in keys if self.render_service.is_pending(key)]
@@ -0,0 +1,208 @@
+import heapq
+import time
+import atexit
+import itertools
+import threading
+from pathlib import Path
+from logging import Logger
+from collections import deque
+from typing import Dict, Optional
+from concurrent.futures import Future, CancelledError, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from app.path_config import PathConfig
+from app.map.batch import create_render_pool, render_in_worker
+from app.map.models import MapRenderRequest
+from library.cache.RenderCache import RenderCache
+
+# lower runs first
+PRIORITY_INTERACTIVE = 0
+# frames of an animation someone waits for, single map images still go first
+PRIORITY_ANIMATION = 5
+PRIORITY_BACKGROUND = 10
+
+
+class _RenderTask:
+
+    def __init__(self, key: str, render_request: MapRenderRequest, fmt: str, priority: int) -> None:
+        self.key = key
+        self.render_request = render_request
+        self.fmt = fmt
+        self.priority = priority
+        self.future = Future()
+        self.submitted = time.monotonic()
+        self.started: Optional[float] = None
+        self.waiters = 1
+
+
+class RenderService:
+    """
+    Renders map images in a process pool shared by every request thread.
+
+    Requests for the same cache key while it is queued or rendering wait on the same future instead of
+    drawing the map again. Tasks wait in a priority queue and are handed to the pool only when a worker
+    is free, so a burst of requests never blocks request threads on CPU bound plotting and interactive
+    requests overtake queued background work. Futures resolve to the image path in the render cache.
+    """
+
+    def __init__(self, path_config: PathConfig, render_cache: RenderCache, workers: int = 2,
+                 logger: Logger = None) -> None:
+        self.path_config = path_config
+        self.render_cache = render_cache
+        self.workers = max(1, workers)
+        self.logger = logger
+
+        self._pool = None
+        self._condition = threading.Condition()
+        self._queue = []  # (priority, sequence, task)
+        self._sequence = itertools.count()
+        self._in_flight: Dict[str, _RenderTask] = {}
+        self._running = 0
+        self._dispatcher: Optional[threading.Thread] = None
+        self._stopped = False
+
+        self._counts = {"submitted": 0, "coalesced": 0, "rendered": 0, "failed": 0, "cancelled": 0}
+        self._wait_seconds = deque(maxlen=200)
+        self._render_seconds = deque(maxlen=200)
+
+    def submit(self, render_request: MapRenderRequest, key: str, fmt: str = "png",
+               priority: int = PRIORITY_INTERACTIVE) -> Future:
+        with self._condition:
+            self._start()
+            task = self._in_flight.get(key)
+            if task is not None:
+                task.waiters += 1
+                self._counts["coalesced"] += 1
+                if priority < task.priority and task.started is None:
+                    # someone is now waiting for a prefetched image, move it up the queue
+                    task.priority = priority
+                    heapq.heappush(self._queue, (priority, next(self._sequence), task))
+                return task.future
+
+            task = _RenderTask(key, render_request, fmt, priority)
+            self._in_flight[key] = task
+            self._counts["submitted"] += 1
+            heapq.heappush(self._queue, (priority, next(self._sequence), task))
+            self._condition.notify_all()
+            return task.future
+
+    def cancel(self, key: str) -> bool:
+        """ Drops a queued task when nobody else waits for it, running renders are not interrupted. """
+        with self._condition:
+            task = self._in_flight.get(key)
+            if task is None or task.started is not None:
+                return False
+            task.waiters -= 1
+            if task.waiters > 0:
+                return False
+            del self._in_flight[key]
+            self._counts["cancelled"] += 1
+            return task.future.cancel()
+
+    def render(self, render_request: MapRenderRequest, key: str, fmt: str = "png",
+               timeout: Optional[float] = None) -> Optional[Path]:
+        """ Image path once rendered, None if it is not done within timeout. Render errors are raised. """
+        image_path = self.render_cache.get(key, fmt=fmt)
+        if image_path is not None:
+            return image_path
+        future = self.submit(render_request, key, fmt=fmt)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            return None
+
+    def is_pending(self, key: str) -> bool:
+        with self._condition:
+            return key in self._in_flight
+
+    @property
+    def metrics(self) -> dict:
+        with self._condition:
+            waits = sorted(self._wait_seconds)
+            renders = sorted(self._render_seconds)
+            return {
+                **self._counts,
+                "workers": self.workers,
+                "queue_depth": len(self._in_flight) - self._running,
+                "running": self._running,
+                "wait_seconds_mean": sum(waits) / len(waits) if waits else None,
+                "wait_seconds_p95": waits[int(.95 * (len(waits) - 1))] if waits else None,
+                "render_seconds_mean": sum(renders) / len(renders) if renders else None,
+                "render_seconds_p95": renders[int(.95 * (len(renders) - 1))] if renders else None,
+            }
+
+    def shutdown(self) -> None:
+        with self._condition:
+            self._stopped = True
+            for task in self._in_flight.values():
+                task.future.cancel()
+            self._condition.notify_all()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _start(self) -> None:
+        # the pool spawns its processes on first use, the app also starts for cli commands
+        if self._dispatcher is not None:
+            return
+        self._pool = create_render_pool(self.path_config, self.render_cache, self.workers)
+        self._dispatcher = threading.Thread(target=self._dispatch, name="render-dispatcher", daemon=True)
+        self._dispatcher.start()
+        atexit.register(self.shutdown)
+
+    def _dispatch(self) -> None:
+        while True:
+            with self._condition:
+                task = self._next_task()
+                while task is None and not self._stopped:
+                    self._condition.wait()
+                    task = self._next_task()
+                if self._stopped:
+                    return
+                task.started = time.monotonic()
+                self._running += 1
+                self._wait_seconds.append(task.started - task.submitted)
+
+            task.future.set_running_or_notify_cancel()
+            try:
+                pool_future = self._pool.submit(render_in_worker, [task.render_request], task.fmt)
+            except BrokenProcessPool:
+                # a worker died (out of memory...), the pool refuses new work from then on
+                self._log("Render pool is broken, starting a new one.")
+                self._pool = create_render_pool(self.path_config, self.render_cache, self.workers)
+                pool_future = self._pool.submit(render_in_worker, [task.render_request], task.fmt)
+            pool_future.add_done_callback(lambda done, task=task: self._finish(task, done))
+
+    def _next_task(self) -> Optional[_RenderTask]:
+        """ Highest priority task still waiting, called with the condition held. """
+        if self._running >= self.workers:
+            return None
+        while self._queue:
+            priority, _, task = heapq.heappop(self._queue)
+            # entries of cancelled, started or reprioritised tasks are left in the heap
+            if task.future.cancelled() or task.started is not None or priority != task.priority:
+                continue
+            return task
+        return None
+
+    def _finish(self, task: _RenderTask, pool_future: Future) -> None:
+        error = CancelledError() if pool_future.cancelled() else pool_future.exception()
+        with self._condition:
+            self._running -= 1
+            self._in_flight.pop(task.key, None)
+            self._render_seconds.append(time.monotonic() - task.started)
+            self._counts["failed" if error else "rendered"] += 1
+            self._condition.notify_all()
+
+        if error is not None:
+            self._log(f"Exception occurred rendering {task.render_request}, details: \n{error}")
+            task.future.set_exception(error)
+            return
+        image_path = self.render_cache.get(task.key, fmt=task.fmt)
+        if image_path is None:
+            task.future.set_exception(RuntimeError(f"{task.render_request} was rendered but is not in the cache."))
+        else:
+            task.future.set_result(image_path)
+
+    def _log(self, message: str) -> None:
+        if self.logger is not None:
+            self.logger.warning(message)
@@ -0,0 +1,104 @@
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import app.map.constants as Constants
+
+from app.WrfOutManager import WrfOutManager
+from app.map.models import MapRenderRequest
+from library.cache.RenderCache import RenderCache
+from library.plotting.CartopyMPLPlotter import CartopyMplPlotter
+
+
+logger = logging.getLogger(__name__)
+
+_thread_state = threading.local()
+
+
+def thread_plotter(wrf_manager: WrfOutManager) -> CartopyMplPlotter:
+    """
+    Plotter of the calling thread, a figure must never be drawn by two requests at once. It keeps its
+    base map between the requests served by the thread.
+    """
+    plotter = getattr(_thread_state, "plotter", None)
+    if plotter is None:
+        plotter = _thread_state.plotter = CartopyMplPlotter(wrf_data_manager=wrf_manager)
+    plotter.data_manager = wrf_manager
+    return plotter
+
+
+def render_cache_key(render_cache: RenderCache, wrf_manager: WrfOutManager, render_request: MapRenderRequest,
+                     fmt: str = "png") -> str:
+    source_path = wrf_manager.path_config.WRF_OUTPUT_FOLDER_PATH.joinpath(render_request.file_name)
+    return render_cache.key_for(
+        source_path,
+        version=wrf_manager.get_frame_version(render_request.file_name, render_request.timeidx),
+        timeidx=render_request.timeidx,
+        colour_fill_data=render_request.colour_fill_data,
+        should_plot_slp=render_request.should_plot_slp,
+        should_plot_wind=render_request.should_plot_wind,
+        figure_size=wrf_manager.get_figure_size(),
+        fmt=fmt
+    )
+
+
+def get_or_render_map(render_cache: RenderCache, wrf_manager: WrfOutManager, plotter: CartopyMplPlotter,
+                      render_request: MapRenderRequest, fmt: str = "png") -> Path:
+    """
+    Path of the rendered image in the cache, renders it first when it is not there.
+    wrf_manager must have the dataset of the request loaded.
+    """
+    key = render_cache_key(render_cache, wrf_manager, render_request, fmt=fmt)
+    image_path = render_cache.get(key, fmt=fmt)
+    if image_path is not None:
+        return image_path
+
+    image = render_map(wrf_manager, plotter, render_request, fmt=fmt)
+    return render_cache.put(key, image, fmt=fmt)
+
+
+def render_map(wrf_manager: WrfOutManager, plotter: CartopyMplPlotter, render_request: MapRenderRequest,
+               fmt: str = "png") -> bytes:
+    colour_fill_data = render_request.colour_fill_data
+    selected_time = render_request.timeidx
+
+    wrf_manager.load_base_variables()
+
+    st = datetime.utcnow()
+    logger.debug("Creating Figure...")
+
+    plotter.create_figure()
+    plotter.generate_figure_title(timeidx=selected_time)
+
+    # TODO: provide an interface for contour customization
+    if render_request.should_plot_slp and (colour_fill_data != Constants.FIELD_KEY_SLP):
+        if colour_fill_data == Constants.FIELD_KEY_GEO500:
+            plotter.plot_contour(data_key=colour_fill_data, time_step=selected_time)
+        elif colour_fill_data == Constants.FIELD_KEY_TEMP850:
+            plotter.plot_contour(data_key=colour_fill_data, time_step=selected_time, level=[0], line_color="black", line_style="dashed", line_width=3)
+            plotter.plot_contour(data_key=Constants.FIELD_KEY_RH850, time_step=selected_time, cmap="rainbow_r")
+
+        elif colour_fill_data == Constants.FIELD_KEY_RH700:
+            plotter.plot_contour(data_key=colour_fill_data, time_step=selected_time)
+
+        elif colour_fill_data == Constants.FIELD_KEY_WS300:
+            plotter.plot_contour(data_key=Constants.FIELD_KEY_SLP, time_step=selected_time, line_style="dashed")
+
+        else:
+            plotter.plot_contour(data_key=Constants.FIELD_KEY_SLP, time_step=selected_time)
+
+    # TODO: provide an interface for barb customization
+    if render_request.should_plot_wind:
+        plotter.plot_wind(wind_variable_key=colour_fill_data, time_step=selected_time, grid_interval=5)
+
+    plotter.plot_contour_fill(data_key=colour_fill_data, timeidx=selected_time)
+
+    plotter.plot_figure_title()
+    plotter.plot_gridlines()
+
+    # figure stays open, the next frame of the same domain reuses its base map
+    image = plotter.save_to_bytes(fmt=fmt)
+    et = datetime.utcnow()
+    logger.debug(f"Creating Figure took: {(et - st).total_seconds()}")
+    return image
@@ -1,6 +1,9 @@
+import uuid
 from datetime import datetime
+from concurrent.futures import wait
 
-from flask import render_template, session, url_for, redirect, current_app
+from flask import render_template, session, url_for, redirect, current_app, request, send_file, abort, jsonify, \
+    Response
 
 from app import FlaskApp
 from app.file_selection.forms import SelectFileForm
@@ -8,8 +11,16 @@ from app.file_selection.routes import selected_file_arg
 from app.map import map_bp
 from app.WrfOutManager import WrfOutManager
 from app.map.forms import SurfacePlotForm, TimeSelectionForm
+from app.map.models import MapRenderRequest
+from app.map.renderer import render_cache_key, thread_plotter
+from app.map.render_service import RenderService, PRIORITY_ANIMATION
+from app.map.prefetch import Prefetcher
+from app.map.animation import animation_frames, encode_animation, ANIMATION_MIMETYPES
+from app.map.points import meteogram_csv, json_values
+from library.models.PointData import METEOGRAM_UNITS, SOUNDING_UNITS
+from library.cache.RenderCache import RenderCache
 
-from library.plotting.CartopyMPLPlotter import CartopyMplPlotter
+from library.plotting.TileRenderer import TileRenderer
 
 from app.path_config import PathConfig
 
@@ -17,12 +28,19 @@ import app.map.constants as Constants
 
 current_app: FlaskApp
 path_config: PathConfig = current_app.config.get("PATH_CONFIG")
-wrf_manager: WrfOutManager = current_app.wrf_manager
-plotter = CartopyMplPlotter(wrf_data_manager=wrf_manager)
+render_cache: RenderCache = current_app.render_cache
+render_service: RenderService = current_app.render_service
+prefetcher = Prefetcher(render_service, steps=current_app.config.get("MAP_PREFETCH_STEPS"))
+viewer_id_arg = "MAP_VIEWER_ID"
+tile_renderer = TileRenderer()
+image_mimetypes = {"png": "image/png", "webp": "image/webp"}
+image_max_age = 24 * 60 * 60
+max_sounding_points = 50
 
 
 @map_bp.route("/", methods=["GET", "POST"])
 def index() -> str:
+    wrf_manager: WrfOutManager = current_app.wrf_manager
     select_file_form = SelectFileForm()
 
     selected_file = session.get(selected_file_arg, None)
@@ -32,62 +50,326 @@ def index() -> str:
     wrf_manager.read_dataset(selected_file)
 
     form = SurfacePlotForm()
-    should_plot_slp = form.should_plot_slp.data
-    should_plot_wind = form.should_plot_wind.data
-    colour_fill_data = form.colour_fill_data.data
-
     time_form = TimeSelectionForm(
         available_times=wrf_manager.data.available_times
     )
-    selected_time = int(time_form.select_time.data)
-    wrf_manager.load_base_variables()
+    render_request = MapRenderRequest(
+        file_name=selected_file,
+        timeidx=int(time_form.select_time.data),
+        colour_fill_data=form.colour_fill_data.data,
+        should_plot_slp=bool(form.should_plot_slp.data),
+        should_plot_wind=bool(form.should_plot_wind.data)
+    )
+
+    image_src = url_for(
+        ".image",
+        file_name=render_request.file_name,
+        timeidx=render_request.timeidx,
+        colour_fill_data=render_request.colour_fill_data,
+        fmt="png",
+        slp=int(render_request.should_plot_slp),
+        wind=int(render_request.should_plot_wind),
+        # changes with the file, lets browsers keep the image for long
+        v=wrf_manager.get_file_version(selected_file)
+    )
+    tiles_url = url_for(".tiles_viewer", file_name=render_request.file_name,
+                        colour_fill_data=render_request.colour_fill_data, timeidx=render_request.timeidx)
+    wrf_manager.close_dataset()
+    return render_template(
+        "map/index.html",
+        form=form,
+        time_form=time_form,
+        select_file_form=select_file_form,
+        selected_file=selected_file,
+        image_source=image_src,
+        tiles_url=tiles_url)
+
 
+def _rendering_response():
+    # still rendering, the page asks again for the same url
+    response = jsonify({"status": "rendering", "poll": request.full_path})
+    response.status_code = 202
+    response.headers["Retry-After"] = "2"
+    return response
+
+
+@map_bp.route("/image/<string:file_name>/<int:timeidx>/<string:colour_fill_data>.<string:fmt>")
+def image(file_name: str, timeidx: int, colour_fill_data: str, fmt: str):
+    wrf_manager: WrfOutManager = current_app.wrf_manager
+    if fmt not in image_mimetypes or Constants.get_contourf_variable(colour_fill_data) is None:
+        abort(404)
+    if not wrf_manager.file_exists(file_name):
+        abort(404)
+
+    wrf_manager.read_dataset(file_name)
+    if wrf_manager.data is None or not 0 <= timeidx < len(wrf_manager.data.available_times):
+        wrf_manager.close_dataset()
+        abort(404)
+
+    render_request = MapRenderRequest(
+        file_name=file_name,
+        timeidx=timeidx,
+        colour_fill_data=colour_fill_data,
+        should_plot_slp=request.args.get("slp", "1") == "1",
+        should_plot_wind=request.args.get("wind", "1") == "1"
+    )
     st = datetime.utcnow()
-    print('Creating Figure...')
+    cache_key = render_cache_key(render_cache, wrf_manager, render_request, fmt=fmt)
+    # the next clicks of the viewer are most likely the neighbouring time steps
+    viewer_id = session.setdefault(viewer_id_arg, uuid.uuid4().hex)
+    prefetcher.prefetch(viewer_id, wrf_manager, render_request, fmt=fmt)
+    wrf_manager.close_dataset()
+    try:
+        # drawn by the render service processes, identical requests share one render
+        image_path = render_service.render(render_request, cache_key, fmt=fmt,
+                                           timeout=current_app.config.get("RENDER_LATENCY_BUDGET_SECONDS"))
+    except Exception as e:
+        current_app.logger.warning(f"Exception occurred rendering {render_request}, details: \n{e}")
+        abort(500)
+    et = datetime.utcnow()
+    current_app.logger.debug(f"Serving map took: {(et - st).total_seconds()}")
+    if image_path is None:
+        return _rendering_response()
 
-    plotter.create_figure()
-    plotter.generate_figure_title(timeidx=selected_time)
+    # conditional=True answers If-None-Match / If-Modified-Since with 304
+    return send_file(
+        image_path,
+        mimetype=image_mimetypes[fmt],
+        conditional=True,
+        etag=cache_key,
+        last_modified=wrf_manager.get_file_modified_time(file_name),
+        max_age=image_max_age
+    )
 
-    # TODO: provide an interface for contour customization
-    if should_plot_slp and (colour_fill_data is not Constants.FIELD_KEY_SLP):
-        if colour_fill_data == Constants.FIELD_KEY_GEO500:
-            plotter.plot_contour(data_key=colour_fill_data, time_step=selected_time)
-        elif colour_fill_data == Constants.FIELD_KEY_TEMP850:
-            plotter.plot_contour(data_key=colour_fill_data, time_step=selected_time, level=[0], line_color="black", line_style="dashed", line_width=3)
-            plotter.plot_contour(data_key=Constants.FIELD_KEY_RH850, time_step=selected_time, cmap="rainbow_r")
 
-        elif colour_fill_data == Constants.FIELD_KEY_RH700:
-            plotter.plot_contour(data_key=colour_fill_data, time_step=selected_time)
+@map_bp.route("/animation/<string:file_name>/<string:colour_fill_data>.<string:fmt>")
+def animation(file_name: str, colour_fill_data: str, fmt: str):
+    wrf_manager: WrfOutManager = current_app.wrf_manager
+    if fmt not in ANIMATION_MIMETYPES or Constants.get_contourf_variable(colour_fill_data) is None:
+        abort(404)
+    if not wrf_manager.file_exists(file_name):
+        abort(404)
 
-        elif colour_fill_data == Constants.FIELD_KEY_WS300:
-            plotter.plot_contour(data_key=Constants.FIELD_KEY_SLP, time_step=selected_time, line_style="dashed")
+    try:
+        animation_key, frames = animation_frames(
+            file_name, colour_fill_data,
+            wrf_manager=wrf_manager,
+            render_cache=render_cache,
+            fmt=fmt,
+            start=request.args.get("start", 0, type=int),
+            end=request.args.get("end", None, type=int),
+            stride=request.args.get("stride", 1, type=int),
+            fps=request.args.get("fps", 2, type=int),
+            should_plot_slp=request.args.get("slp", "1") == "1",
+            should_plot_wind=request.args.get("wind", "1") == "1"
+        )
+    except ValueError as e:
+        abort(400, str(e))
 
-        else:
-            plotter.plot_contour(data_key=Constants.FIELD_KEY_SLP, time_step=selected_time)
+    animation_path = render_cache.get(animation_key, fmt=fmt)
+    if animation_path is None:
+        # frames are drawn by the render service like map images, shared with /image and other viewers
+        futures = [render_service.submit(render_request, frame_key, priority=PRIORITY_ANIMATION)
+                   for render_request, frame_key in frames if render_cache.get(frame_key) is None]
+        done, not_done = wait(futures, timeout=current_app.config.get("RENDER_LATENCY_BUDGET_SECONDS"))
+        if not_done:
+            return _rendering_response()
+        frame_paths = [render_cache.get(frame_key) for _, frame_key in frames]
+        if any(future.cancelled() or future.exception() is not None for future in done) or None in frame_paths:
+            current_app.logger.warning(f"Frames of the {colour_fill_data} animation of {file_name} could not be "
+                                       f"rendered.")
+            abort(500)
+        animation_path = encode_animation(animation_key, frame_paths, render_cache, fmt=fmt,
+                                          fps=request.args.get("fps", 2, type=int))
 
-    # TODO: provide an interface for barb customization
-    if should_plot_wind:
-        plotter.plot_wind(wind_variable_key=colour_fill_data, time_step=selected_time, grid_interval=5)
+    return send_file(
+        animation_path,
+        mimetype=ANIMATION_MIMETYPES[fmt],
+        conditional=True,
+        etag=animation_path.stem,
+        last_modified=wrf_manager.get_file_modified_time(file_name),
+        max_age=image_max_age
+    )
 
-    plotter.plot_contour_fill(data_key=colour_fill_data, timeidx=selected_time)
 
-    plotter.plot_figure_title()
-    plotter.plot_gridlines()
+@map_bp.route("/tiles/<string:file_name>/<string:colour_fill_data>/<int:timeidx>")
+def tiles_viewer(file_name: str, colour_fill_data: str, timeidx: int):
+    wrf_manager: WrfOutManager = current_app.wrf_manager
+    if Constants.get_contourf_variable(colour_fill_data) is None or not wrf_manager.file_exists(file_name):
+        abort(404)
 
-    image_src = plotter.save()
+    wrf_manager.read_dataset(file_name)
+    wrf_manager.load_base_variables()
+    lats, lons = wrf_manager.get_latitudes_and_longitudes()
     wrf_manager.close_dataset()
-    et = datetime.utcnow()
-    print(f"Creating Figure took: {(et - st).total_seconds()}")
     return render_template(
-        "map/index.html",
-        form=form,
-        time_form=time_form,
-        select_file_form=select_file_form,
-        selected_file=selected_file,
-        image_source=image_src)
+        "map/tiles.html",
+        tile_url_template=url_for(".tile", file_name=file_name, colour_fill_data=colour_fill_data, timeidx=timeidx,
+                                  z=0, x=0, y=0, v=wrf_manager.get_file_version(file_name))
+        .replace("/0/0/0.png", "/{z}/{x}/{y}.png"),
+        bounds=[[float(lats.min()), float(lons.min())], [float(lats.max()), float(lons.max())]],
+        selected_file=file_name
+    )
+
+
+@map_bp.route("/tiles/<string:file_name>/<string:colour_fill_data>/<int:timeidx>/<int:z>/<int:x>/<int:y>.png")
+def tile(file_name: str, colour_fill_data: str, timeidx: int, z: int, x: int, y: int):
+    wrf_manager: WrfOutManager = current_app.wrf_manager
+    ctf_variable = Constants.get_contourf_variable(colour_fill_data)
+    if ctf_variable is None or not tile_renderer.tile_exists(z, x, y) or not wrf_manager.file_exists(file_name):
+        abort(404)
+
+    source_path = path_config.WRF_OUTPUT_FOLDER_PATH.joinpath(file_name)
+    tile_key = render_cache.key_for(source_path, tile=colour_fill_data, timeidx=timeidx, z=z, x=x, y=y)
+    tile_path = render_cache.get(tile_key)
+    if tile_path is None:
+        wrf_manager.read_dataset(file_name)
+        if wrf_manager.data is None or not 0 <= timeidx < len(wrf_manager.data.available_times):
+            wrf_manager.close_dataset()
+            abort(404)
+
+        wrf_manager.load_base_variables()
+        lats, lons = wrf_manager.get_latitudes_and_longitudes()
+        raster = tile_renderer.get_raster(
+            raster_key=(str(source_path), wrf_manager.get_file_version(file_name), colour_fill_data, timeidx),
+            domain_key=wrf_manager.get_domain_key(),
+            lats=lats, lons=lons,
+            grid_spacing=min(wrf_manager.data.dx, wrf_manager.data.dy),
+            field_loader=lambda: wrf_manager.get_contour_fill_data(colour_fill_data, timeidx=timeidx).data_to_plot
+        )
+        wrf_manager.close_dataset()
+        tile_path = render_cache.put(tile_key, tile_renderer.render_tile(raster, ctf_variable.cmap, z, x, y))
+
+    return send_file(
+        tile_path,
+        mimetype="image/png",
+        conditional=True,
+        etag=tile_key,
+        last_modified=wrf_manager.get_file_modified_time(file_name),
+        max_age=image_max_age
+    )
+
+
+@map_bp.route("/point/<string:file_name>")
+def point(file_name: str):
+    """ Meteogram of the nearest grid point, ?lat=..&lon=..[&format=csv] """
+    wrf_manager: WrfOutManager = current_app.wrf_manager
+    lat = request.args.get("lat", type=float)
+    lon = request.args.get("lon", type=float)
+    if lat is None or lon is None:
+        abort(400, "lat and lon are required.")
+    if not wrf_manager.file_exists(file_name):
+        abort(404)
+
+    wrf_manager.read_dataset(file_name)
+    if wrf_manager.data is None:
+        abort(404)
+    point_index = wrf_manager.get_point_index()
+    south_north, west_east, distance_km = point_index.nearest(lat, lon)
+    if south_north[0] < 0:
+        wrf_manager.close_dataset()
+        abort(404, "The point is outside of the domain.")
+    south_north, west_east = int(south_north[0]), int(west_east[0])
+    times, series = wrf_manager.get_meteogram(south_north, west_east)
+    wrf_manager.close_dataset()
+
+    if request.args.get("format") == "csv":
+        return Response(meteogram_csv(times, series), mimetype="text/csv", headers={
+            "Content-Disposition": f"attachment; filename={file_name}_{lat:.3f}_{lon:.3f}.csv"
+        })
+    return jsonify({
+        "file": file_name,
+        "requested": {"lat": lat, "lon": lon},
+        "grid_point": {
+            "south_north": south_north,
+            "west_east": west_east,
+            "lat": float(point_index.lats[south_north, west_east]),
+            "lon": float(point_index.lons[south_north, west_east]),
+            "distance_km": float(distance_km[0]),
+        },
+        "times": [time.isoformat() for time in times],
+        "units": METEOGRAM_UNITS,
+        "series": {name: json_values(values) for name, values in series.items()},
+    })
+
+
+@map_bp.route("/sounding/<string:file_name>/<int:timeidx>")
+def sounding(file_name: str, timeidx: int):
+    """
+    Model level profiles of the nearest grid points, ?lat=..&lon=..[&lat=..&lon=..] for many points in one
+    read of the file, ?format=png draws a Skew-T of a single point.
+    """
+    wrf_manager: WrfOutManager = current_app.wrf_manager
+    lats = request.args.getlist("lat", type=float)
+    lons = request.args.getlist("lon", type=float)
+    if not lats or len(lats) != len(lons):
+        abort(400, "lat and lon are required for every point.")
+    if len(lats) > max_sounding_points:
+        abort(400, f"At most {max_sounding_points} points are allowed.")
+    fmt = request.args.get("format", "json")
+    if fmt not in ("json", "png") or (fmt == "png" and len(lats) > 1):
+        abort(400, "format=png draws a single point.")
+    if not wrf_manager.file_exists(file_name):
+        abort(404)
+
+    wrf_manager.read_dataset(file_name)
+    if wrf_manager.data is None or not 0 <= timeidx < len(wrf_manager.data.available_times):
+        wrf_manager.close_dataset()
+        abort(404)
+    point_index = wrf_manager.get_point_index()
+    south_north, west_east, distance_km = point_index.nearest(lats, lons)
+    if (south_north < 0).any():
+        wrf_manager.close_dataset()
+        abort(404, "A point is outside of the domain.")
+    points = [(int(sn), int(we)) for sn, we in zip(south_north, west_east)]
+
+    if fmt == "png":
+        try:
+            from library.plotting.SkewTPlotter import render_skewt
+        except ImportError:
+            wrf_manager.close_dataset()
+            abort(501, "Skew-T diagrams need metpy.")
+        source_path = path_config.WRF_OUTPUT_FOLDER_PATH.joinpath(file_name)
+        skewt_key = render_cache.key_for(source_path, version=wrf_manager.get_frame_version(file_name, timeidx),
+                                         skewt=timeidx, south_north=points[0][0], west_east=points[0][1])
+        image_path = render_cache.get(skewt_key)
+        if image_path is None:
+            profile = wrf_manager.get_soundings(points, timeidx)[0]
+            title = f"{lats[0]:.3f}, {lons[0]:.3f}  {wrf_manager.get_time_string_by_index(timeidx)}"
+            wrf_manager.close_dataset()
+            image_path = render_cache.put(skewt_key, render_skewt(profile, title=title))
+        else:
+            wrf_manager.close_dataset()
+        return send_file(image_path, mimetype=image_mimetypes["png"], conditional=True, etag=skewt_key,
+                         max_age=image_max_age)
+
+    profiles = wrf_manager.get_soundings(points, timeidx)
+    time = wrf_manager.get_time_string_by_index(timeidx, fmt="%Y-%m-%dT%H:%M:%S")
+    wrf_manager.close_dataset()
+    return jsonify({
+        "file": file_name,
+        "time": time,
+        "units": SOUNDING_UNITS,
+        "points": [{
+            "requested": {"lat": lat, "lon": lon},
+            "grid_point": {
+                "south_north": sn,
+                "west_east": we,
+                "lat": float(point_index.lats[sn, we]),
+                "lon": float(point_index.lons[sn, we]),
+                "distance_km": float(distance),
+            },
+            "levels": {name: json_values(values) for name, values in profile.items()},
+        } for lat, lon, (sn, we), distance, profile in zip(lats, lons, points, distance_km, profiles)],
+    })
+
+
+@map_bp.route("/render/metrics")
+def render_metrics():
+    return jsonify(render_service.metrics)
 
 
 @map_bp.route("/<string:selected_file>/clear")
 def clear_map(selected_file: str):
-    plotter.clear_figure()
+    thread_plotter(current_app.wrf_manager).clear_figure()
     return redirect(url_for('.index', selected_file=selected_file))
@@ -23,6 +23,16 @@ class PathConfig:
 
     # WRF OUTPUT
     WRF_OUTPUT_FOLDER_PATH = WRF_INTERNAL_DATA_PATH.joinpath("WRFOUT")
+    # upper air fields interpolated to pressure levels, one companion file per wrfout
+    WRF_ISOBARIC_FOLDER_PATH = WRF_INTERNAL_DATA_PATH.joinpath("WRFOUT_ISOBARIC")
+    # rendered map images, see library.cache.RenderCache
+    RENDER_CACHE_FOLDER_PATH = WRF_INTERNAL_DATA_PATH.joinpath("RENDERED_MAPS")
+
+    # queued WPS/WRF pipeline jobs, see library.JobEngine
+    JOBS_FOLDER_PATH = WRF_INTERNAL_DATA_PATH.joinpath("JOBS")
+
+    # geo_em files of previous domains, see library.GeogridCache
+    GEOGRID_CACHE_FOLDER_PATH = WRF_INTERNAL_DATA_PATH.joinpath("GEOGRID_CACHE")
 
     # EXTERNAL DOWNLOAD
     GFS_FOLDER_PATH = WRF_INTERNAL_DATA_PATH.joinpath("GFS")  # /Build_WRF/DATA/GFS
@@ -153,4 +153,4 @@ class WrfForm(FlaskForm):
 
     core = fields.SelectField(
         "core", description="Kaç Çekirdek ile Paralel Çalışacağını Seçiniz",
-        choices=list(range(1, 7)), default=2)
+        choices=list(range(1, 7)), default=2, coerce=int)  # choices are set from the detected cpus
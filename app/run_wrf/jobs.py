@@ -0,0 +1,151 @@
+from pathlib import Path
+from functools import wraps
+
+from flask import current_app
+
+import app.run_wrf.repository as run_repository
+
+from app import FlaskApp
+from app.run_wrf import run_wrf_bp
+from app.map.batch import render_wrfout
+from library.JobEngine import JobEngine, Stage, run_stages
+from library.GeogridCache import GeogridCache
+from library.WrfOutWatcher import WrfOutWatcher
+
+current_app: FlaskApp
+logger = current_app.logger
+job_engine: JobEngine = current_app.job_engine
+geogrid_cache = GeogridCache(
+    current_app.config.get("PATH_CONFIG").GEOGRID_CACHE_FOLDER_PATH,
+    max_entries=current_app.config.get("GEOGRID_CACHE_MAX_ENTRIES"),
+    logger=logger
+)
+
+WPS_TASK = "wps"
+WRF_TASK = "wrf"
+
+
+def task(name: str):
+    """ Registers a pipeline stage, it runs on a job worker thread inside the app context. """
+    flask_app = current_app._get_current_object()
+
+    def decorator(func):
+        @wraps(func)
+        def in_app_context(**params):
+            with flask_app.app_context():
+                return func(**params)
+
+        job_engine.register(name, in_app_context)
+        return func
+
+    return decorator
+
+
+def _write_file(path: Path, content: str) -> None:
+    # each job writes its own namelist, a queued run must not pick up the namelist of the next one
+    with open(path, "w") as namelist_file:
+        namelist_file.write(content)
+
+
+def _ungrib(gfs_files: [str]) -> None:
+    run_repository.link_grib([Path(gfs_file) for gfs_file in gfs_files])
+    if not run_repository.run_ungrib_exe():
+        raise RuntimeError("ungrib.exe did not complete, see the app log for its output.")
+
+
+def _geogrid() -> None:
+    wps_folder = run_repository.WPS_FOLDER_PATH
+    geogrid_key = geogrid_cache.key_for(wps_folder.joinpath("namelist.wps"),
+                                        wps_folder.joinpath("geogrid/GEOGRID.TBL"))
+    if geogrid_cache.restore(geogrid_key, wps_folder):
+        logger.info("Same domain as a previous run, skipped geogrid.exe.")
+        return
+
+    geogrid_cache.remove_outputs(wps_folder)
+    if not run_repository.run_geogrid_exe():
+        raise RuntimeError("geogrid.exe did not complete, see the app log for its output.")
+    geogrid_cache.store(geogrid_key, wps_folder)
+
+
+def _metgrid() -> None:
+    if not run_repository.run_metgrid_exe():
+        raise RuntimeError("metgrid.exe did not complete, see the app log for its output.")
+    run_repository.link_metem()
+
+
+def _render_new_frames(wrf_out: Path, timeidxs: [int]) -> None:
+    logger.info(f"New time steps {timeidxs} of running {wrf_out.name}")
+    workers = current_app.config.get("WRF_WATCH_RENDER_WORKERS")
+    if workers > 0:
+        render_wrfout(wrf_out.name, wrf_manager=current_app.wrf_manager, render_cache=current_app.render_cache,
+                      workers=workers, timeidxs=timeidxs, logger=logger)
+
+
+def _wrfout_watcher(split_output: bool) -> WrfOutWatcher:
+    flask_app = current_app._get_current_object()
+
+    def on_new_frames(wrf_out: Path, timeidxs: [int]) -> None:
+        with flask_app.app_context():
+            _render_new_frames(wrf_out, timeidxs)
+
+    return WrfOutWatcher(
+        run_folder=run_repository.WRF_RUN_FOLDER_PATH,
+        output_folder=run_repository.path_config.WRF_OUTPUT_FOLDER_PATH,
+        on_new_frames=on_new_frames,
+        poll_seconds=current_app.config.get("WRF_WATCH_POLL_SECONDS"),
+        split_runs=split_output,
+        logger=logger
+    )
+
+
+@task(WPS_TASK)
+def wps(namelist_wps: str, gfs_files: [str]) -> dict:
+    _write_file(run_repository.WPS_FOLDER_PATH.joinpath("namelist.wps"), namelist_wps)
+    # ungrib only reads the gfs files and geogrid only the static data, metgrid needs both
+    stages = run_stages([
+        Stage("ungrib", lambda: _ungrib(gfs_files)),
+        Stage("geogrid", _geogrid),
+        Stage("metgrid", _metgrid, depends_on=["ungrib", "geogrid"]),
+    ])
+    return {name: stage["seconds"] for name, stage in stages.items()}
+
+
+@task(WRF_TASK)
+def wrf(namelist_input: str, core_count: int, omp_threads: int = 1, split_output: bool = False) -> dict:
+    _write_file(run_repository.WRF_RUN_FOLDER_PATH.joinpath("namelist.input"), namelist_input)
+    if not run_repository.run_real_exe():
+        raise RuntimeError("real.exe did not complete, please check your WRF configuration.")
+
+    logger.info(f"Successful real.exe run, continuing with wrf.exe with core count: {core_count}")
+    watcher = _wrfout_watcher(split_output) if current_app.config.get("WRF_WATCH_OUTPUT") else None
+    if watcher is not None:
+        watcher.start()
+    completed = False
+    try:
+        completed = run_repository.run_wrf_exe(core_count=core_count, omp_threads=omp_threads)
+    finally:
+        if watcher is not None:
+            watcher.stop()
+            if not completed:
+                # partial outputs of a failed or cancelled run
+                watcher.remove_links()
+    if not completed:
+        raise RuntimeError("wrf.exe did not complete, see the app log for its output.")
+
+    # replaces the links of the watcher with the finished files
+    new_wrf_outs = run_repository.move_wrf_outs(split_output=split_output)
+    if current_app.config.get("WRF_POSTPROCESS_ISOBARIC"):
+        run_repository.write_isobaric_stores(new_wrf_outs)
+    # files with the same name may already be open or rendered from a previous run
+    current_app.wrf_manager.invalidate_files(new_wrf_outs)
+    for wrf_out in new_wrf_outs:
+        current_app.render_cache.invalidate(wrf_out)
+    if current_app.config.get("RENDER_AFTER_RUN"):
+        run_repository.render_wrf_outs(new_wrf_outs)
+    return {"wrf_outs": [wrf_out.name for wrf_out in new_wrf_outs]}
+
+
+@run_wrf_bp.before_app_request
+def start_job_workers() -> None:
+    # started by the web app only, flask cli commands must not pick up the queued runs
+    job_engine.start()
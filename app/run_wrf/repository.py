@@ -2,11 +2,16 @@ import os
 import subprocess
 
 from glob import glob
+from datetime import datetime
 from pathlib import Path
 
 from flask import current_app
 
 from app.path_config import PathConfig
+from app.map.batch import render_wrfout
+from library.JobEngine import run_process, JobCancelled
+from library.HardwareInfo import mpi_launch_command, omp_environment
+from library.models.IsobaricStore import write_isobaric_store
 
 logger = current_app.logger
 path_config: PathConfig = current_app.config.get("PATH_CONFIG")
@@ -55,9 +60,13 @@ def clean_linked_files():
 
 
 def clean_gfs_folder():
+    # only the links of the previous run, the files stay in the gfs archive
     old_gfs_files = [Path(wrfout) for wrfout in glob(str(path_config.GFS_FOLDER_PATH.joinpath("gfs.*")))]
     for file in old_gfs_files:
         file: Path
+        if not file.is_symlink():
+            logger.warning(f"Not removing {file=}, it is not a link into the gfs archive.")
+            continue
         os.remove(file)
         logger.info(f"Removed {file=}")
 
@@ -65,39 +74,47 @@ def clean_gfs_folder():
 def link_grib(downloaded_gfs_files: [Path]) -> str:
     logger.info("Linking Grib data.")
     link_gfs_data_path = os.path.commonprefix(downloaded_gfs_files)
-    cmd_result = subprocess.run([
+    cmd_result = run_process([
         "./link_grib.csh", link_gfs_data_path,
-    ], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=WPS_FOLDER_PATH.as_posix())
+    ], cwd=WPS_FOLDER_PATH.as_posix())
     return cmd_result
 
 
-def run_ungrib_exe() -> str:
-    cmd_result = subprocess.run([
+def run_ungrib_exe() -> bool:
+    logger.info('Running ungrib.exe')
+    cmd_result = run_process([
         "./ungrib.exe"
-    ], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=WPS_FOLDER_PATH.as_posix())
-    return cmd_result
+    ], cwd=WPS_FOLDER_PATH.as_posix())
+    cmd_stdout = cmd_result.stdout.decode("utf-8")
+    result_success_message = "Successful completion of ungrib."
+    if result_success_message in cmd_stdout:
+        logger.info(result_success_message)
+        return True
+    else:
+        logger.warning(f"Something wrong with ungrib.exe, details:\n{cmd_stdout}")
+        return False
 
 
-def run_geogrid_exe():
+def run_geogrid_exe() -> bool:
     logger.info('Running geogrid.exe')
-    cmd_result_geogrid_exe = subprocess.run(
+    cmd_result_geogrid_exe = run_process(
         ["./geogrid.exe"], shell=True,
-        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
         cwd=WPS_FOLDER_PATH.as_posix()
     )
     cmd_stdout = cmd_result_geogrid_exe.stdout.decode("utf-8")
     result_success_message = "Successful completion of geogrid."
     if result_success_message in cmd_stdout:
         logger.info(result_success_message)
+        return True
     else:
         logger.warning(f"Something wrong with geogrid.exe, details:\n{cmd_stdout}")
+        return False
 
 
-def run_metgrid_exe():
+def run_metgrid_exe() -> bool:
     logger.info('Running metgrid.exe')
-    cmd_metgrid_exe = subprocess.run(
+    cmd_metgrid_exe = run_process(
         ["./metgrid.exe"], shell=True,
-        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
         cwd=WPS_FOLDER_PATH.as_posix()
     )
     cmd_stdout = cmd_metgrid_exe.stdout.decode("utf-8")
@@ -105,8 +122,10 @@ def run_metgrid_exe():
     result_success_message = "Successful completion of metgrid."
     if result_success_message in cmd_stdout:
         logger.info(result_success_message)
+        return True
     else:
         logger.warning(f"Something wrong with metgrid.exe, details:\n{cmd_stdout}")
+        return False
 
 
 def link_metem():
@@ -140,10 +159,9 @@ def plot_domain():
 
 
 def run_real_exe() -> bool:
-    cmd_real_run = subprocess.run(
+    cmd_real_run = run_process(
         ["./real.exe"],
-        cwd=WRF_RUN_FOLDER_PATH.as_posix(), shell=True,
-        stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        cwd=WRF_RUN_FOLDER_PATH.as_posix(), shell=True
     )
 
     real_exe_success_output = 'starting wrf task            0  of            1\n'
@@ -161,36 +179,89 @@ def run_real_exe() -> bool:
             return True
 
 
-def run_wrf_exe(core_count: int) -> bool:
-    # TODO: add rsl.error to logs
-    logger.info(f"Running wrf.exe with core count: {core_count}")
-    # TODO: --use-hwthread-cpus for maxing out process count
-    run_wrf_process = subprocess.Popen(
-        ["mpirun", "-np", str(core_count), "./wrf.exe"],
-        cwd=WRF_RUN_FOLDER_PATH.as_posix(),
-        stdout=subprocess.PIPE, stderr=subprocess.STDOUT
-    )
+def run_wrf_exe(core_count: int, omp_threads: int = 1) -> bool:
+    command = mpi_launch_command("./wrf.exe", process_count=core_count, omp_threads=omp_threads)
+    logger.info(f"Running wrf.exe with core count: {core_count}, threads per process: {omp_threads}: {command}")
     run_success = False
-    # TODO: make communicate optional for user
+    # model progress goes to rsl.out.0000/rsl.error.0000, mpirun output is written straight to a log file
+    # instead of being held in memory until the run ends
+    wrf_log_path = path_config.LOGS_FOLDER.joinpath(f"wrf_exe_{datetime.utcnow().strftime('%H-%M-%S_%d-%m-%Y')}.log")
     try:
-        out = run_wrf_process.communicate()
-        logger.info(f"wrf.exe completed with output: {out}")
-        run_success = True
+        with open(wrf_log_path, "wb") as wrf_log_file:
+            cmd_wrf_run = run_process(
+                command,
+                cwd=WRF_RUN_FOLDER_PATH.as_posix(),
+                stdout=wrf_log_file,
+                env=omp_environment(omp_threads)
+            )
+        logger.info(f"wrf.exe completed with return code {cmd_wrf_run.returncode}, output: {wrf_log_path}")
+        run_success = cmd_wrf_run.returncode == 0
+    except JobCancelled:
+        raise
     except Exception as e:
         logger.warning(f"Exception occurred details:\n{e}")
-
-    finally:
-        return run_success
-
-
-def move_wrf_outs():
-    wrf_out_paths = [Path(wrfout) for wrfout in glob(str(WRF_RUN_FOLDER_PATH.joinpath("wrfout_*")))]
-    new_wrf_out_paths = [path_config.WRF_OUTPUT_FOLDER_PATH.joinpath(path.name) for path in wrf_out_paths]
+    return run_success
+
+
+def move_wrf_outs(split_output: bool = False) -> [Path]:
+    """
+    Moves the wrfout files of the finished run into WRFOUT. With split_output the per-time files of each
+    domain go into a run folder named after its first file, see library.models.WrfOutRun.
+    Returns the new files or run folders.
+    """
+    wrf_out_paths = sorted(Path(wrfout) for wrfout in glob(str(WRF_RUN_FOLDER_PATH.joinpath("wrfout_*"))))
+    if split_output:
+        run_folders = {}
+        for path in wrf_out_paths:
+            domain = path.name.split("_")[1]
+            run_folders.setdefault(domain, path_config.WRF_OUTPUT_FOLDER_PATH.joinpath(path.name))
+        new_wrf_out_paths = [run_folders[path.name.split("_")[1]].joinpath(path.name) for path in wrf_out_paths]
+    else:
+        new_wrf_out_paths = [path_config.WRF_OUTPUT_FOLDER_PATH.joinpath(path.name) for path in wrf_out_paths]
     # TODO: check params
     try:
         for src, target in zip(wrf_out_paths, new_wrf_out_paths):
+            target.parent.mkdir(exist_ok=True)
             src.rename(target)
             logger.info(f"Moved from: {src=} To {target=}")
         # logger.info("Moved wrfout files to app data directory.")
     except Exception as e:
         logger.warning(f'Exception occurred while moving wrfout files, details: \n{e}')
+
+    if not split_output:
+        return [path for path in new_wrf_out_paths if path.exists()]
+
+    run_folders = sorted(set(path.parent for path in new_wrf_out_paths if path.exists()))
+    for run_folder in run_folders:
+        # files of an earlier, longer run with the same name
+        for old_path in set(run_folder.iterdir()) - set(new_wrf_out_paths):
+            old_path.unlink()
+    return run_folders
+
+
+def write_isobaric_stores(wrf_out_paths: [Path]) -> [Path]:
+    store_paths = []
+    for wrf_out_path in wrf_out_paths:
+        try:
+            logger.info(f"Writing isobaric levels of {wrf_out_path.name}")
+            store_path = write_isobaric_store(wrf_out_path, path_config.WRF_ISOBARIC_FOLDER_PATH)
+            store_paths.append(store_path)
+            logger.info(f"Wrote isobaric levels to {store_path=}")
+        except Exception as e:
+            logger.warning(f"Exception occurred writing isobaric levels of {wrf_out_path}, details: \n{e}")
+    return store_paths
+
+
+def render_wrf_outs(wrf_out_paths: [Path]) -> None:
+    """ Called by the wrf job once the run finished, same as `flask map render` for every new file. """
+    for wrf_out_path in wrf_out_paths:
+        try:
+            render_wrfout(
+                wrf_out_path.name,
+                wrf_manager=current_app.wrf_manager,
+                render_cache=current_app.render_cache,
+                workers=current_app.config.get("RENDER_WORKERS"),
+                logger=logger
+            )
+        except Exception as e:
+            logger.warning(f"Exception occurred rendering {wrf_out_path}, details: \n{e}")
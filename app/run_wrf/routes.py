@@ -1,21 +1,44 @@
 import os
+import json
+import time
 
 from pathlib import Path
 from time import sleep
 from datetime import datetime, timedelta
 
-from flask import request, render_template, url_for, redirect, session, current_app, flash
+from flask import (
+    request, render_template, url_for, redirect, session, current_app, flash, jsonify, abort, Response
+)
 
 import app.run_wrf.repository as run_repository
 
 from app.run_wrf import run_wrf_bp
+from app.run_wrf.jobs import job_engine, WPS_TASK, WRF_TASK
 from app.run_wrf.forms import WpsForm, DomainForm, WrfForm
 from app.path_config import PathConfig
+from library.HardwareInfo import detect_hardware, suggest_process_count, decompose
+from library.WrfLogs import read_new_lines, read_last_bytes, run_period_from_namelist, WrfProgress
+from library.GfsArchive import GfsArchive
 from library.GfsDownloader import GfsDownloader
+from library.GribInventory import GFS_VTABLE_RECORDS
 
 logger = current_app.logger
 path_config: PathConfig = current_app.config.get("PATH_CONFIG")
-gfs_downloader = GfsDownloader(path_config, logger=logger)
+gfs_downloader = GfsDownloader(
+    path_config,
+    logger=logger,
+    max_workers=current_app.config.get("GFS_DOWNLOAD_WORKERS", 4),
+    max_retries=current_app.config.get("GFS_DOWNLOAD_RETRIES", 5),
+    base_url=current_app.config.get("GFS_BASE_URL"),
+    resolution=current_app.config.get("GFS_RESOLUTION"),
+    subset_records=GFS_VTABLE_RECORDS if current_app.config.get("GFS_SUBSET") else None,
+    archive=GfsArchive(
+        path_config.GFS_BACKUP_FOLDER,
+        max_bytes=current_app.config.get("GFS_ARCHIVE_MAX_BYTES"),
+        max_age_days=current_app.config.get("GFS_ARCHIVE_MAX_AGE_DAYS"),
+        logger=logger
+    )
+)
 WRF_INSTALL_SCRIPT = "WRF4.5_Install.bash"
 WPS_FOLDER = "WPS-4.5"
 WRF_FOLDER = "WRF-4.5-ARW"
@@ -33,6 +56,7 @@ gfs_end_arg = "gfs_end_datetime"
 model_input_arg = "model_input_in_seconds"
 model_out_arg = "model_output_in_minutes"
 frame_count_arg = "frame"
+rsl_log_names = ("rsl.out.0000", "rsl.error.0000")
 
 
 @run_wrf_bp.route('/', methods=["GET", "POST"])
@@ -92,11 +116,16 @@ def run_wrf():
         run_repository.clean_gfs_folder()
 
         # end_date must be at least 6 hours earlier
-        downloaded_files: [Path] = gfs_downloader.download(
-            start_date=gfs_start_datetime,
-            end_date=gfs_end_datetime,
-            interval_hours=model_input_in_hours
-        )
+        try:
+            downloaded_files: [Path] = gfs_downloader.download(
+                start_date=gfs_start_datetime,
+                end_date=gfs_end_datetime,
+                interval_hours=model_input_in_hours
+            )
+        except IOError as e:
+            current_app.logger.warning(str(e))
+            flash("GFS dosyalarının bir kısmı indirilemedi, lütfen daha sonra tekrar deneyin.")
+            return render_template("run_wrf/run.html", form=form)
         session["downloaded_files"] = downloaded_files
         # update Vtable
         run_repository.link_ungrib_variable_table()
@@ -158,27 +187,24 @@ def wps():
             stand_lon=ref_lon  # TODO: include standard lon
         )
 
+        # the domain page plots this namelist, wps programs run once the domain is confirmed
         with open(wps_namelist_path, 'w') as wps_file:
             wps_file.write(namelist_wps_content)
 
-        sleep(.2)
-        # link grib
-        downloaded_files = session["downloaded_files"]
-        run_repository.link_grib(downloaded_files)
-        run_repository.run_ungrib_exe()
-
         return redirect(url_for('.domain'))
 
 
 @run_wrf_bp.route('/domain', methods=["GET", "POST"])
 def domain():
     if request.method == "POST":
-        sleep(.1)
-        run_repository.run_geogrid_exe()
-        sleep(.1)
-        run_repository.run_metgrid_exe()
-        sleep(.1)
-        run_repository.link_metem()
+        with open(wps_namelist_path) as wps_file:
+            namelist_wps_content = wps_file.read()
+        downloaded_files = session["downloaded_files"]
+        wps_job = job_engine.submit(WPS_TASK, params={
+            "namelist_wps": namelist_wps_content,
+            "gfs_files": [str(gfs_file) for gfs_file in downloaded_files]
+        })
+        session["wps_job"] = wps_job.job_id
         return redirect(url_for('run_wrf_bp.wrf'))
     else:
         run_repository.plot_domain()
@@ -188,12 +214,19 @@ def domain():
 @run_wrf_bp.route('/wrf', methods=["GET", "POST"])
 def wrf():
     form = WrfForm()
+    hardware = detect_hardware()
+    omp_threads = current_app.config.get("WRF_OMP_THREADS", 1)
+    suggested_core = suggest_process_count(
+        hardware, e_we=int(session.get("e_we", 100)), e_sn=int(session.get("e_sn", 100)), omp_threads=omp_threads
+    )
+    form.core.choices = list(range(1, max(1, hardware.logical_cpus // omp_threads) + 1))
     if request.method != "POST":
-        return render_template("run_wrf/wrf.html", form=form)
+        form.core.data = suggested_core
+        return render_template("run_wrf/wrf.html", form=form, hardware=hardware, suggested_core=suggested_core)
     else:
 
         if not form.validate_on_submit():
-            return render_template("run_wrf/wrf.html", form=form)
+            return render_template("run_wrf/wrf.html", form=form, hardware=hardware, suggested_core=suggested_core)
 
         microphy = form.microphy.data
         pbl = form.pbl.data
@@ -223,14 +256,15 @@ def wrf():
         e_we = session.get("e_we", "not-set")
         e_sn = session.get("e_sn", "not-set")
         dx_dy = session.get("dx_dy", "not-set")
-        frame_per_outfile = session.get(frame_count_arg, "not-set")
+        split_output = current_app.config.get("WRF_SPLIT_OUTPUT")
+        frame_per_outfile = 1 if split_output else session.get(frame_count_arg, "not-set")
+        nproc_x, nproc_y = decompose(core, int(e_we), int(e_sn))
 
         run_time_period: timedelta = end_date - start_date
         run_days = run_time_period.days
         seconds_in_hour = 60 * 60
         run_hours = int(run_time_period.seconds / seconds_in_hour)
 
-        namelist_input_path = WRF_RUN_FOLDER_PATH.joinpath("namelist.input")
         namelist_input_content = render_template(
             "namelists/namelist.input",
             max_dom=max_dom,
@@ -256,21 +290,126 @@ def wrf():
             time_step=int(dx_dy) * 6,  # must be higher than 6x dx or dy
             microphy=microphy,
             cumulus=cumulus,
-            pbl=pbl
+            pbl=pbl,
+            nproc_x=nproc_x,
+            nproc_y=nproc_y,
+            numtiles=omp_threads
         )
-        with open(namelist_input_path, 'w') as wps_file:
-            wps_file.write(namelist_input_content)
-
-        sleep(2)
-        is_run_ok = run_repository.run_real_exe()
-        if not is_run_ok:
-            flash("Please check your WRF configuration.")
-            return redirect(url_for(".wrf"))
-
-        logger.info(f"Successful real.exe run, continuing with wrf.exe with core count: {core}")
-        run_success = run_repository.run_wrf_exe(core_count=core)
-        if run_success:
-            run_repository.move_wrf_outs()
-            return redirect(url_for("file_selection_bp.index"))
-        else:
-            return redirect(url_for("run_wrf_bp.run"))
+        # real.exe and wrf.exe run in the background once geogrid and metgrid are done,
+        # the wrf job writes the namelist itself
+        wrf_job = job_engine.submit(
+            WRF_TASK,
+            params={"namelist_input": namelist_input_content, "core_count": core, "omp_threads": omp_threads,
+                    "split_output": split_output},
+            depends_on=[job_id for job_id in [session.get("wps_job")] if job_id]
+        )
+        flash(f"WRF çalıştırması sıraya alındı: {wrf_job.job_id}")
+        return redirect(url_for(".jobs"))
+
+
+@run_wrf_bp.route('/jobs', methods=["GET", "POST"])
+def jobs():
+    if request.method == "POST":
+        # json api: {"task": "wrf", "params": {...}, "depends_on": [...]}
+        payload = request.get_json(force=True)
+        try:
+            job = job_engine.submit(payload["task"], params=payload.get("params"),
+                                    depends_on=payload.get("depends_on", []))
+        except (KeyError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(job.to_dict()), 202, {"Location": url_for(".job", job_id=job.job_id)}
+
+    all_jobs = job_engine.jobs()
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify([job.to_dict() for job in all_jobs])
+    return render_template("run_wrf/jobs.html", jobs=all_jobs)
+
+
+@run_wrf_bp.route('/jobs/<job_id>', methods=["GET"])
+def job(job_id: str):
+    found_job = job_engine.get(job_id)
+    if found_job is None:
+        abort(404)
+    return jsonify(found_job.to_dict())
+
+
+@run_wrf_bp.route('/jobs/<job_id>/cancel', methods=["POST"])
+def cancel_job(job_id: str):
+    if job_engine.get(job_id) is None:
+        abort(404)
+    cancelled = job_engine.cancel(job_id)
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"job_id": job_id, "cancelled": cancelled})
+    return redirect(url_for(".jobs"))
+
+
+def _log_file_path(log_name: str) -> Path:
+    if log_name in rsl_log_names:
+        # may not exist yet, the stream waits for wrf.exe to create it
+        return WRF_RUN_FOLDER_PATH.joinpath(log_name)
+    # installer and wrf.exe logs of the app log folder
+    log_path = path_config.LOGS_FOLDER.joinpath(log_name)
+    if Path(log_name).name != log_name or log_path.suffix != ".log" or not log_path.exists():
+        abort(404)
+    return log_path
+
+
+def _wrf_progress() -> WrfProgress:
+    run_period = run_period_from_namelist(WRF_RUN_FOLDER_PATH.joinpath("namelist.input"))
+    return WrfProgress(*run_period) if run_period else WrfProgress()
+
+
+@run_wrf_bp.route('/logs', defaults={"log_name": "rsl.out.0000"}, methods=["GET"])
+@run_wrf_bp.route('/logs/<log_name>', methods=["GET"])
+def logs(log_name: str):
+    _log_file_path(log_name)
+    return render_template("run_wrf/logs.html", log_name=log_name, log_names=rsl_log_names)
+
+
+@run_wrf_bp.route('/logs/<log_name>/stream', methods=["GET"])
+def stream_log(log_name: str):
+    """
+    Server-sent events of the new lines of a log file. The event id is the file offset,
+    a reconnecting EventSource sends it back as Last-Event-ID and continues where it stopped.
+    rsl.out.0000 streams also carry the model progress.
+    """
+    log_path = _log_file_path(log_name)
+    offset = request.args.get("offset", 0, type=int)
+    last_event_id = request.headers.get("Last-Event-ID", "")
+    if last_event_id.isdigit():
+        offset = int(last_event_id)
+    offset = max(0, offset)
+    progress = _wrf_progress() if log_name == "rsl.out.0000" else None
+    if progress is not None and offset > 0:
+        # catch up with the steps before the offset without sending them again
+        for line in read_last_bytes(log_path, end=offset):
+            progress.feed(line)
+
+    def events():
+        nonlocal offset
+        last_sent = time.monotonic()
+        while True:
+            lines, offset = read_new_lines(log_path, offset)
+            if not lines:
+                if time.monotonic() - last_sent > 15:
+                    # keeps proxies from closing an idle stream
+                    last_sent = time.monotonic()
+                    yield ": keep-alive\n\n"
+                time.sleep(1)
+                continue
+
+            last_sent = time.monotonic()
+            yield f"id: {offset}\nevent: log\ndata: {json.dumps(lines)}\n\n"
+            if progress is not None and sum(progress.feed(line) for line in lines) > 0:
+                yield f"event: progress\ndata: {json.dumps(progress.to_dict())}\n\n"
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@run_wrf_bp.route('/logs/progress', methods=["GET"])
+def wrf_progress():
+    progress = _wrf_progress()
+    for line in read_last_bytes(WRF_RUN_FOLDER_PATH.joinpath("rsl.out.0000")):
+        progress.feed(line)
+    return jsonify(progress.to_dict())
@@ -0,0 +1,173 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+from glob import glob
+from pathlib import Path
+from logging import Logger
+from typing import Optional
+
+GEO_EM_PATTERN = "geo_em.d0*.nc"
+
+
+def _namelist_section(namelist: str, section: str) -> str:
+    match = re.search(rf"^\s*&{section}\s*$(.*?)^\s*/\s*$", namelist, re.MULTILINE | re.DOTALL | re.IGNORECASE)
+    if match is None:
+        return ""
+    lines = (re.sub(r"\s+", "", line) for line in match.group(1).splitlines())
+    return "\n".join(line for line in lines if line and not line.startswith("!"))
+
+
+def _geog_data_path(geogrid_section: str) -> Optional[Path]:
+    match = re.search(r"geog_data_path='([^']*)'", geogrid_section)
+    return Path(match.group(1)) if match else None
+
+
+def static_data_signature(geog_data_path: Path) -> str:
+    """
+    Cheap fingerprint of the static geographical data: name, size and mtime of the datasets and their
+    `index` files. Replacing or adding a dataset changes it, the data files themselves are not read.
+    """
+    entries = []
+    try:
+        for entry in sorted(os.scandir(geog_data_path), key=lambda entry: entry.name):
+            stat = entry.stat()
+            entries.append(f"{entry.name}:{stat.st_mtime_ns}")
+            index_path = Path(entry.path).joinpath("index")
+            if entry.is_dir() and index_path.exists():
+                index_stat = index_path.stat()
+                entries.append(f"{entry.name}/index:{index_stat.st_size}:{index_stat.st_mtime_ns}")
+    except OSError:
+        entries.append("missing")
+    return hashlib.sha256("\n".join(entries).encode("utf-8")).hexdigest()
+
+
+class GeogridCache:
+    """
+    geo_em files of previous geogrid runs, keyed by everything geogrid reads: the &geogrid section and
+    max_dom of namelist.wps, GEOGRID.TBL and a signature of the static data. Run dates are not part of
+    the key, a fixed domain runs geogrid once.
+    """
+
+    _manifest_name = "manifest.json"
+
+    def __init__(self, folder: Path, max_entries: int = 8, logger: Logger = None) -> None:
+        self.folder = Path(folder)
+        self.max_entries = max_entries
+        self.logger = logger
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+    def key_for(self, namelist_wps_path: Path, geogrid_table_path: Path) -> str:
+        with open(namelist_wps_path) as namelist_file:
+            namelist = namelist_file.read()
+        geogrid_section = _namelist_section(namelist, "geogrid")
+        max_dom = re.search(r"max_dom=(\d+)", _namelist_section(namelist, "share"))
+
+        digest = hashlib.sha256()
+        digest.update(geogrid_section.encode("utf-8"))
+        digest.update(f"max_dom={max_dom.group(1) if max_dom else 1}".encode("utf-8"))
+        try:
+            with open(geogrid_table_path, "rb") as table_file:
+                digest.update(table_file.read())
+        except OSError:
+            digest.update(b"no-geogrid-table")
+        geog_data_path = _geog_data_path(geogrid_section)
+        if geog_data_path is not None:
+            digest.update(static_data_signature(geog_data_path).encode("utf-8"))
+        return digest.hexdigest()[:32]
+
+    def restore(self, key: str, wps_folder: Path) -> bool:
+        """ Puts the cached geo_em files of key into the WPS folder, False on a miss. """
+        entry_folder = self.folder.joinpath(key)
+        manifest = self._read_manifest(entry_folder)
+        if manifest is None:
+            return False
+        cached_files = [entry_folder.joinpath(name) for name in manifest["files"]]
+        if not all(path.exists() and path.stat().st_size == size
+                   for path, size in zip(cached_files, manifest["sizes"])):
+            self._log(f"Geogrid cache entry {key} is incomplete, dropping it.")
+            shutil.rmtree(entry_folder, ignore_errors=True)
+            return False
+
+        self.remove_outputs(wps_folder)
+        for cached_file in cached_files:
+            target = Path(wps_folder).joinpath(cached_file.name)
+            tmp_target = target.with_name(f".{target.name}.tmp")
+            try:
+                # geogrid never writes into these, remove_outputs unlinks them before every geogrid run
+                os.link(cached_file, tmp_target)
+            except OSError:
+                shutil.copy2(cached_file, tmp_target)
+            os.replace(tmp_target, target)
+
+        manifest["last_used"] = time.time()
+        self._write_manifest(entry_folder, manifest)
+        self._log(f"Restored {len(cached_files)} geo_em files from the geogrid cache {key}")
+        return True
+
+    def store(self, key: str, wps_folder: Path) -> None:
+        geo_em_paths = sorted(Path(path) for path in glob(str(Path(wps_folder).joinpath(GEO_EM_PATTERN))))
+        if not geo_em_paths:
+            return
+
+        tmp_folder = self.folder.joinpath(f".{key}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        tmp_folder.mkdir()
+        for geo_em_path in geo_em_paths:
+            shutil.copy2(geo_em_path, tmp_folder.joinpath(geo_em_path.name))
+        now = time.time()
+        self._write_manifest(tmp_folder, {
+            "files": [path.name for path in geo_em_paths],
+            "sizes": [path.stat().st_size for path in geo_em_paths],
+            "created": now,
+            "last_used": now,
+        })
+
+        entry_folder = self.folder.joinpath(key)
+        shutil.rmtree(entry_folder, ignore_errors=True)
+        os.replace(tmp_folder, entry_folder)
+        self._log(f"Stored {len(geo_em_paths)} geo_em files in the geogrid cache {key}")
+        self._evict()
+
+    @staticmethod
+    def remove_outputs(wps_folder: Path) -> None:
+        """
+        geogrid truncates existing outputs in place, unlinking them first keeps the hard linked
+        cache entries intact.
+        """
+        for geo_em_path in glob(str(Path(wps_folder).joinpath(GEO_EM_PATTERN))):
+            os.remove(geo_em_path)
+
+    def clear(self) -> None:
+        for entry_folder in self.folder.iterdir():
+            shutil.rmtree(entry_folder, ignore_errors=True)
+
+    def _evict(self) -> None:
+        entries = []
+        for entry_folder in self.folder.iterdir():
+            manifest = self._read_manifest(entry_folder)
+            if manifest is not None:
+                entries.append((manifest["last_used"], entry_folder))
+        for _, entry_folder in sorted(entries)[:max(0, len(entries) - self.max_entries)]:
+            self._log(f"Evicting geogrid cache entry {entry_folder.name}")
+            shutil.rmtree(entry_folder, ignore_errors=True)
+
+    def _read_manifest(self, entry_folder: Path) -> Optional[dict]:
+        try:
+            with open(entry_folder.joinpath(self._manifest_name)) as manifest_file:
+                return json.load(manifest_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_manifest(self, entry_folder: Path, manifest: dict) -> None:
+        manifest_path = entry_folder.joinpath(self._manifest_name)
+        tmp_path = manifest_path.with_name(f".{self._manifest_name}.tmp")
+        with open(tmp_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=1)
+        os.replace(tmp_path, manifest_path)
+
+    def _log(self, message: str) -> None:
+        if self.logger is not None:
+            self.logger.info(message)
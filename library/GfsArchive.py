@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import fcntl
+import hashlib
+from pathlib import Path
+from logging import Logger
+from threading import Lock
+from contextlib import contextmanager
+from typing import Optional, Iterable, List, Tuple
+
+
+class GfsArchive:
+    """
+    Downloaded GFS files kept between runs.
+
+    Files are stored once under `objects/` by the sha256 of their content, `index.json` maps
+    `<cycle>/f<forecast hour>/<resolution>/<subset>` keys to objects. Runs do not own the files,
+    they get symlinks to the objects, overlapping runs reuse what is already here.
+    Entries older than `max_age_days` and the least recently used ones over `max_bytes` are evicted.
+    """
+
+    _index_file_name = "index.json"
+    _lock_file_name = ".lock"
+
+    def __init__(self, folder: Path, max_bytes: int = 20 * 1024 ** 3, max_age_days: float = 14.,
+                 logger: Logger = None) -> None:
+        self.folder = Path(folder)
+        self.objects_folder = self.folder.joinpath("objects")
+        self.incoming_folder = self.folder.joinpath("incoming")
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.logger = logger
+        self._thread_lock = Lock()
+        self.objects_folder.mkdir(parents=True, exist_ok=True)
+        self.incoming_folder.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key_for(cycle: str, forecast_hour: int, resolution: str, subset: Optional[Iterable] = None) -> str:
+        """ cycle is `YYYYMMDDHH`, subset is the record list of a subset download or None for whole files. """
+        subset_name = "full" if subset is None else hashlib.sha1(repr(tuple(subset)).encode("utf-8")).hexdigest()[:12]
+        return f"{cycle}/f{forecast_hour:03d}/{resolution}/{subset_name}"
+
+    def incoming_path(self, key: str) -> Path:
+        # stable name so an interrupted download resumes after a restart
+        return self.incoming_folder.joinpath(key.replace("/", "_"))
+
+    def get(self, key: str, verify_checksum: bool = False) -> Optional[Path]:
+        with self._locked() as index:
+            entry = index.get(key)
+            if entry is None:
+                return None
+
+            object_path = self._object_path(entry["sha256"])
+            if not self._is_intact(object_path, entry, verify_checksum):
+                self._log(f"Archived GFS file of {key} is damaged, dropping it.")
+                del index[key]
+                self._remove_unreferenced(index, entry["sha256"])
+                self._save_index(index)
+                return None
+
+            entry["last_used"] = time.time()
+            self._save_index(index)
+        return object_path
+
+    def put(self, key: str, file_path: Path, source_url: str = None, keep_keys: Iterable[str] = ()) -> Path:
+        """
+        Moves a downloaded file into the archive, identical content is stored once. Eviction skips the
+        entries of keep_keys, the other files of the run being fetched.
+        """
+        sha256 = self._sha256(file_path)
+        size = os.path.getsize(file_path)
+        object_path = self._object_path(sha256)
+
+        with self._locked() as index:
+            object_path.parent.mkdir(exist_ok=True)
+            if object_path.exists():
+                os.remove(file_path)
+            else:
+                os.replace(file_path, object_path)
+
+            now = time.time()
+            index[key] = {"sha256": sha256, "size": size, "url": source_url, "created": now, "last_used": now}
+            keep = {sha256} | {index[keep_key]["sha256"] for keep_key in keep_keys if keep_key in index}
+            self._evict(index, keep=keep)
+            self._save_index(index)
+        self._log(f"Archived GFS file {key} ({size / 1024 ** 2:.1f} MB)")
+        return object_path
+
+    def link_run_files(self, files: List[Tuple[str, Path]], run_folder: Path) -> List[Path]:
+        """
+        Points `run_folder/<link name>` at the archived files. Existing links are replaced atomically,
+        calling it again for the same run is harmless.
+        """
+        links = []
+        for link_name, object_path in files:
+            link_path = Path(run_folder).joinpath(link_name)
+            tmp_link_path = link_path.with_name(f".{link_name}.{os.getpid()}.tmp")
+            if os.path.lexists(tmp_link_path):
+                os.remove(tmp_link_path)
+            os.symlink(object_path, tmp_link_path)
+            os.replace(tmp_link_path, link_path)
+            links.append(link_path)
+        return links
+
+    def evict(self) -> None:
+        with self._locked() as index:
+            self._evict(index)
+            self._save_index(index)
+
+    def stats(self) -> dict:
+        with self._locked() as index:
+            sizes = {entry["sha256"]: entry["size"] for entry in index.values()}
+            return {"entries": len(index), "objects": len(sizes), "bytes": sum(sizes.values()),
+                    "max_bytes": self.max_bytes, "max_age_days": self.max_age_days}
+
+    def _evict(self, index: dict, keep: Optional[set] = None) -> None:
+        keep = keep or set()
+        expire_before = time.time() - self.max_age_days * 24 * 60 * 60
+        for key, entry in list(index.items()):
+            if entry["created"] < expire_before and entry["sha256"] not in keep:
+                self._drop(index, key)
+
+        def total_bytes() -> int:
+            return sum({entry["sha256"]: entry["size"] for entry in index.values()}.values())
+
+        for key, entry in sorted(index.items(), key=lambda item: item[1]["last_used"]):
+            if total_bytes() <= self.max_bytes:
+                break
+            if entry["sha256"] not in keep:
+                self._drop(index, key)
+
+    def _drop(self, index: dict, key: str) -> None:
+        entry = index.pop(key)
+        self._log(f"Evicted archived GFS file {key}")
+        self._remove_unreferenced(index, entry["sha256"])
+
+    def _remove_unreferenced(self, index: dict, sha256: str) -> None:
+        if any(entry["sha256"] == sha256 for entry in index.values()):
+            return
+        object_path = self._object_path(sha256)
+        if object_path.exists():
+            os.remove(object_path)
+
+    def _object_path(self, sha256: str) -> Path:
+        return self.objects_folder.joinpath(sha256[:2], sha256)
+
+    def _is_intact(self, object_path: Path, entry: dict, verify_checksum: bool) -> bool:
+        try:
+            if os.path.getsize(object_path) != entry["size"]:
+                return False
+            # every grib2 file starts with GRIB and its last message ends with 7777
+            with open(object_path, "rb") as gfs_file:
+                header = gfs_file.read(4)
+                gfs_file.seek(-4, os.SEEK_END)
+                trailer = gfs_file.read(4)
+            if header != b"GRIB" or trailer != b"7777":
+                return False
+        except OSError:
+            return False
+        return not verify_checksum or self._sha256(object_path) == entry["sha256"]
+
+    @staticmethod
+    def _sha256(file_path: Path) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @contextmanager
+    def _locked(self):
+        """ Index of the archive, locked against other threads and other processes (the flask cli). """
+        with self._thread_lock, open(self.folder.joinpath(self._lock_file_name), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield self._load_index()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.folder.joinpath(self._index_file_name)) as index_file:
+                return json.load(index_file)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            self._log("GFS archive index is unreadable, starting with an empty index.")
+            return {}
+
+    def _save_index(self, index: dict) -> None:
+        index_path = self.folder.joinpath(self._index_file_name)
+        tmp_path = index_path.with_name(f".{self._index_file_name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as index_file:
+            json.dump(index, index_file, indent=1)
+        os.replace(tmp_path, index_path)
+
+    def _log(self, message: str) -> None:
+        if self.logger is not None:
+            self.logger.info(message)
@@ -1,12 +1,21 @@
 import os
+from time import sleep
 from datetime import datetime
 from pathlib import Path
 from logging import Logger
+from typing import Iterable, Optional
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 import pandas as pd
 
+from requests.adapters import HTTPAdapter
+
 from app.path_config import PathConfig
+from library.GfsArchive import GfsArchive
+from library.GribInventory import (
+    GFS_VTABLE_RECORDS, RangeWriter, parse_idx, select_records, merge_byte_ranges, write_multipart_byteranges
+)
 
 # TODO:
 # def calculate_earliest_possible_gfs_date():
@@ -18,25 +27,75 @@ class GfsDownloader:
     _resolution = "1p00"
     # https://www.ftp.ncep.noaa.gov/data/nccf/com/gfs/prod/gfs.20230717/12/atmos/gfs.t12z.pgrb2.1p00.f000
     _base_url = "https://www.ftp.ncep.noaa.gov/data/nccf/com/gfs/prod"  # + gfs.20230717/12/atmos/gfs.t12z.pgrb2.1p00.f000
+    _chunk_size = 1024 * 1024
+    _partial_suffix = ".part"
+    _subset_suffix = ".subset"
+    _max_ranges_per_request = 32  # keeps the Range header well under server header limits
 
-    def __init__(self, path_config: PathConfig, logger: Logger):
+    def __init__(self, path_config: PathConfig, logger: Logger, max_workers: int = 4, max_retries: int = 5,
+                 backoff_seconds: float = 2., timeout_seconds: float = 60., base_url: str = None,
+                 resolution: str = None, subset_records: Optional[tuple] = None, archive: GfsArchive = None):
         self.logger = logger
         self.path_config = path_config
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout_seconds = timeout_seconds
+        if base_url is not None:
+            # e.g. a local http server with the same folder layout
+            self._base_url = base_url.rstrip("/")
+        if resolution is not None:
+            self._resolution = resolution
+        # (field, level pattern) records to fetch with byte ranges using the .idx inventory, whole files if None
+        self.subset_records = subset_records
+        self.archive = archive or GfsArchive(path_config.GFS_BACKUP_FOLDER, logger=logger)
+
+        # one keep-alive connection per worker, shared by every file of the run
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
     def download(self, start_date: datetime, end_date: datetime, interval_hours: int) -> [Path]:
+        """
+        Files already in the archive are reused, the others are downloaded into it. Returns the links
+        of the run in GFS_FOLDER_PATH, in date order. Raises IOError if a file could not be downloaded
+        after all retries.
+        """
         dates_to_fetch = pd.date_range(start_date, end_date, freq=f"{interval_hours}H", inclusive="both")
-        file_paths = []
+        downloads = []
         for date in dates_to_fetch:
-            date_folder_name = date.strftime("%Y%m%d")
-            self._make_date_directory_tree(date_folder_name)
             url = self.generate_gfs_url(date)
-            gfs_file_name = url.split("/")[-1]
-            file_path = self._download_and_write_to_file(url=url, date_folder_name=date_folder_name,
-                                                         file_name_to_save=gfs_file_name)
-            os.symlink(file_path, self.path_config.GFS_FOLDER_PATH.joinpath(file_path.name))
-            file_paths.append(file_path)
+            archive_key = self.archive.key_for(
+                cycle=f"{date.strftime('%Y%m%d')}{self.get_base_run_hour(for_date=date)}",
+                forecast_hour=int(self.distance_in_hour_string_of_gfs(for_date=date)),
+                resolution=self._resolution,
+                subset=self.subset_records
+            )
+            # file names repeat every day, the date keeps the links of a multi day run apart and sorted
+            link_name = f"gfs.{date.strftime('%Y%m%d')}.{url.split('/')[-1][len('gfs.'):]}"
+            if self.subset_records is not None:
+                link_name += self._subset_suffix
+            downloads.append((url, archive_key, link_name))
+
+        # files of this run that are already archived or downloaded must survive the eviction of the next ones
+        run_keys = {archive_key for _, archive_key, _ in downloads}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            file_paths = list(pool.map(lambda download: self._fetch_into_archive(download[0], download[1], run_keys),
+                                       downloads))
 
-        return file_paths
+        run_files, missing_urls = [], []
+        for (url, _, link_name), file_path in zip(downloads, file_paths):
+            if file_path is None:
+                missing_urls.append(url)
+            else:
+                run_files.append((link_name, file_path))
+        if missing_urls:
+            # ungrib/metgrid would run without some boundary times
+            raise IOError(f"Could not download {len(missing_urls)} of {len(downloads)} GFS files: "
+                          + ", ".join(missing_urls))
+
+        return self.archive.link_run_files(run_files, self.path_config.GFS_FOLDER_PATH)
 
     def generate_gfs_url(self, date: datetime) -> str:
         date_str = date.strftime('%Y%m%d')
@@ -51,32 +110,129 @@ class GfsDownloader:
         gfs_file_name = f"gfs.t{base_run_hour_str}z.pgrb2.{self._resolution}.f{distance_in_hour_str.zfill(3)}"
         return f"{self._base_url}/gfs.{date_str}/{base_run_hour_str}/atmos/{gfs_file_name}"
 
-    def _make_date_directory_tree(self, date_folder_name: str) -> None:
-        date_folder_path = self.path_config.GFS_FOLDER_PATH.joinpath(date_folder_name)
-        if date_folder_path.exists():
-            return
-
-        try:
-            os.makedirs(date_folder_path)
-        except OSError as file_exists_error:
-            self.logger.warning(f"Could not create directory tree for {date_folder_path}, details: \n{file_exists_error}")
-
-    def _download_and_write_to_file(self, url: str, date_folder_name: str, file_name_to_save: str) -> Path:
-        file_name = f'{date_folder_name}/{file_name_to_save}'
-        file_absolute_path = self.path_config.GFS_FOLDER_PATH.joinpath(file_name)
-        if file_absolute_path.exists():
-            return file_absolute_path  # early exit if file exists
-
-        try:
-            self.logger.info(f"Starting to download to {file_name}.")
-            response = requests.get(url)
-            with open(file_absolute_path, "wb") as gfs_file:
-                gfs_file.write(response.content)
-            self.logger.info(f"Downloaded and saved file to {file_absolute_path=}")
-        except Exception as e:
-            self.logger.warning(f"Exception occurred downloading {file_name} details:{e}")
-        finally:
-            return file_absolute_path
+    def _fetch_into_archive(self, url: str, archive_key: str, run_keys: Iterable[str] = ()) -> Optional[Path]:
+        archived_path = self.archive.get(archive_key)
+        if archived_path is not None:
+            self.logger.info(f"Using archived {archive_key} for {url}")
+            return archived_path  # early exit if file exists
+
+        file_absolute_path = self.archive.incoming_path(archive_key)
+        file_name = file_absolute_path.name
+        partial_path = file_absolute_path.with_name(file_absolute_path.name + self._partial_suffix)
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self.logger.info(f"Starting to download to {file_name}, attempt {attempt}.")
+                if self.subset_records is not None:
+                    self._stream_subset_to_partial_file(url, partial_path)
+                else:
+                    self._stream_to_partial_file(url, partial_path)
+                # complete files only ever appear under their final name
+                os.replace(partial_path, file_absolute_path)
+                self.logger.info(f"Downloaded and saved file to {file_absolute_path=}")
+                return self.archive.put(archive_key, file_absolute_path, source_url=url, keep_keys=run_keys)
+            except Exception as e:
+                self.logger.warning(f"Exception occurred downloading {file_name} details:{e}")
+                if attempt < self.max_retries:
+                    sleep(self.backoff_seconds * 2 ** (attempt - 1))
+
+        return None
+
+    def _stream_to_partial_file(self, url: str, partial_path: Path) -> None:
+        """
+        Appends the missing bytes of url to partial_path, continues from an interrupted download with a Range request.
+        """
+        offset = partial_path.stat().st_size if partial_path.exists() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout_seconds) as response:
+            if response.status_code == 416 and offset > 0:
+                # nothing left to fetch, the partial file is already complete
+                return
+            response.raise_for_status()
+
+            if response.status_code == 206:
+                mode = "ab"
+                expected_size = self._total_size_from_content_range(response.headers.get("Content-Range"))
+            else:
+                # the server ignored the range, start over
+                mode = "wb"
+                offset = 0
+                content_length = response.headers.get("Content-Length")
+                expected_size = int(content_length) if content_length is not None else None
+
+            with open(partial_path, mode) as gfs_file:
+                for chunk in response.iter_content(chunk_size=self._chunk_size):
+                    gfs_file.write(chunk)
+
+        if expected_size is not None and partial_path.stat().st_size != expected_size:
+            raise IOError(f"Incomplete download of {url}: {partial_path.stat().st_size} of {expected_size} bytes.")
+
+    def _stream_subset_to_partial_file(self, url: str, partial_path: Path) -> None:
+        """
+        Writes only the GRIB2 messages of `subset_records` to partial_path. GRIB2 messages are self-contained,
+        concatenating them gives a valid file for ungrib.
+        """
+        idx_response = self.session.get(f"{url}.idx", timeout=self.timeout_seconds)
+        idx_response.raise_for_status()
+        records = select_records(parse_idx(idx_response.text), self.subset_records)
+        if not records:
+            raise ValueError(f"None of the subset records are in the inventory of {url}")
+
+        file_size = None
+        if any(record.end is None for record in records):
+            head_response = self.session.head(url, timeout=self.timeout_seconds)
+            head_response.raise_for_status()
+            file_size = int(head_response.headers["Content-Length"])
+        ranges = merge_byte_ranges(records, file_size=file_size)
+
+        with open(partial_path, "wb") as gfs_file:
+            writer = RangeWriter(gfs_file, ranges)
+            for i in range(0, len(ranges), self._max_ranges_per_request):
+                self._fetch_ranges(url, ranges[i:i + self._max_ranges_per_request], writer)
+
+        written_size = partial_path.stat().st_size
+        if written_size != writer.expected_size:
+            raise IOError(f"Incomplete subset of {url}: {written_size} of {writer.expected_size} bytes.")
+        with open(partial_path, "rb") as gfs_file:
+            for output_offset in writer.output_offsets:
+                gfs_file.seek(output_offset)
+                if gfs_file.read(4) != b"GRIB":
+                    raise IOError(f"Subset of {url} is not aligned to GRIB messages at byte {output_offset}.")
+
+        self.logger.info(f"Fetched {len(records)} records, {written_size / 1024 ** 2:.1f} MB of {url}")
+
+    def _fetch_ranges(self, url: str, ranges: [(int, int)], writer: RangeWriter) -> None:
+        range_header = "bytes=" + ",".join(f"{first}-{last}" for first, last in ranges)
+        with self.session.get(url, headers={"Range": range_header}, stream=True,
+                              timeout=self.timeout_seconds) as response:
+            response.raise_for_status()
+            chunks = response.iter_content(chunk_size=self._chunk_size)
+            content_type = response.headers.get("Content-Type", "")
+
+            if response.status_code == 206 and content_type.startswith("multipart/byteranges"):
+                write_multipart_byteranges(chunks, writer)
+                return
+
+            if response.status_code == 206:
+                # a single range, or the server merged the ranges into one
+                content_range = response.headers.get("Content-Range", "")
+                position = int(content_range.split()[1].split("-")[0])
+            else:
+                # the server ignored the Range header, pick the records out of the whole file
+                position = 0
+                self.logger.warning(f"Range requests are not supported for {url}, reading the whole file.")
+
+            for chunk in chunks:
+                writer.write(position, chunk)
+                position += len(chunk)
+
+    @staticmethod
+    def _total_size_from_content_range(content_range: Optional[str]) -> Optional[int]:
+        # bytes 100-199/200
+        if content_range is None or "/" not in content_range:
+            return None
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
 
     @staticmethod
     def distance_in_hour_string_of_gfs(for_date: datetime) -> str:
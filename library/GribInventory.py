@@ -0,0 +1,161 @@
+import re
+from typing import Iterator, List, Optional, Tuple, BinaryIO, Iterable
+
+# records ungrib reads with Vtable.GFS (WPS 4.5), as (field name, level) patterns of the NOAA .idx inventory
+# 1:0:d=2023071712:PRMSL:mean sea level:anl:
+_ISOBARIC = r"[\d.]+ mb"
+_SOIL_LAYER = r"[\d.]+-[\d.]+ m below ground"
+GFS_VTABLE_RECORDS = (
+    ("HGT", f"{_ISOBARIC}|surface"),
+    ("TMP", f"{_ISOBARIC}|2 m above ground|surface"),
+    ("RH", f"{_ISOBARIC}|2 m above ground"),
+    ("SPFH", f"{_ISOBARIC}|2 m above ground"),
+    ("UGRD", f"{_ISOBARIC}|10 m above ground"),
+    ("VGRD", f"{_ISOBARIC}|10 m above ground"),
+    ("PRES", "surface"),
+    ("PRMSL", "mean sea level"),
+    ("MSLET", "mean sea level"),
+    ("LAND", "surface"),
+    ("ICEC", "surface"),
+    ("WEASD", "surface"),
+    ("SNOD", "surface"),
+    ("SOILW", _SOIL_LAYER),
+    ("TSOIL", _SOIL_LAYER),
+)
+
+
+class GribRecord:
+
+    def __init__(self, number: int, offset: int, variable: str, level: str, end: Optional[int] = None) -> None:
+        self.number = number
+        self.offset = offset
+        self.variable = variable
+        self.level = level
+        self.end = end  # last byte, None for the last record of the file
+
+    def __repr__(self) -> str:
+        return f"GribRecord({self.number}, {self.variable}:{self.level}, {self.offset}-{self.end})"
+
+
+def parse_idx(idx_text: str) -> List[GribRecord]:
+    records = []
+    for line in idx_text.splitlines():
+        fields = line.split(":")
+        if len(fields) < 5:
+            continue
+        records.append(GribRecord(number=int(fields[0]), offset=int(fields[1]), variable=fields[3], level=fields[4]))
+
+    records.sort(key=lambda record: record.offset)
+    for record, next_record in zip(records, records[1:]):
+        record.end = next_record.offset - 1
+    return records
+
+
+def select_records(records: List[GribRecord], wanted: Iterable[Tuple[str, str]] = GFS_VTABLE_RECORDS) -> List[GribRecord]:
+    patterns = [(variable, re.compile(level)) for variable, level in wanted]
+    return [
+        record for record in records
+        if any(record.variable == variable and level.fullmatch(record.level) for variable, level in patterns)
+    ]
+
+
+def merge_byte_ranges(records: List[GribRecord], file_size: Optional[int] = None) -> List[Tuple[int, int]]:
+    """
+    Inclusive (first, last) byte ranges covering the records, neighbouring records are merged into one range.
+    """
+    ranges = []
+    for record in sorted(records, key=lambda record: record.offset):
+        end = record.end
+        if end is None:
+            if file_size is None:
+                raise ValueError(f"Size of the file is needed to fetch its last record {record}")
+            end = file_size - 1
+
+        if ranges and ranges[-1][1] + 1 == record.offset:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((record.offset, end))
+    return ranges
+
+
+class RangeWriter:
+    """
+    Writes the requested byte ranges of a remote file back to back into `target`.
+
+    Any span of the remote file can be passed to `write`, only the parts inside the requested ranges
+    are written. Multipart parts, a coalesced range or the whole file (server ignored the Range header)
+    are all handled the same way.
+    """
+
+    def __init__(self, target: BinaryIO, ranges: List[Tuple[int, int]]) -> None:
+        self.target = target
+        self.ranges = ranges
+        self.output_offsets = []
+        output_offset = 0
+        for first, last in ranges:
+            self.output_offsets.append(output_offset)
+            output_offset += last - first + 1
+        self.expected_size = output_offset
+
+    def write(self, span_start: int, data: bytes) -> None:
+        span_end = span_start + len(data) - 1
+        for (first, last), output_offset in zip(self.ranges, self.output_offsets):
+            if last < span_start or first > span_end:
+                continue
+            start, end = max(first, span_start), min(last, span_end)
+            self.target.seek(output_offset + start - first)
+            self.target.write(data[start - span_start:end - span_start + 1])
+
+
+class ChunkReader:
+    """ Reads delimited and fixed size blocks from an iterator of byte chunks. """
+
+    def __init__(self, chunks: Iterator[bytes]) -> None:
+        self._chunks = chunks
+        self._buffer = b""
+
+    def _fill(self) -> None:
+        for chunk in self._chunks:
+            if chunk:
+                self._buffer += chunk
+                return
+        raise EOFError
+
+    def read_until(self, delimiter: bytes) -> bytes:
+        while delimiter not in self._buffer:
+            self._fill()
+        index = self._buffer.index(delimiter) + len(delimiter)
+        block, self._buffer = self._buffer[:index], self._buffer[index:]
+        return block
+
+    def iter_exact(self, size: int) -> Iterator[bytes]:
+        while size > 0:
+            if not self._buffer:
+                self._fill()
+            block, self._buffer = self._buffer[:size], self._buffer[size:]
+            size -= len(block)
+            yield block
+
+
+_PART_CONTENT_RANGE = re.compile(rb"content-range:\s*bytes\s+(\d+)-(\d+)/", re.IGNORECASE)
+
+
+def write_multipart_byteranges(chunks: Iterator[bytes], writer: RangeWriter) -> None:
+    """
+    Parses a multipart/byteranges body, parts are written where they belong whatever their order.
+    """
+    reader = ChunkReader(chunks)
+    while True:
+        try:
+            part_headers = reader.read_until(b"\r\n\r\n")
+        except EOFError:
+            break
+        match = _PART_CONTENT_RANGE.search(part_headers)
+        if match is None:
+            # closing boundary
+            break
+
+        position = int(match.group(1))
+        for block in reader.iter_exact(int(match.group(2)) - position + 1):
+            writer.write(position, block)
+            position += len(block)
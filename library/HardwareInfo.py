@@ -0,0 +1,173 @@
+import os
+import shutil
+import subprocess
+from glob import glob
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+# rules of thumb for ARW, about 1 KB per grid point for the model state and a fixed cost per MPI rank
+BYTES_PER_GRID_POINT = 1024
+BYTES_PER_PROCESS = 150 * 1024 ** 2
+# WRF patches smaller than this in either direction spend more time in halo exchange than computing
+MIN_PATCH_SIZE = 10
+
+
+class HardwareInfo:
+
+    def __init__(self, logical_cpus: int, physical_cores: int, sockets: int, numa_nodes: int,
+                 memory_total_bytes: Optional[int], memory_available_bytes: Optional[int]) -> None:
+        self.logical_cpus = logical_cpus
+        self.physical_cores = physical_cores
+        self.sockets = sockets
+        self.numa_nodes = numa_nodes
+        self.memory_total_bytes = memory_total_bytes
+        self.memory_available_bytes = memory_available_bytes
+
+    @property
+    def threads_per_core(self) -> int:
+        return max(1, self.logical_cpus // max(1, self.physical_cores))
+
+    def to_dict(self) -> dict:
+        return {
+            "logical_cpus": self.logical_cpus,
+            "physical_cores": self.physical_cores,
+            "sockets": self.sockets,
+            "numa_nodes": self.numa_nodes,
+            "memory_total_bytes": self.memory_total_bytes,
+            "memory_available_bytes": self.memory_available_bytes,
+        }
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _meminfo() -> dict:
+    values = {}
+    for line in (_read("/proc/meminfo") or "").splitlines():
+        name, _, value = line.partition(":")
+        parts = value.split()
+        if parts and parts[0].isdigit():
+            values[name] = int(parts[0]) * 1024  # kB
+    return values
+
+
+def detect_hardware() -> HardwareInfo:
+    """ CPUs this process may run on (affinity, cgroup cpusets), their cores and sockets, NUMA nodes and memory. """
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = list(range(os.cpu_count() or 1))
+
+    cores, sockets = set(), set()
+    for cpu in cpus:
+        package = _read(f"/sys/devices/system/cpu/cpu{cpu}/topology/physical_package_id")
+        core = _read(f"/sys/devices/system/cpu/cpu{cpu}/topology/core_id")
+        if package is None or core is None:
+            # no topology in sysfs (some containers), count every cpu as a core
+            package, core = "0", str(cpu)
+        cores.add((package, core))
+        sockets.add(package)
+
+    numa_nodes = len(glob("/sys/devices/system/node/node[0-9]*")) or 1
+    meminfo = _meminfo()
+    return HardwareInfo(
+        logical_cpus=len(cpus),
+        physical_cores=len(cores),
+        sockets=len(sockets),
+        numa_nodes=numa_nodes,
+        memory_total_bytes=meminfo.get("MemTotal"),
+        memory_available_bytes=meminfo.get("MemAvailable"),
+    )
+
+
+def decompose(process_count: int, e_we: int, e_sn: int) -> Tuple[int, int]:
+    """ nproc_x, nproc_y with patches as close to square as possible. """
+    pairs = [(nx, process_count // nx) for nx in range(1, process_count + 1) if process_count % nx == 0]
+    return min(pairs, key=lambda pair: abs(e_we / pair[0] - e_sn / pair[1]))
+
+
+def estimate_memory_bytes(e_we: int, e_sn: int, e_vert: int, process_count: int) -> int:
+    return e_we * e_sn * e_vert * BYTES_PER_GRID_POINT + process_count * BYTES_PER_PROCESS
+
+
+def suggest_process_count(hardware: HardwareInfo, e_we: int, e_sn: int, e_vert: int = 45,
+                          omp_threads: int = 1) -> int:
+    """
+    MPI ranks for a domain: one per physical core (over `omp_threads` cores in hybrid builds), no more than
+    the grid can be split into patches of MIN_PATCH_SIZE, and fitting into the available memory.
+    """
+    count = max(1, hardware.physical_cores // max(1, omp_threads))
+    count = min(count, max(1, (e_we // MIN_PATCH_SIZE) * (e_sn // MIN_PATCH_SIZE)))
+
+    def fits(process_count: int) -> bool:
+        nproc_x, nproc_y = decompose(process_count, e_we, e_sn)
+        if e_we // nproc_x < MIN_PATCH_SIZE or e_sn // nproc_y < MIN_PATCH_SIZE:
+            return False
+        if hardware.memory_available_bytes is None:
+            return True
+        return estimate_memory_bytes(e_we, e_sn, e_vert, process_count) <= .8 * hardware.memory_available_bytes
+
+    while count > 1 and not fits(count):
+        count -= 1
+    return count
+
+
+@lru_cache(maxsize=1)
+def mpi_flavor() -> str:
+    """ "openmpi", "mpich" or "unknown", the binding options differ between them. """
+    if shutil.which("mpirun") is None:
+        return "unknown"
+    try:
+        version = subprocess.run(["mpirun", "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 timeout=10).stdout.decode("utf-8", errors="replace")
+    except (OSError, subprocess.TimeoutExpired):
+        return "unknown"
+    if "Open MPI" in version or "OpenRTE" in version:
+        return "openmpi"
+    if "HYDRA" in version or "MPICH" in version:
+        return "mpich"
+    return "unknown"
+
+
+def mpi_launch_command(executable: str, process_count: int, omp_threads: int = 1,
+                       hardware: Optional[HardwareInfo] = None, flavor: Optional[str] = None) -> List[str]:
+    """
+    mpirun command with each rank bound to its own core(s). Fewer ranks than cores are spread over the
+    NUMA nodes for memory bandwidth, hardware threads are only used when more ranks than physical cores
+    are asked for.
+    """
+    hardware = hardware or detect_hardware()
+    flavor = flavor or mpi_flavor()
+    omp_threads = max(1, omp_threads)
+    command = ["mpirun", "-np", str(process_count)]
+    used_cores = process_count * omp_threads
+    spread = hardware.numa_nodes > 1 and used_cores < hardware.physical_cores
+
+    unit = "hwthread" if used_cores > hardware.physical_cores else "core"
+    if flavor == "openmpi":
+        if unit == "hwthread":
+            command += ["--use-hwthread-cpus"]
+        mapping = "numa" if spread else unit
+        if omp_threads > 1:
+            mapping = f"{'numa' if spread else 'slot'}:PE={omp_threads}"
+        command += ["--map-by", mapping, "--bind-to", unit]
+    elif flavor == "mpich":
+        if spread:
+            command += ["-map-by", "numa"]
+        command += ["-bind-to", f"{unit}:{omp_threads}" if omp_threads > 1 else unit]
+
+    return command + [executable]
+
+
+def omp_environment(omp_threads: int) -> dict:
+    environment = dict(os.environ)
+    if omp_threads > 1:
+        environment.update({"OMP_NUM_THREADS": str(omp_threads), "OMP_PROC_BIND": "close", "OMP_PLACES": "cores"})
+    else:
+        environment["OMP_NUM_THREADS"] = "1"
+    return environment
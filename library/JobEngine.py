@@ -0,0 +1,352 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import signal
+import subprocess
+import traceback
+from pathlib import Path
+from logging import Logger
+from threading import Thread, Condition, Timer, local
+from typing import Callable, Dict, Iterable, List, Optional
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+_current = local()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+
+    def __init__(self, job_id: str, task: str, params: dict, depends_on: List[str], state: str = PENDING,
+                 created: float = None, started: float = None, finished: float = None, error: str = None,
+                 result=None, cancel_requested: bool = False, stages: Optional[dict] = None) -> None:
+        self.job_id = job_id
+        self.task = task
+        self.params = params
+        self.depends_on = depends_on
+        self.state = state
+        self.created = created or time.time()
+        self.started = started
+        self.finished = finished
+        self.error = error
+        self.result = result
+        self.cancel_requested = cancel_requested
+        self.stages = stages  # state and wall time of the stages of a task, see run_stages
+        self.processes = set()  # running subprocesses, killed on cancel
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "task": self.task,
+            "params": self.params,
+            "depends_on": self.depends_on,
+            "state": self.state,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+            "result": self.result,
+            "cancel_requested": self.cancel_requested,
+            "stages": self.stages,
+        }
+
+    @classmethod
+    def from_dict(cls, job_dict: dict) -> "Job":
+        return cls(**job_dict)
+
+
+def current_job() -> Optional[Job]:
+    """ Job the calling thread is running, None outside of the job engine. """
+    return getattr(_current, "job", None)
+
+
+def run_process(args, cwd: str = None, shell: bool = False, stdout=subprocess.PIPE,
+                env: dict = None) -> subprocess.CompletedProcess:
+    """
+    subprocess.run for the pipeline executables. Inside a job the process gets its own process group,
+    cancelling the job kills the whole group (mpirun and its ranks, shell=True children).
+    """
+    job = current_job()
+    if job is not None and job.cancel_requested:
+        raise JobCancelled(f"Job {job.job_id} is cancelled, not starting {args}.")
+    process = subprocess.Popen(args, cwd=cwd, shell=shell, stdout=stdout, stderr=subprocess.STDOUT, env=env,
+                               start_new_session=job is not None)
+    if job is None:
+        out, _ = process.communicate()
+        return subprocess.CompletedProcess(args, process.returncode, out)
+
+    job.processes.add(process)
+    try:
+        out, _ = process.communicate()
+    finally:
+        job.processes.discard(process)
+
+    if job.cancel_requested:
+        raise JobCancelled(f"{args} was stopped, job {job.job_id} is cancelled.")
+    return subprocess.CompletedProcess(args, process.returncode, out)
+
+
+class Stage:
+
+    def __init__(self, name: str, func: Callable, depends_on: Iterable[str] = ()) -> None:
+        self.name = name
+        self.func = func
+        self.depends_on = list(depends_on)
+
+
+def run_stages(stages: List[Stage]) -> Dict[str, dict]:
+    """
+    Runs each stage as soon as the stages it depends on are done, independent stages run at the same time.
+    Stages after a failed stage are cancelled, the others still run to the end. Returns the state and
+    wall time of every stage, inside a job the same report is kept in `job.stages`.
+    """
+    job = current_job()
+    report = {
+        stage.name: {"state": PENDING, "seconds": None, "depends_on": stage.depends_on} for stage in stages
+    }
+    if job is not None:
+        job.stages = report
+
+    def run(stage: Stage):
+        # run_process of the stage must see the job to be cancellable
+        _current.job = job
+        report[stage.name]["state"] = RUNNING
+        st = time.perf_counter()
+        try:
+            return stage.func()
+        finally:
+            report[stage.name]["seconds"] = round(time.perf_counter() - st, 3)
+            _current.job = None
+
+    errors = {}
+    submitted = set()
+    with ThreadPoolExecutor(max_workers=len(stages)) as pool:
+        in_flight = {}
+        while True:
+            for stage in stages:
+                if stage.name in submitted or report[stage.name]["state"] != PENDING:
+                    continue
+                dependency_states = [report[name]["state"] for name in stage.depends_on]
+                if any(state in (FAILED, CANCELLED) for state in dependency_states):
+                    report[stage.name]["state"] = CANCELLED
+                elif all(state == DONE for state in dependency_states):
+                    submitted.add(stage.name)
+                    in_flight[pool.submit(run, stage)] = stage
+
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = in_flight.pop(future)
+                try:
+                    future.result()
+                    report[stage.name]["state"] = DONE
+                except JobCancelled as e:
+                    report[stage.name]["state"] = CANCELLED
+                    errors[stage.name] = e
+                except Exception as e:
+                    report[stage.name]["state"] = FAILED
+                    errors[stage.name] = e
+
+    if any(isinstance(error, JobCancelled) for error in errors.values()):
+        raise JobCancelled(f"Stages cancelled: {list(errors)}")
+    if errors:
+        raise RuntimeError("; ".join(f"{name}: {error}" for name, error in errors.items()))
+    return report
+
+
+def _kill_process_group(process: subprocess.Popen, sig: int) -> None:
+    if process.poll() is not None:
+        return
+    try:
+        os.killpg(process.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class JobEngine:
+    """
+    Runs registered tasks on a fixed number of worker threads.
+
+    Every job is persisted as `<job id>.json` in `folder`, pending jobs survive a restart and jobs
+    that were running when the app stopped are marked failed. A job only starts once all of its
+    `depends_on` jobs are done, it is cancelled if one of them fails or is cancelled.
+    """
+
+    def __init__(self, folder: Path, max_concurrent: int = 1, max_finished_jobs: int = 200,
+                 logger: Logger = None) -> None:
+        self.folder = Path(folder)
+        self.max_concurrent = max_concurrent
+        self.max_finished_jobs = max_finished_jobs
+        self.logger = logger
+        self._tasks: Dict[str, Callable] = {}
+        self._jobs: Dict[str, Job] = {}
+        self._condition = Condition()
+        self._workers: List[Thread] = []
+        self._stopping = False
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def register(self, name: str, task: Callable) -> None:
+        """ task is called with the params of the job as keyword arguments, the return value is the job result. """
+        self._tasks[name] = task
+
+    def start(self) -> None:
+        with self._condition:
+            if self._workers:
+                return
+            for i in range(self.max_concurrent):
+                worker = Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+        atexit.register(self.shutdown)
+
+    def submit(self, task: str, params: dict = None, depends_on: List[str] = ()) -> Job:
+        if task not in self._tasks:
+            raise ValueError(f"Unknown task: {task}")
+
+        job_id = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        job = Job(job_id=job_id, task=task, params=params or {}, depends_on=list(depends_on))
+        with self._condition:
+            self._jobs[job_id] = job
+            self._save(job)
+            self._prune()
+            self._condition.notify_all()
+        self._log(f"Submitted job {job_id} ({task}), depends on {job.depends_on}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Job]:
+        with self._condition:
+            return sorted(self._jobs.values(), key=lambda job: job.created, reverse=True)
+
+    def cancel(self, job_id: str) -> bool:
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.state in FINISHED_STATES:
+                return False
+
+            job.cancel_requested = True
+            if job.state == PENDING:
+                self._finish(job, CANCELLED, error="Cancelled before it started.")
+            for process in list(job.processes):
+                _kill_process_group(process, signal.SIGTERM)
+                # mpirun forwards SIGTERM to the ranks, anything still alive is killed a bit later
+                Timer(10, _kill_process_group, args=(process, signal.SIGKILL)).start()
+            self._save(job)
+        self._log(f"Cancel requested for job {job_id}")
+        return True
+
+    def shutdown(self) -> None:
+        with self._condition:
+            self._stopping = True
+            running = [job.job_id for job in self._jobs.values() if job.state == RUNNING]
+            self._condition.notify_all()
+        # do not leave orphan model runs behind
+        for job_id in running:
+            self.cancel(job_id)
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                job = self._next_runnable()
+                while job is None and not self._stopping:
+                    self._condition.wait()
+                    job = self._next_runnable()
+                if self._stopping:
+                    return
+                job.state = RUNNING
+                job.started = time.time()
+                self._save(job)
+            self._run(job)
+
+    def _next_runnable(self) -> Optional[Job]:
+        for job in sorted(self._jobs.values(), key=lambda job: job.created):
+            if job.state != PENDING:
+                continue
+            dependencies = [self._jobs.get(job_id) for job_id in job.depends_on]
+            broken = [
+                job_id for job_id, dependency in zip(job.depends_on, dependencies)
+                if dependency is None or dependency.state in (FAILED, CANCELLED)
+            ]
+            if broken:
+                self._finish(job, CANCELLED, error=f"Dependencies did not complete: {broken}")
+                continue
+            if all(dependency.state == DONE for dependency in dependencies):
+                return job
+        return None
+
+    def _run(self, job: Job) -> None:
+        self._log(f"Starting job {job.job_id} ({job.task})")
+        _current.job = job
+        state, result, error = DONE, None, None
+        try:
+            result = self._tasks[job.task](**job.params)
+        except JobCancelled as e:
+            state, error = CANCELLED, str(e)
+        except Exception as e:
+            state, error = (CANCELLED, str(e)) if job.cancel_requested else (FAILED, f"{type(e).__name__}: {e}")
+            self._log(f"Job {job.job_id} ({job.task}) failed, details:\n{traceback.format_exc()}")
+        finally:
+            _current.job = None
+
+        with self._condition:
+            job.result = result
+            self._finish(job, state, error=error)
+            self._condition.notify_all()
+        self._log(f"Job {job.job_id} ({job.task}) {state} in {job.finished - job.started:.1f}s")
+
+    def _finish(self, job: Job, state: str, error: str = None) -> None:
+        job.state = state
+        job.error = error
+        job.finished = time.time()
+        self._save(job)
+
+    def _prune(self) -> None:
+        finished = sorted((job for job in self._jobs.values() if job.state in FINISHED_STATES),
+                          key=lambda job: job.created)
+        for job in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job.job_id]
+            self._job_path(job.job_id).unlink(missing_ok=True)
+
+    def _job_path(self, job_id: str) -> Path:
+        return self.folder.joinpath(f"{job_id}.json")
+
+    def _save(self, job: Job) -> None:
+        job_path = self._job_path(job.job_id)
+        tmp_path = job_path.with_name(f".{job_path.name}.tmp")
+        with open(tmp_path, "w") as job_file:
+            json.dump(job.to_dict(), job_file, indent=1, default=str)
+        os.replace(tmp_path, job_path)
+
+    def _load(self) -> None:
+        for job_path in self.folder.glob("*.json"):
+            try:
+                with open(job_path) as job_file:
+                    job = Job.from_dict(json.load(job_file))
+            except (ValueError, TypeError) as e:
+                self._log(f"Skipping unreadable job file {job_path}, details: {e}")
+                continue
+            if job.state == RUNNING:
+                job.state = FAILED
+                job.error = "Interrupted by a restart."
+                job.finished = time.time()
+                self._save(job)
+            self._jobs[job.job_id] = job
+
+    def _log(self, message: str) -> None:
+        if self.logger is not None:
+            self.logger.info(message)
@@ -0,0 +1,144 @@
+import os
+import re
+from pathlib import Path
+from collections import deque
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+# Timing for main: time 2023-07-17_12:01:30 on domain   1:    0.51234 elapsed seconds
+_TIMING_LINE = re.compile(
+    r"Timing for main: time (\d{4}-\d{2}-\d{2}_\d{2}:\d{2}:\d{2}) on domain\s+(\d+):\s+([\d.]+) elapsed seconds"
+)
+_WRF_TIME_FMT = "%Y-%m-%d_%H:%M:%S"
+
+
+def read_new_lines(path: Path, offset: int = 0, max_bytes: int = 64 * 1024) -> Tuple[List[str], int]:
+    """
+    Complete lines written to `path` after `offset`, at most `max_bytes` per call.
+    Returns the lines and the offset to continue from. A file that shrank (rsl files of a new run)
+    is read again from the start.
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return [], offset
+    if size < offset:
+        offset = 0
+    if size == offset:
+        return [], offset
+
+    with open(path, "rb") as log_file:
+        log_file.seek(offset)
+        data = log_file.read(max_bytes)
+
+    # keep a partial last line for the next call, unless it alone fills the read
+    end = data.rfind(b"\n") + 1
+    if end == 0 and len(data) < max_bytes:
+        return [], offset
+    if end == 0:
+        end = len(data)
+    lines = data[:end].decode("utf-8", errors="replace").splitlines()
+    return lines, offset + end
+
+
+def read_last_bytes(path: Path, max_bytes: int = 64 * 1024, end: Optional[int] = None) -> List[str]:
+    """
+    Lines of the last `max_bytes` before `end` (end of the file by default), the first line is dropped
+    when it may be partial.
+    """
+    try:
+        with open(path, "rb") as log_file:
+            log_file.seek(0, os.SEEK_END)
+            end = log_file.tell() if end is None else min(end, log_file.tell())
+            start = max(0, end - max_bytes)
+            log_file.seek(start)
+            data = log_file.read(end - start)
+    except OSError:
+        return []
+    lines = data.decode("utf-8", errors="replace").splitlines()
+    return lines[1:] if start > 0 else lines
+
+
+def run_period_from_namelist(namelist_input_path: Path) -> Optional[Tuple[datetime, datetime]]:
+    """ Start and end date of domain 1 from namelist.input. """
+    try:
+        with open(namelist_input_path) as namelist_file:
+            namelist = namelist_file.read()
+    except OSError:
+        return None
+
+    def first_value(name: str) -> int:
+        match = re.search(rf"^\s*{name}\s*=\s*(\d+)", namelist, re.MULTILINE)
+        return int(match.group(1)) if match else 0
+
+    try:
+        start = datetime(*(first_value(f"start_{part}") for part in ("year", "month", "day", "hour", "minute", "second")))
+        end = datetime(*(first_value(f"end_{part}") for part in ("year", "month", "day", "hour", "minute", "second")))
+    except ValueError:
+        return None
+    return start, end
+
+
+class WrfProgress:
+    """
+    Progress of a running wrf.exe from the "Timing for main" lines of rsl.out.0000.
+
+    Throughput is simulated seconds per wall clock second over the last `window` time steps,
+    the ETA assumes it stays the same for the rest of the run.
+    """
+
+    def __init__(self, start: Optional[datetime] = None, end: Optional[datetime] = None, domain: int = 1,
+                 window: int = 20) -> None:
+        self.start = start
+        self.end = end
+        self.domain = domain
+        self.simulated_time: Optional[datetime] = None
+        self.steps = 0
+        self._recent = deque(maxlen=window)  # (simulated seconds of the step, elapsed wall seconds)
+
+    def feed(self, line: str) -> bool:
+        """ Returns True if the line was a timing line of the tracked domain. """
+        match = _TIMING_LINE.search(line)
+        if match is None or int(match.group(2)) != self.domain:
+            return False
+
+        simulated_time = datetime.strptime(match.group(1), _WRF_TIME_FMT)
+        elapsed = float(match.group(3))
+        # the first line seen may be anywhere in the run (tail of a log), only steps between lines count
+        if self.simulated_time is not None:
+            self._recent.append(((simulated_time - self.simulated_time).total_seconds(), elapsed))
+        self.simulated_time = simulated_time
+        self.steps += 1
+        return True
+
+    @property
+    def throughput(self) -> Optional[float]:
+        wall_seconds = sum(elapsed for _, elapsed in self._recent)
+        if wall_seconds <= 0:
+            return None
+        return sum(simulated for simulated, _ in self._recent) / wall_seconds
+
+    @property
+    def fraction(self) -> Optional[float]:
+        if None in (self.start, self.end, self.simulated_time) or self.end <= self.start:
+            return None
+        done = (self.simulated_time - self.start).total_seconds() / (self.end - self.start).total_seconds()
+        return min(1., max(0., done))
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        throughput = self.throughput
+        if None in (self.end, self.simulated_time) or not throughput:
+            return None
+        return max(0., (self.end - self.simulated_time).total_seconds() / throughput)
+
+    def to_dict(self) -> dict:
+        return {
+            "simulated_time": self.simulated_time.strftime(_WRF_TIME_FMT) if self.simulated_time else None,
+            "start": self.start.strftime(_WRF_TIME_FMT) if self.start else None,
+            "end": self.end.strftime(_WRF_TIME_FMT) if self.end else None,
+            "steps": self.steps,
+            "fraction": self.fraction,
+            "throughput": self.throughput,
+            "eta_seconds": self.eta_seconds,
+        }
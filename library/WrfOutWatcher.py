@@ -0,0 +1,163 @@
+import os
+import re
+import threading
+from glob import glob
+from pathlib import Path
+from logging import Logger
+from typing import Callable, Dict, List, Optional
+
+from netCDF4 import Dataset
+
+# wrfout_d01_2023-07-17_12:00:00
+_WRFOUT_NAME = re.compile(r"^wrfout_d(\d+)_")
+
+
+def frame_count(path: Path) -> Optional[int]:
+    """ Length of the Time dimension, None while the file can not be read (header being written). """
+    try:
+        with Dataset(path, mode="r") as dataset:
+            return dataset.dimensions["Time"].size
+    except (OSError, KeyError, RuntimeError):
+        return None
+
+
+def is_in_progress(path: Path) -> bool:
+    """ Files of a running wrf.exe are exposed in the output folder as links into the run folder. """
+    path = Path(path)
+    if path.is_dir():
+        return any(entry.is_symlink() for entry in os.scandir(path))
+    return path.is_symlink()
+
+
+class WrfOutWatcher:
+    """
+    Follows the wrfout files of a running wrf.exe and links them into the output folder as they appear.
+
+    WRF appends history frames to the newest file of a domain, the last frame of that file may be half
+    written so it only counts as complete once the next frame or the next file of the domain appears.
+    `on_new_frames(link_path, timeidxs)` is called from the watcher thread for every newly completed frame.
+    """
+
+    def __init__(self, run_folder: Path, output_folder: Path,
+                 on_new_frames: Optional[Callable[[Path, List[int]], None]] = None,
+                 poll_seconds: float = 30., split_runs: bool = False, logger: Logger = None) -> None:
+        self.run_folder = Path(run_folder)
+        self.output_folder = Path(output_folder)
+        self.on_new_frames = on_new_frames
+        self.poll_seconds = poll_seconds
+        # per-time files (frames_per_outfile = 1) are linked into a run folder per domain, see WrfOutRun
+        self.split_runs = split_runs
+        self.logger = logger
+        self.links: List[Path] = []
+        self._complete_frames: Dict[str, int] = {}
+        self._created = set()
+        self._skipped = set()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._watch, name="wrfout-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def remove_links(self) -> None:
+        """ Links of a failed run, its partial files stay in the run folder. """
+        for link in self.links:
+            if link.is_symlink():
+                link.unlink()
+            if self.split_runs:
+                try:
+                    link.parent.rmdir()
+                except OSError:
+                    pass
+        self.links = []
+
+    def poll(self) -> Dict[str, List[int]]:
+        """
+        Links new files and returns the newly completed time indexes per exposed name, the file name or
+        with split_runs the run folder name and time indexes of the whole run.
+        """
+        domains = {}
+        for path in sorted(Path(path) for path in glob(str(self.run_folder.joinpath("wrfout_d*")))):
+            match = _WRFOUT_NAME.match(path.name)
+            if match is not None:
+                # file names end with their first valid time, sorted they follow the run
+                domains.setdefault(match.group(1), []).append(path)
+
+        new_frames = {}
+        for paths in domains.values():
+            run_name = paths[0].name
+            offset = 0
+            for path in paths:
+                count = frame_count(path)
+                if not count:
+                    break
+                if path == paths[-1]:
+                    # the file wrf.exe writes into
+                    count -= 1
+                done = self._complete_frames.get(path.name, 0)
+                if count > done:
+                    link = self._link(path, run_name)
+                    if link is not None:
+                        self._complete_frames[path.name] = count
+                        target = link.parent if self.split_runs else link
+                        timeidxs = [offset + timeidx for timeidx in range(done, count)]
+                        new_frames.setdefault(target.name, []).extend(timeidxs)
+                        self._notify(target, timeidxs)
+                offset += count
+        return new_frames
+
+    def _notify(self, target: Path, timeidxs: List[int]) -> None:
+        if self.on_new_frames is None:
+            return
+        try:
+            self.on_new_frames(target, timeidxs)
+        except Exception as e:
+            self._log(f"Exception occurred handling new frames of {target.name}, details: \n{e}")
+
+    def _link(self, path: Path, run_name: str) -> Optional[Path]:
+        if self.split_runs:
+            run_folder = self.output_folder.joinpath(run_name)
+            if run_name in self._skipped or (run_name not in self._created and run_folder.exists()):
+                # run folder of an earlier run with the same name, move_wrf_outs replaces it when this run finishes
+                if run_name not in self._skipped:
+                    self._log(f"{run_folder} exists, {run_name} is shown once the run finishes.")
+                self._skipped.add(run_name)
+                return None
+            run_folder.mkdir(exist_ok=True)
+            self._created.add(run_name)
+            link = run_folder.joinpath(path.name)
+        else:
+            link = self.output_folder.joinpath(path.name)
+            if path.name in self._skipped:
+                return None
+            if link.exists() and not link.is_symlink():
+                self._log(f"{link} exists, {path.name} is shown once the run finishes.")
+                self._skipped.add(path.name)
+                return None
+
+        if link.is_symlink():
+            return link
+        tmp_link = link.with_name(f".{link.name}.tmp")
+        if tmp_link.is_symlink():
+            tmp_link.unlink()
+        os.symlink(path.absolute(), tmp_link)
+        os.replace(tmp_link, link)
+        self.links.append(link)
+        self._log(f"Linked running wrfout {path.name}")
+        return link
+
+    def _watch(self) -> None:
+        while not self._stop_event.wait(self.poll_seconds):
+            try:
+                self.poll()
+            except Exception as e:
+                self._log(f"Exception occurred watching {self.run_folder}, details: \n{e}")
+
+    def _log(self, message: str) -> None:
+        if self.logger is not None:
+            self.logger.info(message)
@@ -0,0 +1,132 @@
+import os
+import logging
+from pathlib import Path
+from logging import Logger
+from threading import RLock
+from typing import Dict, Optional, Tuple, Union
+
+from netCDF4 import Dataset
+
+from library.cache.LRUCache import LRUCache
+from library.models.WRFData import WRFData
+from library.models.IsobaricStore import open_isobaric_store
+from library.models.WrfOutRun import WrfOutRun, open_wrfout, wrfout_size
+
+
+class DatasetPool:
+    """
+    Keeps recently used wrfout files and split-by-time run folders open.
+
+    Entries are keyed by (absolute path, mtime) so a file which is replaced on disk is reopened
+    instead of being served from a stale handle. The byte budget is measured with the on-disk size
+    of the file which is a reasonable upper bound of what netCDF4 and wrf-python keep in memory.
+
+    The pool is shared by every request thread. Datasets handed out with `acquire` are leased, an
+    entry evicted or invalidated while leased is closed when its last lease is released.
+    """
+
+    def __init__(self, max_open_files: int = 4, max_bytes: Optional[int] = None,
+                 diagnostic_cache_bytes: Optional[int] = None, isobaric_store_folder: Optional[Path] = None,
+                 logger: Logger = None) -> None:
+        self.logger = logger or logging.getLogger(__name__)
+        self.diagnostic_cache_bytes = diagnostic_cache_bytes
+        self.isobaric_store_folder = isobaric_store_folder
+        self._lock = RLock()
+        self._leases: Dict[int, int] = {}  # id(WRFData) -> lease count
+        self._retired: Dict[int, tuple] = {}  # evicted while leased, id(WRFData) -> (key, entry)
+        self._cache = LRUCache(
+            max_items=max_open_files,
+            max_bytes=max_bytes,
+            size_of=lambda entry: entry[2],
+            on_evict=self._evict_entry
+        )
+
+    def get(self, file_path: Path, in_progress: bool = False) -> WRFData:
+        """ in_progress: the file is still written by wrf.exe, see WRFData. """
+        key = self._key(file_path)
+        with self._lock:
+            entry = self._cache.get_or_create(key, lambda: self._open(file_path, in_progress))
+            if key not in self._cache:
+                # larger than max_bytes, not pooled and closed by the release of its lease
+                self._retired[id(entry[1])] = (key, entry)
+        return entry[1]
+
+    def acquire(self, file_path: Path, in_progress: bool = False) -> WRFData:
+        """
+        get with a lease, the dataset stays open until `release` even if it leaves the pool. Files over
+        max_bytes are opened for each lease.
+        """
+        with self._lock:
+            data = self.get(file_path, in_progress=in_progress)
+            self._leases[id(data)] = self._leases.get(id(data), 0) + 1
+        return data
+
+    def release(self, data: WRFData) -> None:
+        with self._lock:
+            count = self._leases.get(id(data), 0) - 1
+            if count > 0:
+                self._leases[id(data)] = count
+                return
+            self._leases.pop(id(data), None)
+            retired = self._retired.pop(id(data), None)
+        if retired is not None:
+            self._close_entry(*retired)
+
+    def invalidate(self, file_path: Path) -> int:
+        path_str = str(Path(file_path).absolute())
+        with self._lock:
+            return self._cache.invalidate(lambda key: key[0] == path_str)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    @property
+    def stats(self) -> dict:
+        return self._cache.stats
+
+    @staticmethod
+    def _key(file_path: Path) -> Tuple[str, int]:
+        file_path = Path(file_path).absolute()
+        return str(file_path), os.stat(file_path).st_mtime_ns
+
+    def _open(self, file_path: Path, in_progress: bool = False) -> Tuple[Union[Dataset, WrfOutRun], WRFData, int]:
+        self._log(f"Opening dataset from file: {file_path}")
+        dataset = open_wrfout(file_path)
+        isobaric_store = None
+        try:
+            if self.isobaric_store_folder is not None:
+                isobaric_store = open_isobaric_store(file_path, self.isobaric_store_folder)
+                if isobaric_store is not None:
+                    self._log(f"Using isobaric store for: {file_path}")
+
+            wrf_data_kwargs = {"isobaric_store": isobaric_store, "in_progress": in_progress}
+            if self.diagnostic_cache_bytes is not None:
+                wrf_data_kwargs["diagnostic_cache_bytes"] = self.diagnostic_cache_bytes
+            data = WRFData(dataset, **wrf_data_kwargs)
+        except Exception:
+            dataset.close()
+            if isobaric_store is not None:
+                isobaric_store.close()
+            raise
+        return dataset, data, wrfout_size(file_path)
+
+    def _evict_entry(self, key: Tuple[str, int], entry: Tuple[Union[Dataset, WrfOutRun], WRFData, int]) -> None:
+        with self._lock:
+            if self._leases.get(id(entry[1])):
+                # still read by a request, closed by its release
+                self._retired[id(entry[1])] = (key, entry)
+                return
+        self._close_entry(key, entry)
+
+    def _close_entry(self, key: Tuple[str, int], entry: Tuple[Union[Dataset, WrfOutRun], WRFData, int]) -> None:
+        dataset, data, _ = entry
+        try:
+            data.close_isobaric_store()
+            dataset.close()
+            self._log(f"Closed dataset {key[0]}")
+        except Exception as e:
+            self._log(f"Exception closing netCDF4 dataset {key[0]}.\n{e}")
+
+    def _log(self, message: str) -> None:
+        self.logger.info(message)
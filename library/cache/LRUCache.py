@@ -0,0 +1,125 @@
+from threading import RLock
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Bounded mapping with least-recently-used eviction.
+
+    Entries are limited both by count and by an approximate byte budget, the size of an entry is
+    measured once with `size_of` when it is stored. `on_evict(key, value)` is called for every
+    entry leaving the cache so owners can release resources (close files etc.).
+    """
+
+    def __init__(self,
+                 max_items: int = 128,
+                 max_bytes: Optional[int] = None,
+                 size_of: Callable[[Any], int] = None,
+                 on_evict: Callable[[Hashable, Any], None] = None) -> None:
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._size_of = size_of if size_of is not None else (lambda _: 0)
+        self._on_evict = on_evict
+
+        self._entries: OrderedDict = OrderedDict()
+        self._sizes: dict = {}
+        self._lock = RLock()
+
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any) -> bool:
+        """
+        False if the value is larger than the whole byte budget, it is not stored then and stays owned by
+        the caller, on_evict is not called for it.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key, notify=self._entries[key] is not value)
+
+            size = self._size_of(value)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return False
+
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.current_bytes += size
+            self._shrink()
+            return True
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """ A created value too large to be stored is returned uncached, see put. """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+            self.misses += 1
+            value = factory()
+            self.put(key, value)
+            return value
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._entries)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "items": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_items": self.max_items,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def _shrink(self) -> None:
+        while len(self._entries) > self.max_items or \
+                (self.max_bytes is not None and self.current_bytes > self.max_bytes):
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key: Hashable, notify: bool = True) -> None:
+        value = self._entries.pop(key)
+        self.current_bytes -= self._sizes.pop(key, 0)
+        if notify and self._on_evict is not None:
+            self._on_evict(key, value)
@@ -0,0 +1,107 @@
+import os
+import hashlib
+from pathlib import Path
+from logging import Logger
+from threading import Lock, get_ident
+from typing import Optional
+
+
+class RenderCache:
+    """
+    Rendered images on disk, addressed by a digest of everything that changes the picture.
+
+    File names are `<source digest>_<render digest>.<format>`, the source digest only depends on the path
+    of the wrfout so every image of a file can be dropped at once. The render digest includes the
+    mtime of the source, an image of an older version of a file is never served.
+    Reads touch the file mtime, eviction removes the least recently used images once the folder
+    grows over `max_bytes`.
+    """
+
+    def __init__(self, folder: Path, max_bytes: int = 2 * 1024 ** 3, logger: Logger = None) -> None:
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes
+        self.logger = logger
+        self._lock = Lock()
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.current_bytes = sum(entry.stat().st_size for entry in self._entries())
+
+    @staticmethod
+    def source_digest(source_path: Path) -> str:
+        return hashlib.sha1(str(Path(source_path).absolute()).encode("utf-8")).hexdigest()[:16]
+
+    def key_for(self, source_path: Path, version: Optional[str] = None, **render_params) -> str:
+        """ version identifies the rendered content of the source, its mtime by default. """
+        source_path = Path(source_path).absolute()
+        params = [f"mtime={os.stat(source_path).st_mtime_ns}" if version is None else f"version={version}"]
+        params.extend(f"{name}={render_params[name]!r}" for name in sorted(render_params))
+        render_digest = hashlib.sha1("&".join(params).encode("utf-8")).hexdigest()
+        return f"{self.source_digest(source_path)}_{render_digest}"
+
+    def path_for(self, key: str, fmt: str = "png") -> Path:
+        return self.folder.joinpath(f"{key}.{fmt}")
+
+    def get(self, key: str, fmt: str = "png") -> Optional[Path]:
+        image_path = self.path_for(key, fmt)
+        try:
+            os.utime(image_path)
+        except FileNotFoundError:
+            return None
+        return image_path
+
+    def put(self, key: str, image: bytes, fmt: str = "png") -> Path:
+        tmp_path = self.temporary_path_for(key, fmt)
+        with open(tmp_path, "wb") as image_file:
+            image_file.write(image)
+        return self.put_file(key, tmp_path, fmt=fmt)
+
+    def temporary_path_for(self, key: str, fmt: str = "png") -> Path:
+        # hidden names are ignored by eviction and size accounting until put_file
+        return self.folder.joinpath(f".{key}.{fmt}.{os.getpid()}.{get_ident()}.tmp")
+
+    def put_file(self, key: str, file_path: Path, fmt: str = "png") -> Path:
+        """ Moves a file written elsewhere (e.g. an encoded animation) into the cache. """
+        image_path = self.path_for(key, fmt)
+        size = os.path.getsize(file_path)
+        os.replace(file_path, image_path)
+
+        with self._lock:
+            self.current_bytes += size
+            if self.current_bytes > self.max_bytes:
+                self._evict()
+        return image_path
+
+    def invalidate(self, source_path: Path) -> int:
+        prefix = f"{self.source_digest(source_path)}_"
+        removed = 0
+        with self._lock:
+            for entry in self._entries():
+                if entry.name.startswith(prefix):
+                    removed += self._remove(entry)
+        self._log(f"Removed {removed} rendered images of {source_path}")
+        return removed
+
+    def _evict(self) -> None:
+        # least recently used first, keep 10 percent headroom to not scan the folder on every put
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        self.current_bytes = sum(entry.stat().st_size for entry in entries)
+        target_bytes = self.max_bytes * 0.9
+        for entry in entries:
+            if self.current_bytes <= target_bytes:
+                break
+            self._remove(entry)
+
+    def _remove(self, entry: os.DirEntry) -> int:
+        try:
+            size = entry.stat().st_size
+            os.remove(entry.path)
+        except FileNotFoundError:
+            return 0
+        self.current_bytes -= size
+        return 1
+
+    def _entries(self) -> [os.DirEntry]:
+        return [entry for entry in os.scandir(self.folder) if entry.is_file() and not entry.name.startswith(".")]
+
+    def _log(self, message: str) -> None:
+        if self.logger is not None:
+            self.logger.info(message)
@@ -0,0 +1,94 @@
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import xarray as xr
+
+from netCDF4 import Dataset
+
+from library.models.WRFData import WRFData
+from library.models.WrfOutRun import open_wrfout
+
+# Companion file of a wrfout with the upper air fields already interpolated to the standard
+# pressure levels for every time step, see WRFData.isobaric_fields.
+STORE_SUFFIX = "_isobaric.nc"
+SOURCE_MTIME_ATTRIBUTE = "source_mtime_ns"
+
+
+def isobaric_store_path(wrfout_path: Path, store_folder: Path) -> Path:
+    return Path(store_folder).joinpath(f"{Path(wrfout_path).name}{STORE_SUFFIX}")
+
+
+def write_isobaric_store(wrfout_path: Path, store_folder: Path) -> Path:
+    wrfout_path = Path(wrfout_path)
+    target_path = isobaric_store_path(wrfout_path, store_folder)
+    tmp_path = target_path.with_name(f".{target_path.name}.tmp")
+
+    source = open_wrfout(wrfout_path)
+    try:
+        # own WRFData without a store attached, values must come from the raw model levels
+        data = WRFData(source)
+        data.load_base_variables()
+        time_count = len(data.available_times)
+        y_count = len(data.ds.dimensions["south_north"])
+        x_count = len(data.ds.dimensions["west_east"])
+        levels = data.STANDARD_PRESSURE_LEVELS
+
+        with Dataset(tmp_path, mode="w", format="NETCDF4") as store:
+            store.setncattr(SOURCE_MTIME_ATTRIBUTE, str(os.stat(wrfout_path).st_mtime_ns))
+            store.setncattr("TITLE", f"Isobaric levels of {wrfout_path.name}")
+            store.createDimension("Time", None)
+            store.createDimension("level", len(levels))
+            store.createDimension("south_north", y_count)
+            store.createDimension("west_east", x_count)
+
+            level_var = store.createVariable("level", "f4", ("level",))
+            level_var.units = "hPa"
+            level_var[:] = np.asarray(levels)
+
+            lats, lons = data.latitudes_and_longitudes_as_np_array
+            for name, values in (("XLAT", lats), ("XLONG", lons)):
+                coord_var = store.createVariable(name, "f4", ("south_north", "west_east"), zlib=True)
+                coord_var[:] = values
+
+            variables = {}
+            for timeidx in range(time_count):
+                fields = data.isobaric_fields(timeidx=timeidx)
+                for var_name in data.ISOBARIC_VARIABLES:
+                    field = fields[var_name]
+                    if var_name not in variables:
+                        variables[var_name] = store.createVariable(
+                            var_name, "f4", ("Time", "level", "south_north", "west_east"),
+                            zlib=True, complevel=4, chunksizes=(1, 1, y_count, x_count),
+                            fill_value=np.float32(np.nan)
+                        )
+                        variables[var_name].units = field.attrs.get("units", "")
+                        variables[var_name].coordinates = "XLONG XLAT"
+                    variables[var_name][timeidx] = field.values.astype(np.float32)
+
+                # one time step at a time, keep only the latest fields in memory
+                data.clear_diagnostic_cache()
+
+        os.replace(tmp_path, target_path)
+    finally:
+        source.close()
+        if tmp_path.exists():
+            os.remove(tmp_path)
+
+    return target_path
+
+
+def open_isobaric_store(wrfout_path: Path, store_folder: Path) -> Optional[xr.Dataset]:
+    """
+    Lazily opened store of the wrfout, None if there is no store or it was written for an older file.
+    """
+    store_path = isobaric_store_path(wrfout_path, store_folder)
+    if not store_path.exists():
+        return None
+
+    store = xr.open_dataset(store_path, engine="netcdf4", cache=False)
+    if store.attrs.get(SOURCE_MTIME_ATTRIBUTE) != str(os.stat(wrfout_path).st_mtime_ns):
+        store.close()
+        return None
+    return store
@@ -0,0 +1,164 @@
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import wrf
+import numpy as np
+
+from scipy.spatial import cKDTree
+
+from library.models.WRFData import WRFData
+
+EARTH_RADIUS_KM = 6371.
+
+# raw variables of the meteogram, all of them are single level fields except the slp column
+SURFACE_VARIABLES = ("T2", "Q2", "PSFC", "U10", "V10", "RAINC", "RAINNC", "COSALPHA", "SINALPHA")
+SLP_COLUMN_VARIABLES = ("P", "PB", "T", "QVAPOR", "PH", "PHB")
+
+METEOGRAM_UNITS = {
+    "T2": "degC",
+    "td2": "degC",
+    "rh2": "%",
+    "wspd10": "m s-1",
+    "wdir10": "degree",
+    "rain": "mm",
+    "rain_total": "mm",
+    "slp": "hPa",
+}
+
+
+def _to_unit_vectors(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    lats, lons = np.radians(lats), np.radians(lons)
+    return np.column_stack([np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)])
+
+
+class GridPointIndex:
+    """
+    Nearest mass grid point of a WRF domain for a latitude/longitude.
+
+    Points are stored as unit vectors on the sphere so the KD-tree works for any map projection and
+    across the date line. Built once per domain, a lookup is a tree query.
+    """
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, grid_spacing_m: float) -> None:
+        self.shape = lats.shape
+        self.lats = lats
+        self.lons = lons
+        self.grid_spacing_km = grid_spacing_m / 1000.
+        self._tree = cKDTree(_to_unit_vectors(lats.ravel(), lons.ravel()))
+
+    def nearest(self, lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (south_north, west_east) indexes and distance in km of the nearest grid points. Points further than
+        about a grid spacing from every grid point are outside of the domain, their indexes are -1.
+        """
+        lats, lons = np.atleast_1d(lats).astype(float), np.atleast_1d(lons).astype(float)
+        chord, flat_index = self._tree.query(_to_unit_vectors(lats, lons))
+        distance_km = 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+        south_north, west_east = np.unravel_index(flat_index, self.shape)
+        outside = distance_km > 1.5 * self.grid_spacing_km
+        south_north[outside] = -1
+        west_east[outside] = -1
+        return south_north, west_east, distance_km
+
+
+def dewpoint_and_rh(t2_k: np.ndarray, q2: np.ndarray, psfc_pa: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ 2 m dew point (degC) and relative humidity (%) with the Bolton formulas wrf-python uses. """
+    q2 = np.maximum(q2, 1e-10)
+    vapor_pressure = q2 * (psfc_pa / 100.) / (.622 + q2)  # hPa
+    log_ratio = np.log(vapor_pressure / 6.112)
+    dewpoint = 243.5 * log_ratio / (17.67 - log_ratio)
+    t2_c = t2_k - 273.15
+    saturation = 6.112 * np.exp(17.67 * t2_c / (t2_c + 243.5))
+    return dewpoint, np.clip(100. * vapor_pressure / saturation, 0., 100.)
+
+
+def earth_relative_wind(u: np.ndarray, v: np.ndarray, cosalpha: np.ndarray,
+                        sinalpha: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Grid relative u, v rotated to earth relative, like wrf-python's uvmet. """
+    return u * cosalpha - v * sinalpha, v * cosalpha + u * sinalpha
+
+
+def speed_and_direction(u: np.ndarray, v: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Speed and meteorological direction (where the wind blows from, degrees). """
+    return np.hypot(u, v), np.mod(270. - np.degrees(np.arctan2(v, u)), 360.)
+
+
+def column_sea_level_pressure(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    """ wrf-python's slp from (Time, bottom_top) columns, hPa per time step. """
+    pressure = columns["P"] + columns["PB"]
+    temperature = wrf.tk(pressure, columns["T"] + 300., meta=False)
+    geopotential = columns["PH"] + columns["PHB"]
+    height = (geopotential[:, :-1] + geopotential[:, 1:]) / 2. / 9.81
+    # slp expects (..., bottom_top, south_north, west_east)
+    as_grid = [values[:, :, np.newaxis, np.newaxis] for values in (height, temperature, pressure, columns["QVAPOR"])]
+    return wrf.to_np(wrf.slp(*as_grid, meta=False, units="hPa"))[:, 0, 0]
+
+
+def meteogram(data: WRFData, south_north: int, west_east: int) -> Tuple[List[datetime], Dict[str, np.ndarray]]:
+    """ Time series of the surface fields of the map page at one grid point, reads only its columns. """
+    times = [time for _, time in data.available_times]
+    values = data.read_point_values(SURFACE_VARIABLES + SLP_COLUMN_VARIABLES, south_north, west_east)
+
+    dewpoint, rh = dewpoint_and_rh(values["T2"], values["Q2"], values["PSFC"])
+    u10, v10 = earth_relative_wind(values["U10"], values["V10"], values["COSALPHA"], values["SINALPHA"])
+    wspd, wdir = speed_and_direction(u10, v10)
+    rain_total = values["RAINC"] + values["RAINNC"]
+    # same convention as WRFData.calculate_rain, the first step is the accumulation so far
+    rain = np.concatenate([rain_total[:1], np.diff(rain_total)])
+
+    return times, {
+        "T2": values["T2"] - 273.15,
+        "td2": dewpoint,
+        "rh2": rh,
+        "wspd10": wspd,
+        "wdir10": wdir,
+        "rain": rain,
+        "rain_total": rain_total,
+        "slp": column_sea_level_pressure(values),
+    }
+
+
+SOUNDING_VARIABLES = ("P", "PB", "T", "QVAPOR", "U", "V", "PH", "PHB", "HGT", "COSALPHA", "SINALPHA")
+
+SOUNDING_UNITS = {
+    "pressure": "hPa",
+    "height": "m",
+    "height_agl": "m",
+    "temperature": "degC",
+    "dewpoint": "degC",
+    "u": "m s-1",
+    "v": "m s-1",
+    "wspd": "m s-1",
+    "wdir": "degree",
+}
+
+
+def soundings(data: WRFData, points: List[Tuple[int, int]], timeidx: int) -> List[Dict[str, np.ndarray]]:
+    """
+    Model level profiles at (south_north, west_east) grid points for one time step. All points are read
+    together, one read of the columns per variable, diagnostics are computed on the columns only.
+    """
+    columns = data.read_columns(SOUNDING_VARIABLES, points, timeidx=timeidx)
+
+    pressure = columns["P"] + columns["PB"]  # (point, bottom_top) Pa
+    temperature = wrf.tk(pressure, columns["T"] + 300., meta=False) - 273.15
+    dewpoint = wrf.td(pressure / 100., np.maximum(columns["QVAPOR"], 1e-10), meta=False)
+    geopotential = columns["PH"] + columns["PHB"]
+    height = (geopotential[:, :-1] + geopotential[:, 1:]) / 2. / 9.81
+    # destagger to the mass points, then rotate to earth relative winds
+    u_grid = columns["U"].mean(axis=-1)
+    v_grid = columns["V"].mean(axis=-1)
+    u, v = earth_relative_wind(u_grid, v_grid, columns["COSALPHA"][:, np.newaxis], columns["SINALPHA"][:, np.newaxis])
+    wspd, wdir = speed_and_direction(u, v)
+
+    return [{
+        "pressure": pressure[point] / 100.,
+        "height": height[point],
+        "height_agl": height[point] - columns["HGT"][point],
+        "temperature": wrf.to_np(temperature)[point],
+        "dewpoint": wrf.to_np(dewpoint)[point],
+        "u": u[point],
+        "v": v[point],
+        "wspd": wspd[point],
+        "wdir": wdir[point],
+    } for point in range(len(points))]
@@ -1,5 +1,6 @@
 from datetime import datetime
-from typing import Tuple
+from typing import Tuple, Optional, Dict, Sequence, Union
+from threading import RLock
 from functools import cached_property
 
 import wrf
@@ -9,14 +10,33 @@ import xarray as xr
 
 from netCDF4 import Dataset
 
+from library.cache.LRUCache import LRUCache
+from library.models.WrfOutRun import WrfOutRun
+
 
 class WRFData:
     _pres_variable_name = 'p'
     _height_variable_name = 'z'
     _terrain_variable_name = "ter"
+    _default_diagnostic_cache_bytes = 512 * 1024 ** 2
+    _level_dim = "level"
+
+    # levels and fields of the upper air maps, see isobaric_fields
+    STANDARD_PRESSURE_LEVELS = (1000., 850., 700., 500., 300.)
+    ISOBARIC_VARIABLES = ("z", "tc", "rh", "u", "v", "avo", "wspd")
 
-    def __init__(self, ds: Dataset) -> None:
-        self.ds = ds
+    def __init__(self, ds: Union[Dataset, WrfOutRun], diagnostic_cache_bytes: Optional[int] = _default_diagnostic_cache_bytes,
+                 diagnostic_cache_items: int = 256, isobaric_store: Optional[xr.Dataset] = None,
+                 in_progress: bool = False) -> None:
+        # split-by-time runs read each time step from its own file, ds is then the first one
+        self.run = ds if isinstance(ds, WrfOutRun) else None
+        self.ds = self.run.first if self.run is not None else ds
+        # wrf.exe is still appending frames, the last one may be partially written
+        self.in_progress = in_progress
+        # netCDF4 handles must not be read by two threads at once, requests share this object through DatasetPool
+        self.lock = RLock()
+        # precomputed isobaric fields of this file, see library.models.IsobaricStore
+        self.isobaric_store = isobaric_store
         self.title = self.ds.TITLE
         self.map_proj = self.ds.MAP_PROJ_CHAR
         self.cen_lat = self.ds.CEN_LAT
@@ -35,6 +55,12 @@ class WRFData:
         self._height_in_meters: xr.DataArray = None
         self._slp_var: xr.DataArray = None
         self._base_vars_loaded: bool = False
+        # getvar results of this dataset, shared by every overlay and request reading it
+        self._diagnostic_cache = LRUCache(
+            max_items=diagnostic_cache_items,
+            max_bytes=diagnostic_cache_bytes,
+            size_of=self._size_of_result
+        )
 
     def __repr__(self) -> str:
         return f"Run{self.title} {self.model_type} simulation start {self.simulation_start_date}."
@@ -49,7 +75,7 @@ class WRFData:
             "Grid Delta Y": self.dy,
             "Delta T": self.dt,
             "Start Date": self.simulation_start_date,
-            "Time Steps": len(self.ds.dimensions['Time'])
+            "Time Steps": len(self.run) if self.run is not None else len(self.ds.dimensions['Time'])
         }
 
     def sea_level_pressure(self, timeidx: int = 0, unit: str = "hPa"):
@@ -59,7 +85,6 @@ class WRFData:
         return self.extract_variable("uvmet10", timeidx=timeidx, units=unit, meta=False)
 
     def load_base_variables(self):
-        # TODO: consider cache
         self._terrain_var = self.extract_variable(
             var_name=self._terrain_variable_name,
             timeidx=0
@@ -72,6 +97,101 @@ class WRFData:
         _p = self.extract_variable("p", timeidx=timeidx, units=pressure_units)
         return wrf.interplevel(variable_to_interpolate, _p, level_to_interpolate)
 
+    def interpolate_to_pressure_levels(self, variables: Dict[str, xr.DataArray], levels: Sequence[float],
+                                       pressure_units: str = "hPa", timeidx: int = 0) -> xr.Dataset:
+        """
+        Interpolates several 3-D variables to several pressure levels at once.
+
+        The bracketing model levels and weights are searched once per column and shared by every variable,
+        values below the ground or above the model top are NaN like wrf.interplevel.
+        Variables can have leading dimensions (e.g. u_v of uvmet), the last three must be
+        (bottom_top, south_north, west_east).
+        """
+        levels = tuple(float(level) for level in levels)
+        lower_k, weight = self._vertical_interpolation_weights(levels, pressure_units, timeidx)
+
+        interpolated = {}
+        for name, variable in variables.items():
+            values = wrf.to_np(variable)
+            lower = np.take_along_axis(values, np.broadcast_to(lower_k, values.shape[:-3] + lower_k.shape), axis=-3)
+            upper = np.take_along_axis(values, np.broadcast_to(lower_k + 1, values.shape[:-3] + lower_k.shape),
+                                       axis=-3)
+            result = lower + weight * (upper - lower)
+            interpolated[name] = self._to_level_array(variable, result, levels)
+
+        return xr.Dataset(interpolated)
+
+    def isobaric_fields(self, timeidx: int = 0) -> xr.Dataset:
+        """
+        Upper air fields on STANDARD_PRESSURE_LEVELS, computed in one pass and kept in the diagnostic cache.
+
+        z (m), tc (degC), rh (%), earth relative u, v and wspd (km h-1), avo (10-5 s-1)
+        """
+        if self.isobaric_store is not None:
+            # lazily loaded, only the slices used by the caller are read from disk
+            return self.isobaric_store.isel(Time=timeidx)
+
+        key = ("__isobaric_fields__", timeidx)
+        return self._diagnostic_cache.get_or_create(key, lambda: self._interpolate_isobaric_fields(timeidx))
+
+    def _interpolate_isobaric_fields(self, timeidx: int) -> xr.Dataset:
+        uv = self.extract_variable("uvmet", units="km h-1", timeidx=timeidx)
+        wspd_wdir = self.extract_variable("uvmet_wspd_wdir", units="km h-1", timeidx=timeidx)
+        variables = {
+            "z": self.extract_variable("z", units="m", timeidx=timeidx),
+            "tc": self.extract_variable("tc", timeidx=timeidx),
+            "rh": self.extract_variable("rh", timeidx=timeidx),
+            # selecting from uvmet leaves a scalar u_v ("u" or "v") coordinate, they would not merge
+            "u": uv[0].drop_vars("u_v", errors="ignore"),
+            "v": uv[1].drop_vars("u_v", errors="ignore"),
+            "avo": self.extract_variable("avo", timeidx=timeidx),
+            "wspd": wspd_wdir[0].drop_vars("wspd_wdir", errors="ignore")
+        }
+        return self.interpolate_to_pressure_levels(variables, self.STANDARD_PRESSURE_LEVELS, timeidx=timeidx)
+
+    def _vertical_interpolation_weights(self, levels: Tuple[float, ...], pressure_units: str,
+                                        timeidx: int) -> Tuple[np.ndarray, np.ndarray]:
+        key = ("__vertical_weights__", levels, pressure_units, timeidx)
+        return self._diagnostic_cache.get_or_create(
+            key, lambda: self._search_vertical_levels(levels, pressure_units, timeidx)
+        )
+
+    def _search_vertical_levels(self, levels: Tuple[float, ...], pressure_units: str,
+                                timeidx: int) -> Tuple[np.ndarray, np.ndarray]:
+        pressure = wrf.to_np(self.extract_variable("p", timeidx=timeidx, units=pressure_units))
+        bottom_top = pressure.shape[0]
+        desired = np.asarray(levels, dtype=pressure.dtype)[:, np.newaxis, np.newaxis, np.newaxis]
+
+        # pressure decreases with height, number of model levels at or below the desired level gives
+        # the index of the level right below it. (level, south_north, west_east)
+        levels_below = np.count_nonzero(pressure[np.newaxis] >= desired, axis=1)
+        out_of_range = (levels_below == 0) | (levels_below == bottom_top)
+        lower_k = np.clip(levels_below - 1, 0, bottom_top - 2)
+
+        p_lower = np.take_along_axis(pressure, lower_k, axis=0)
+        p_upper = np.take_along_axis(pressure, lower_k + 1, axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weight = (p_lower - desired[:, :, :, 0]) / (p_lower - p_upper)
+        weight[out_of_range] = np.nan
+        return lower_k, weight
+
+    def _to_level_array(self, source: xr.DataArray, values: np.ndarray, levels: Tuple[float, ...]) -> xr.DataArray:
+        if not isinstance(source, xr.DataArray):
+            return xr.DataArray(values)
+
+        leading_dims = source.dims[:-3]
+        horizontal_dims = source.dims[-2:]
+        coords = {name: coord for name, coord in source.coords.items()
+                  if set(coord.dims) <= set(leading_dims + horizontal_dims)}
+        coords[self._level_dim] = list(levels)
+        return xr.DataArray(
+            values,
+            dims=leading_dims + (self._level_dim,) + horizontal_dims,
+            coords=coords,
+            attrs=dict(source.attrs),
+            name=source.name
+        )
+
     def built_in_variables(self) -> dict:
         _variables = {}
         for var_name, nc_var in self.ds.variables.items():
@@ -90,8 +210,13 @@ class WRFData:
         return self._available_times
 
     def __extract_all_times(self) -> [dict]:
-        all_times = wrf.extract_times(wrfin=self.ds, timeidx=wrf.ALL_TIMES)
-        return [(idx, datetime.fromisoformat(pd.to_datetime(date).isoformat())) for idx, date in enumerate(all_times)]
+        if self.run is not None:
+            # only finished files are moved or linked into a run folder
+            return list(enumerate(self.run.times))
+        with self.lock:
+            all_times = wrf.extract_times(wrfin=self.ds, timeidx=wrf.ALL_TIMES)
+        times = [(idx, datetime.fromisoformat(pd.to_datetime(date).isoformat())) for idx, date in enumerate(all_times)]
+        return times[:-1] if self.in_progress else times
 
     @property
     def latitudes_and_longitudes_as_np_array(self) -> Tuple[np.ndarray, np.ndarray]:
@@ -99,26 +224,141 @@ class WRFData:
 
     @property
     def cartopy_proj(self):
-        return wrf.get_cartopy(wrfin=self.ds)
+        with self.lock:
+            return wrf.get_cartopy(wrfin=self.ds)
 
     @property
     def cartopy_xlim(self):
-        return wrf.cartopy_xlim(wrfin=self.ds)
+        with self.lock:
+            return wrf.cartopy_xlim(wrfin=self.ds)
 
     @property
     def cartopy_ylim(self):
-        return wrf.cartopy_ylim(wrfin=self.ds)
+        with self.lock:
+            return wrf.cartopy_ylim(wrfin=self.ds)
 
     def extract_variable(self, var_name: str, *args, **kwargs) -> xr.DataArray:
-        # TODO: consider cache
-        result = wrf.getvar(wrfin=self.ds, varname=var_name, *args, **kwargs)
-        return result
+        """
+        Cached wrf.getvar, results must be treated as read only since they are shared between callers.
+        """
+        key = self._diagnostic_key(var_name, *args, **kwargs)
+        return self._diagnostic_cache.get_or_create(key, lambda: self._getvar(var_name, *args, **kwargs))
+
+    def _getvar(self, var_name: str, *args, **kwargs):
+        with self.lock:
+            if self.run is None:
+                return wrf.getvar(self.ds, var_name, *args, **kwargs)
+            dataset, kwargs["timeidx"] = self.run.locate(kwargs.get("timeidx", 0))
+            return wrf.getvar(dataset, var_name, *args, **kwargs)
+
+    @property
+    def diagnostic_cache_stats(self) -> dict:
+        return self._diagnostic_cache.stats
+
+    def clear_diagnostic_cache(self) -> None:
+        self._diagnostic_cache.clear()
+
+    def close_isobaric_store(self) -> None:
+        if self.isobaric_store is not None:
+            self.isobaric_store.close()
+            self.isobaric_store = None
+
+    @staticmethod
+    def _diagnostic_key(var_name: str, *args, **kwargs) -> tuple:
+        timeidx = kwargs.pop("timeidx", 0)
+        units = kwargs.pop("units", None)
+        meta = kwargs.pop("meta", True)
+        extra = tuple(sorted((key, repr(value)) for key, value in kwargs.items()))
+        return var_name, timeidx, units, meta, args, extra
+
+    @staticmethod
+    def _size_of_result(result) -> int:
+        if isinstance(result, (tuple, list)):
+            return sum(WRFData._size_of_result(item) for item in result)
+        return getattr(result, "nbytes", 0)
 
     def extract_variable_to_np(self, *args, **kwargs) -> np.ndarray:
         return wrf.to_np(self.extract_variable(*args, **kwargs))
 
+    def read_point_values(self, var_names: Sequence[str], south_north: int, west_east: int,
+                          timeidx: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """ read_columns of a single grid point. """
+        columns = self.read_columns(var_names, [(south_north, west_east)], timeidx=timeidx)
+        return {var_name: values[0] for var_name, values in columns.items()}
+
+    def read_columns(self, var_names: Sequence[str], points: Sequence[Tuple[int, int]],
+                     timeidx: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """
+        Raw variables at (south_north, west_east) grid points, netCDF reads only the rows and columns the
+        points are on instead of whole fields, all points in one read per variable and file.
+        Shape is (point, Time, ...) for every available time step or (point, ...) for a single one.
+        Staggered horizontal dimensions keep the two points around the mass point as the last axis,
+        (..., 2) for U and V.
+        """
+        if timeidx is None:
+            frames = range(len(self.available_times))
+        else:
+            frames = [timeidx]
+
+        # (global frames, local time indexes) per file in order, a run reads each file it spans once
+        groups = []
+        for frame in frames:
+            file_idx, local_idx = self.run.frames[frame] if self.run is not None else (0, frame)
+            if groups and groups[-1][0] == file_idx:
+                groups[-1][1].append(frame)
+                groups[-1][2].append(local_idx)
+            else:
+                groups.append((file_idx, [frame], [local_idx]))
+
+        parts = {var_name: [] for var_name in var_names}
+        with self.lock:
+            for _, group_frames, local_idxs in groups:
+                # a run keeps a limited number of files open, read a file before locating the next one
+                dataset = self.run.locate(group_frames[0])[0] if self.run is not None else self.ds
+                for var_name in var_names:
+                    parts[var_name].append(self._read_columns(dataset.variables[var_name], local_idxs, points))
+        return {var_name: np.concatenate(var_parts, axis=1) if timeidx is None else var_parts[0][:, 0]
+                for var_name, var_parts in parts.items()}
+
+    @staticmethod
+    def _read_columns(nc_var, local_idxs: Sequence[int], points: Sequence[Tuple[int, int]]) -> np.ndarray:
+        rows = sorted(set(row for row, _ in points))
+        cols = sorted(set(col for _, col in points))
+        # netCDF indexes integer lists per dimension (outer product), mass and staggered points both included
+        axes = {
+            "south_north": rows,
+            "west_east": cols,
+            "south_north_stag": sorted(set(rows) | set(row + 1 for row in rows)),
+            "west_east_stag": sorted(set(cols) | set(col + 1 for col in cols)),
+        }
+        read_index = []
+        for dim in nc_var.dimensions:
+            if dim == "Time":
+                read_index.append(slice(local_idxs[0], local_idxs[-1] + 1))
+            else:
+                read_index.append(axes.get(dim, slice(None)))
+        block = np.ma.filled(nc_var[tuple(read_index)], np.nan)
+
+        columns = []
+        for row, col in points:
+            point_index = []
+            for dim in nc_var.dimensions:
+                if dim == "south_north":
+                    point_index.append(axes[dim].index(row))
+                elif dim == "west_east":
+                    point_index.append(axes[dim].index(col))
+                elif dim == "south_north_stag":
+                    point_index.append([axes[dim].index(row), axes[dim].index(row + 1)])
+                elif dim == "west_east_stag":
+                    point_index.append([axes[dim].index(col), axes[dim].index(col + 1)])
+                else:
+                    point_index.append(slice(None))
+            columns.append(block[tuple(point_index)])
+        return np.stack(columns)
+
     def extract_projection_params(self):
-        return wrf.get_proj_params(wrfin=self.ds)
+        with self.lock:
+            return wrf.get_proj_params(wrfin=self.ds)
 
     def extract_variables(self, variables_list: [str], time_index: int) -> dict:
         result = {
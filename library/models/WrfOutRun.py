@@ -0,0 +1,70 @@
+import os
+from glob import glob
+from pathlib import Path
+from datetime import datetime
+from typing import List, Tuple, Union
+
+import wrf
+import pandas as pd
+
+from netCDF4 import Dataset
+
+from library.cache.LRUCache import LRUCache
+
+WRFOUT_PATTERN = "wrfout_d*"
+
+
+class WrfOutRun:
+    """
+    Per-time wrfout files of one run (frames_per_outfile = 1) in a run folder, seen as one time axis.
+
+    The headers are read once to map a global time index to (file, time index in the file), the files
+    themselves are opened on first use and at most `max_open_files` of them stay open. The first file
+    stays open for the attributes, projection and static fields which are the same in every file.
+    """
+
+    def __init__(self, folder: Path, max_open_files: int = 16) -> None:
+        self.folder = Path(folder)
+        self.paths = sorted(Path(path) for path in glob(str(self.folder.joinpath(WRFOUT_PATTERN))))
+        if not self.paths:
+            raise FileNotFoundError(f"No wrfout files in {self.folder}")
+
+        self.frames: List[Tuple[int, int]] = []  # global time index -> (file index, local time index)
+        self.times: List[datetime] = []
+        for file_idx, path in enumerate(self.paths):
+            with Dataset(path, mode="r") as dataset:
+                all_times = wrf.extract_times(wrfin=dataset, timeidx=wrf.ALL_TIMES)
+            for local_idx, date in enumerate(all_times):
+                self.frames.append((file_idx, local_idx))
+                self.times.append(datetime.fromisoformat(pd.to_datetime(date).isoformat()))
+
+        self.first = Dataset(self.paths[0], mode="r")
+        self._open_files = LRUCache(max_items=max_open_files, on_evict=lambda _, dataset: dataset.close())
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def locate(self, timeidx: int) -> Tuple[Dataset, int]:
+        """ Dataset holding the global time index and the index of the time step in it. """
+        file_idx, local_idx = self.frames[timeidx]
+        if file_idx == 0:
+            return self.first, local_idx
+        path = self.paths[file_idx]
+        return self._open_files.get_or_create(path, lambda: Dataset(path, mode="r")), local_idx
+
+    def close(self) -> None:
+        self._open_files.clear()
+        self.first.close()
+
+
+def open_wrfout(path: Path) -> Union[Dataset, WrfOutRun]:
+    """ A single wrfout file or the run folder of a split-by-time run. """
+    if Path(path).is_dir():
+        return WrfOutRun(path)
+    return Dataset(path, mode="r")
+
+
+def wrfout_size(path: Path) -> int:
+    if Path(path).is_dir():
+        return sum(os.path.getsize(file_path) for file_path in glob(str(Path(path).joinpath(WRFOUT_PATTERN))))
+    return os.path.getsize(path)
@@ -5,9 +5,10 @@ from dataclasses import dataclass
 
 import numpy as np
 import matplotlib
-import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
 
+from matplotlib.figure import Figure
+
 from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
 
 import app.map.constants as Constants
@@ -24,29 +25,46 @@ class CartopyMplPlotter:
         self.data_manager = wrf_data_manager
 
         self._default_proj_transformer: ccrs.Projection = ccrs.PlateCarree()
-        self._figure: plt.Figure = None
+        self._figure: Figure = None
         self._left_subtitle: str = ""
         self._right_subtitle: str = ""
         self._ax: matplotlib.projections.GeoAxes = None
         self.lats = None
         self.lons = None
 
+        # static base map (projection, extent, coastlines, gridlines) is kept between frames of the same domain,
+        # only the data layers in _data_artists are replaced
+        self._base_map_key: tuple = None
+        self._base_ax_position = None
+        self._gridliner = None
+        self._data_artists: list = []
+        self._colorbars: list = []
+
     def create_figure(self, **mpl_fig_kwargs) -> None:
         figsize = self.data_manager.get_figure_size()
-
-        self._figure = plt.figure(figsize=figsize, **mpl_fig_kwargs)
-        self._figure.set_facecolor("#e4ede8")
+        projection_data = self.data_manager.extract_projection_and_bounds()
+        x_lim = projection_data["x-limit"]
+        y_lim = projection_data["y-limit"]
 
         self._left_subtitle = ""
         self._right_subtitle = ""
+        self.lats, self.lons = self.data_manager.get_latitudes_and_longitudes()
 
-        projection_data = self.data_manager.extract_projection_and_bounds()
-        self._ax = plt.axes(projection=projection_data["projection"])
+        base_map_key = (projection_data["projection"].proj4_init, tuple(x_lim), tuple(y_lim), tuple(figsize),
+                        tuple(sorted(mpl_fig_kwargs.items())))
+        if self._figure is not None and base_map_key == self._base_map_key:
+            self.clear_data_layers()
+            return
 
-        self.lats, self.lons = self.data_manager.get_latitudes_and_longitudes()
+        if self._figure is not None:
+            self.close_figure()
+
+        # plain Figure objects instead of pyplot, pyplot's current figure is global state shared by all threads
+        self._figure = Figure(figsize=figsize, **mpl_fig_kwargs)
+        self._figure.set_facecolor("#e4ede8")
+
+        self._ax = self._figure.add_subplot(1, 1, 1, projection=projection_data["projection"])
 
-        x_lim = projection_data["x-limit"]
-        y_lim = projection_data["y-limit"]
         # margin = 200000
         # self._ax.set_xlim([x_lim[0] - margin, x_lim[1] + margin])
         # self._ax.set_ylim([y_lim[0] - margin, y_lim[1] + margin])
@@ -54,8 +72,34 @@ class CartopyMplPlotter:
         self._ax.set_xlim(x_lim)
         self._ax.set_ylim(y_lim)
         self._ax.coastlines("10m", linewidth=0.8)
+        self.plot_gridlines()
+
+        self._base_map_key = base_map_key
+        self._base_ax_position = self._ax.get_position(original=True)
+
+    def clear_data_layers(self) -> None:
+        for colorbar in self._colorbars:
+            colorbar.remove()
+        for artist in self._data_artists:
+            self._remove_artist(artist)
+        self._colorbars = []
+        self._data_artists = []
+        if self._base_ax_position is not None:
+            self._ax.set_position(self._base_ax_position)
+
+    @staticmethod
+    def _remove_artist(artist) -> None:
+        try:
+            artist.remove()
+        except (AttributeError, NotImplementedError, ValueError):
+            # ContourSet of matplotlib < 3.8 is not an artist itself
+            for collection in getattr(artist, "collections", []):
+                collection.remove()
 
     def plot_gridlines(self):
+        if self._gridliner is not None:
+            return
+
         # plot grid lines
         gl = self._ax.gridlines(
             crs=self._default_proj_transformer,
@@ -72,6 +116,7 @@ class CartopyMplPlotter:
         # gl.ypadding = 0.2
         gl.xformatter = LONGITUDE_FORMATTER
         gl.yformatter = LATITUDE_FORMATTER
+        self._gridliner = gl
 
     def generate_figure_title(self, timeidx: int = 0):
         date = self.data_manager.get_time_string_by_index(timeidx)
@@ -104,7 +149,9 @@ class CartopyMplPlotter:
             linestyles=line_style,
             cmap=cmap
         )
-        self._ax.clabel(ct, inline=True, fontsize=12)
+        labels = self._ax.clabel(ct, inline=True, fontsize=12)
+        self._data_artists.append(ct)
+        self._data_artists.extend(labels)
         return ct
 
     def plot_figure_title(self, additional_msg: str = "", **kwargs):
@@ -118,37 +165,45 @@ class CartopyMplPlotter:
         u_wind, v_wind = self.data_manager.get_winds(key=wind_variable_key, timeidx=time_step)
 
         if wind_variable_key == Constants.FIELD_KEY_WS300:
-            self._ax.streamplot(
+            patches_before = set(self._ax.patches)
+            streamplot = self._ax.streamplot(
                 self.lons[::grid_interval, ::grid_interval],
                 self.lats[::grid_interval, ::grid_interval],
                 u_wind[::grid_interval, ::grid_interval],
                 v_wind[::grid_interval, ::grid_interval],
                 transform=self._default_proj_transformer, zorder=10, color="black", arrowsize=1.5, density=[.9, .9])
+            # streamplot.arrows is a PatchCollection never added to the axes (matplotlib < 3.9), the drawn
+            # arrows are separate patches
+            self._data_artists.append(streamplot.lines)
+            self._data_artists.extend(patch for patch in self._ax.patches if patch not in patches_before)
 
         elif wind_variable_key == Constants.FIELD_KEY_TEMP850:
-            self._ax.barbs(
+            barbs = self._ax.barbs(
                 self.lons[::grid_interval, ::grid_interval],
                 self.lats[::grid_interval, ::grid_interval],
                 u_wind[::grid_interval, ::grid_interval],
                 v_wind[::grid_interval, ::grid_interval],
                 transform=self._default_proj_transformer,
                 length=6, zorder=10)
+            self._data_artists.append(barbs)
         elif wind_variable_key == Constants.FIELD_KEY_RH700:
-            self._ax.barbs(
+            barbs = self._ax.barbs(
                 self.lons[::grid_interval, ::grid_interval],
                 self.lats[::grid_interval, ::grid_interval],
                 u_wind[::grid_interval, ::grid_interval],
                 v_wind[::grid_interval, ::grid_interval],
                 transform=self._default_proj_transformer,
                 length=6, zorder=10)
+            self._data_artists.append(barbs)
         else:
-            self._ax.barbs(
+            barbs = self._ax.barbs(
                 self.lons[::grid_interval, ::grid_interval],
                 self.lats[::grid_interval, ::grid_interval],
                 u_wind[::grid_interval, ::grid_interval],
                 v_wind[::grid_interval, ::grid_interval],
                 transform=self._default_proj_transformer,
                 length=6, zorder=10)
+            self._data_artists.append(barbs)
 
     def plot_contour_fill(self, data_key: str, timeidx: int = 0):
         ctf_var: CTFVariable = self.data_manager.get_contour_fill_data(data_key, timeidx=timeidx)
@@ -165,26 +220,39 @@ class CartopyMplPlotter:
             zorder=0,
             **ctf_kwargs,
         )
-        cbar = plt.colorbar(ctf, ax=self._ax,
-                            orientation="horizontal",
-                            ticks=ctf_var.levels,
-                            boundaries=ctf_var.levels,
-                            pad=0.03, shrink=0.83,
-                            extend=ctf_var.cmap.cbar_extend)
+        cbar = self._figure.colorbar(ctf, ax=self._ax,
+                                     orientation="horizontal",
+                                     ticks=ctf_var.levels,
+                                     boundaries=ctf_var.levels,
+                                     pad=0.03, shrink=0.83,
+                                     extend=ctf_var.cmap.cbar_extend)
 
         cbar.set_label(f"{ctf_var.title} {ctf_var.unit_text}")
-
-    @staticmethod
-    def __show_all_figures():
-        plt.show()
+        self._data_artists.append(ctf)
+        self._colorbars.append(cbar)
 
     def clear_figure(self):
-        self._figure.clear()
+        # drops the base map as well, next create_figure starts from scratch
+        if self._figure is not None:
+            self.close_figure()
+
+    def close_figure(self):
+        # not registered with pyplot, dropping the references frees it
+        self._figure = None
+        self._ax = None
+        self._base_map_key = None
+        self._base_ax_position = None
+        self._gridliner = None
+        self._data_artists = []
+        self._colorbars = []
 
     def save(self) -> str:
-        tmp_image = io.BytesIO()
-        self._figure.tight_layout()
-        self._figure.savefig(tmp_image, format='png')
-        encoded = base64.b64encode(tmp_image.getvalue()).decode('utf-8')
+        encoded = base64.b64encode(self.save_to_bytes()).decode('utf-8')
         image_source = f'data:image/png;base64,{encoded}'
         return image_source
+
+    def save_to_bytes(self, fmt: str = "png") -> bytes:
+        tmp_image = io.BytesIO()
+        self._figure.tight_layout()
+        self._figure.savefig(tmp_image, format=fmt)
+        return tmp_image.getvalue()
@@ -0,0 +1,38 @@
+import io
+from typing import Dict
+
+import numpy as np
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from metpy.plots import SkewT
+from metpy.units import units
+
+
+def render_skewt(profile: Dict[str, np.ndarray], title: str = "", fmt: str = "png", dpi: int = 100) -> bytes:
+    """ Skew-T log-P diagram of a sounding profile from PointData.soundings. """
+    figure = Figure(figsize=(7, 8))
+    FigureCanvasAgg(figure)
+    skew = SkewT(figure, rotation=45)
+
+    pressure = profile["pressure"] * units.hPa
+    skew.plot(pressure, profile["temperature"] * units.degC, "r", linewidth=2)
+    skew.plot(pressure, profile["dewpoint"] * units.degC, "g", linewidth=2)
+    # a barb every few levels, the model levels are dense near the ground
+    step = max(1, len(pressure) // 25)
+    skew.plot_barbs(pressure[::step], (profile["u"][::step] * units("m/s")).to("knots"),
+                    (profile["v"][::step] * units("m/s")).to("knots"))
+
+    skew.plot_dry_adiabats(alpha=.3)
+    skew.plot_moist_adiabats(alpha=.3)
+    skew.plot_mixing_lines(alpha=.3)
+    skew.ax.set_ylim(1050, 100)
+    skew.ax.set_xlim(-40, 50)
+    skew.ax.set_xlabel("Sıcaklık (°C)")
+    skew.ax.set_ylabel("Basınç (hPa)")
+    skew.ax.set_title(title, fontsize=10)
+
+    output = io.BytesIO()
+    figure.savefig(output, format=fmt, dpi=dpi, bbox_inches="tight")
+    return output.getvalue()
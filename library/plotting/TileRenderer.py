@@ -0,0 +1,130 @@
+import io
+import math
+from typing import Hashable, Tuple
+
+import numpy as np
+import matplotlib.colors as mcolors
+
+from PIL import Image
+from scipy.spatial import cKDTree
+
+from app.map.models import Cmap
+from library.cache.LRUCache import LRUCache
+
+TILE_SIZE = 256
+WEB_MERCATOR_ORIGIN = 20037508.342789244  # half of the earth's circumference in web mercator meters
+MAX_LATITUDE = 85.05112878
+
+
+def lat_lon_to_web_mercator(lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    lats = np.clip(lats, -MAX_LATITUDE, MAX_LATITUDE)
+    x = np.radians(lons) * 6378137.0
+    y = np.log(np.tan(np.pi / 4 + np.radians(lats) / 2)) * 6378137.0
+    return x, y
+
+
+class MercatorRaster:
+    """
+    WRF field resampled to a regular web mercator grid, row 0 is the northern edge.
+    """
+
+    def __init__(self, values: np.ndarray, west: float, north: float, resolution: float) -> None:
+        self.values = values
+        self.west = west
+        self.north = north
+        self.resolution = resolution
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes
+
+    def sample(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        cols = np.floor((x - self.west) / self.resolution).astype(np.int64)
+        rows = np.floor((self.north - y) / self.resolution).astype(np.int64)
+        rows_count, cols_count = self.values.shape
+        inside = (cols >= 0) & (cols < cols_count) & (rows >= 0) & (rows < rows_count)
+
+        sampled = np.full(x.shape, np.nan, dtype=self.values.dtype)
+        sampled[inside] = self.values[rows[inside], cols[inside]]
+        return sampled
+
+
+class TileRenderer:
+    """
+    Renders XYZ web mercator tiles of WRF fields.
+
+    The nearest neighbour mapping from the mercator grid to the WRF grid is built once per domain,
+    resampling a field is then a single fancy index. Resampled fields are kept in memory so every
+    tile of a field reuses them.
+    """
+
+    def __init__(self, max_domains: int = 4, max_raster_bytes: int = 512 * 1024 ** 2) -> None:
+        self._domains = LRUCache(max_items=max_domains)
+        self._rasters = LRUCache(max_items=256, max_bytes=max_raster_bytes, size_of=lambda raster: raster.nbytes)
+
+    def get_raster(self, raster_key: Hashable, domain_key: Hashable, lats: np.ndarray, lons: np.ndarray,
+                   grid_spacing: float, field_loader) -> MercatorRaster:
+        """
+        `field_loader()` is only called when the raster of `raster_key` is not cached.
+        """
+        def resample() -> MercatorRaster:
+            nearest, valid, west, north, resolution, shape = self._domains.get_or_create(
+                domain_key, lambda: self._build_domain_index(lats, lons, grid_spacing)
+            )
+            field = np.asarray(field_loader(), dtype=np.float32).ravel()
+            values = np.full(shape[0] * shape[1], np.nan, dtype=np.float32)
+            values[valid] = field[nearest[valid]]
+            return MercatorRaster(values.reshape(shape), west=west, north=north, resolution=resolution)
+
+        return self._rasters.get_or_create(raster_key, resample)
+
+    @staticmethod
+    def _build_domain_index(lats: np.ndarray, lons: np.ndarray, grid_spacing: float) -> tuple:
+        x, y = lat_lon_to_web_mercator(lats, lons)
+        # mercator stretches distances by 1 / cos(lat), keep roughly one cell per model grid point
+        resolution = grid_spacing / math.cos(math.radians(float(np.nanmax(np.abs(lats)))))
+        west, east = float(np.min(x)), float(np.max(x))
+        south, north = float(np.min(y)), float(np.max(y))
+        shape = (int(math.ceil((north - south) / resolution)) + 1, int(math.ceil((east - west) / resolution)) + 1)
+
+        cols, rows = np.meshgrid(np.arange(shape[1]), np.arange(shape[0]))
+        target_x = west + (cols.ravel() + .5) * resolution
+        target_y = north - (rows.ravel() + .5) * resolution
+
+        tree = cKDTree(np.column_stack([x.ravel(), y.ravel()]))
+        distance, nearest = tree.query(np.column_stack([target_x, target_y]))
+        # cells further than about a grid point from the domain are outside of it
+        valid = distance <= 1.5 * resolution
+        return nearest, valid, west, north, resolution, shape
+
+    @staticmethod
+    def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+        tile_span = 2 * WEB_MERCATOR_ORIGIN / 2 ** z
+        west = -WEB_MERCATOR_ORIGIN + x * tile_span
+        north = WEB_MERCATOR_ORIGIN - y * tile_span
+        return west, north - tile_span, west + tile_span, north
+
+    @staticmethod
+    def tile_exists(z: int, x: int, y: int) -> bool:
+        return 0 <= z <= 22 and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+    def render_tile(self, raster: MercatorRaster, cmap: Cmap, z: int, x: int, y: int) -> bytes:
+        west, south, east, north = self.tile_bounds(z, x, y)
+        pixel = (east - west) / TILE_SIZE
+        cols, rows = np.meshgrid(np.arange(TILE_SIZE), np.arange(TILE_SIZE))
+        values = raster.sample(west + (cols + .5) * pixel, north - (rows + .5) * pixel)
+
+        ctf_kwargs = cmap.create_cmap()
+        colormap = ctf_kwargs["cmap"]
+        # discrete colors like the contourf of the map page
+        try:
+            norm = mcolors.BoundaryNorm(ctf_kwargs["levels"], colormap.N, extend=cmap.cbar_extend)
+        except ValueError:
+            # not enough colors for the extension bins, out of range values take the end colors
+            norm = mcolors.BoundaryNorm(ctf_kwargs["levels"], colormap.N, clip=True)
+        rgba = colormap(norm(np.ma.masked_invalid(values)), bytes=True)
+        rgba[np.isnan(values)] = 0
+
+        tile = io.BytesIO()
+        Image.fromarray(rgba, mode="RGBA").save(tile, format="PNG", optimize=False)
+        return tile.getvalue()
@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+WRFOUT_START = datetime(2023, 7, 17, 12)
+
+
+def write_synthetic_wrfout(path: Path, time_count: int = 2, bottom_top: int = 10, south_north: int = 5,
+                           west_east: int = 6) -> Path:
+    """
+    Small wrfout with the variables and attributes wrf-python needs for the upper air diagnostics,
+    a lambert conformal domain around 40N 30E with a realistic vertical structure.
+    """
+    np = pytest.importorskip("numpy")
+    netCDF4 = pytest.importorskip("netCDF4")
+    rng = np.random.default_rng(0)
+
+    with netCDF4.Dataset(path, mode="w", format="NETCDF4") as ds:
+        ds.TITLE = " OUTPUT FROM WRF V4.5 MODEL"
+        ds.MAP_PROJ = 1
+        ds.MAP_PROJ_CHAR = "Lambert Conformal"
+        ds.CEN_LAT = 40.
+        ds.CEN_LON = 30.
+        ds.TRUELAT1 = 30.
+        ds.TRUELAT2 = 60.
+        ds.STAND_LON = 30.
+        ds.MOAD_CEN_LAT = 40.
+        ds.POLE_LAT = 90.
+        ds.POLE_LON = 0.
+        ds.DX = 30000.
+        ds.DY = 30000.
+        ds.DT = 180.
+        ds.SIMULATION_INITIALIZATION_TYPE = "REAL-DATA CASE"
+        ds.SIMULATION_START_DATE = WRFOUT_START.strftime("%Y-%m-%d_%H:%M:%S")
+        ds.setncattr("WEST-EAST_GRID_DIMENSION", west_east + 1)
+        ds.setncattr("SOUTH-NORTH_GRID_DIMENSION", south_north + 1)
+        ds.setncattr("BOTTOM-TOP_GRID_DIMENSION", bottom_top + 1)
+
+        ds.createDimension("Time", None)
+        ds.createDimension("DateStrLen", 19)
+        for name, size in (("bottom_top", bottom_top), ("bottom_top_stag", bottom_top + 1),
+                           ("south_north", south_north), ("south_north_stag", south_north + 1),
+                           ("west_east", west_east), ("west_east_stag", west_east + 1)):
+            ds.createDimension(name, size)
+
+        def variable(name, dims, values, units="", description="", stagger=""):
+            nc_var = ds.createVariable(name, "f4", ("Time",) + dims)
+            nc_var.FieldType = 104
+            nc_var.MemoryOrder = "XYZ" if len(dims) == 3 else "XY "
+            nc_var.description = description
+            nc_var.units = units
+            nc_var.stagger = stagger
+            nc_var.coordinates = "XLONG XLAT XTIME"
+            nc_var[:] = values
+            return nc_var
+
+        times = ds.createVariable("Times", "S1", ("Time", "DateStrLen"))
+        xtime = ds.createVariable("XTIME", "f4", ("Time",))
+        xtime.units = f"minutes since {WRFOUT_START.strftime('%Y-%m-%d %H:%M:%S')}"
+        xtime.description = "minutes since simulation start"
+        for timeidx in range(time_count):
+            time = WRFOUT_START + timedelta(hours=3 * timeidx)
+            times[timeidx] = netCDF4.stringtochar(np.array([time.strftime("%Y-%m-%d_%H:%M:%S")], dtype="S19"))
+            xtime[timeidx] = 180. * timeidx
+
+        def lat_lon(rows, cols):
+            lats = 40. + .27 * (np.arange(rows) - rows / 2.)[:, np.newaxis] + np.zeros((rows, cols))
+            lons = 30. + .35 * (np.arange(cols) - cols / 2.)[np.newaxis, :] + np.zeros((rows, cols))
+            return np.broadcast_to(lats, (time_count, rows, cols)), np.broadcast_to(lons, (time_count, rows, cols))
+
+        for suffix, rows, cols, stagger in (("", south_north, west_east, ""),
+                                            ("_U", south_north, west_east + 1, "X"),
+                                            ("_V", south_north + 1, west_east, "Y")):
+            lats, lons = lat_lon(rows, cols)
+            dims = ("south_north_stag" if stagger == "Y" else "south_north",
+                    "west_east_stag" if stagger == "X" else "west_east")
+            variable(f"XLAT{suffix}", dims, lats, "degree_north", stagger=stagger)
+            variable(f"XLONG{suffix}", dims, lons, "degree_east", stagger=stagger)
+
+        mass = (time_count, south_north, west_east)
+        terrain = rng.uniform(0., 800., mass[1:])
+        variable("HGT", ("south_north", "west_east"), np.broadcast_to(terrain, mass), "m")
+        variable("COSALPHA", ("south_north", "west_east"), np.full(mass, .99))
+        variable("SINALPHA", ("south_north", "west_east"), np.full(mass, .01))
+        variable("F", ("south_north", "west_east"), np.full(mass, 1e-4), "s-1")
+        variable("MAPFAC_M", ("south_north", "west_east"), np.ones(mass))
+        variable("MAPFAC_U", ("south_north", "west_east_stag"), np.ones((time_count, south_north, west_east + 1)))
+        variable("MAPFAC_V", ("south_north_stag", "west_east"), np.ones((time_count, south_north + 1, west_east)))
+
+        # surface pressure from the terrain, eta levels from the ground to 50 hPa
+        surface_pressure = 101325. * np.exp(-terrain / 8000.)
+        eta_stag = np.linspace(1., 0., bottom_top + 1)
+        eta = (eta_stag[:-1] + eta_stag[1:]) / 2.
+        top = 5000.
+        pressure = top + eta[:, np.newaxis, np.newaxis] * (surface_pressure - top)  # (bottom_top, sn, we)
+        pressure_stag = top + eta_stag[:, np.newaxis, np.newaxis] * (surface_pressure - top)
+        base_pressure = pressure * .98
+
+        def in_time(values, noise=0.):
+            return np.stack([values + noise * timeidx + rng.normal(0., abs(noise) + 1e-6, values.shape)
+                             for timeidx in range(time_count)])
+
+        level_dims = ("bottom_top", "south_north", "west_east")
+        variable("PB", level_dims, in_time(base_pressure), "Pa")
+        variable("P", level_dims, in_time(pressure - base_pressure, 10.), "Pa")
+        theta = 300. * (100000. / pressure) ** .08
+        variable("T", level_dims, in_time(theta - 300., .2), "K")
+        variable("QVAPOR", level_dims, np.clip(in_time(.012 * (pressure / 100000.) ** 3, 1e-5), 1e-7, None), "kg kg-1")
+
+        geopotential = 9.81 * 7000. * np.log(101325. / pressure_stag)
+        geopotential[0] = 9.81 * terrain
+        geopotential = np.maximum.accumulate(geopotential, axis=0)
+        base_geopotential = geopotential * .99
+        stag_dims = ("bottom_top_stag", "south_north", "west_east")
+        variable("PHB", stag_dims, in_time(base_geopotential), "m2 s-2", stagger="Z")
+        variable("PH", stag_dims, in_time(geopotential - base_geopotential, 1.), "m2 s-2", stagger="Z")
+
+        u = 5. + 25. * (1. - eta)[:, np.newaxis, np.newaxis] + np.zeros((bottom_top, south_north, west_east + 1))
+        v = -3. + 10. * (1. - eta)[:, np.newaxis, np.newaxis] + np.zeros((bottom_top, south_north + 1, west_east))
+        variable("U", ("bottom_top", "south_north", "west_east_stag"), in_time(u, .5), "m s-1", stagger="X")
+        variable("V", ("bottom_top", "south_north_stag", "west_east"), in_time(v, .5), "m s-1", stagger="Y")
+    return path
+
+
+@pytest.fixture
+def synthetic_wrfout(tmp_path) -> Path:
+    return write_synthetic_wrfout(tmp_path.joinpath(f"wrfout_d01_{WRFOUT_START.strftime('%Y-%m-%d_%H:%M:%S')}"))
@@ -0,0 +1,210 @@
+import logging
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# imports the app package, needs the environment of spec-file.txt
+GfsDownloader = pytest.importorskip("library.GfsDownloader").GfsDownloader
+
+from library.GfsArchive import GfsArchive
+
+GFS_CONTENT = b"GRIB" + bytes(range(256)) * 64 + b"7777"
+RUN_DATE = datetime(2023, 7, 17, 12)
+
+
+# (variable, level) of the messages of the fixture GRIB file used by the subset tests
+GRIB_MESSAGES = (("TMP", "500 mb"), ("HGT", "500 mb"), ("TMP", "850 mb"), ("UGRD", "10 m above ground"),
+                 ("PRMSL", "mean sea level"))
+
+
+def _grib_fixture():
+    """ Messages of different sizes, each starting with GRIB and ending with 7777, and their .idx inventory. """
+    messages = [b"GRIB" + bytes([number]) * 100 * number + b"7777" for number in range(1, len(GRIB_MESSAGES) + 1)]
+    idx_lines, offset = [], 0
+    for number, ((variable, level), message) in enumerate(zip(GRIB_MESSAGES, messages), start=1):
+        idx_lines.append(f"{number}:{offset}:d=2023071712:{variable}:{level}:anl:")
+        offset += len(message)
+    return messages, "\n".join(idx_lines) + "\n"
+
+
+class _GfsHandler(BaseHTTPRequestHandler):
+    # set per test by the gfs_server fixture
+    failures_left = 0
+    range_headers = []
+    head_requests = 0
+    # subset tests serve a GRIB file with an inventory, range_mode is how the server answers a Range header:
+    # "multipart", "multipart_reversed" (parts in any order), "coalesced" (one range over all) or "ignore" (200)
+    grib_content = None
+    idx_text = None
+    range_mode = "multipart"
+    boundary = "gfs-test-boundary"
+
+    def do_HEAD(self):
+        _GfsHandler.head_requests += 1
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self._content())))
+        self.end_headers()
+
+    def do_GET(self):
+        if _GfsHandler.failures_left > 0:
+            _GfsHandler.failures_left -= 1
+            self.send_error(503)
+            return
+
+        if self.path.endswith(".idx") and _GfsHandler.idx_text is not None:
+            self._send(200, _GfsHandler.idx_text.encode("utf-8"))
+            return
+
+        range_header = self.headers.get("Range")
+        _GfsHandler.range_headers.append(range_header)
+        content = self._content()
+        if range_header is None or _GfsHandler.range_mode == "ignore":
+            self._send(200, content)
+            return
+
+        ranges = [tuple(int(byte) if byte else len(content) - 1 for byte in span.split("-"))
+                  for span in range_header[len("bytes="):].split(",")]
+        if len(ranges) == 1 or _GfsHandler.range_mode == "coalesced":
+            first, last = min(first for first, _ in ranges), max(last for _, last in ranges)
+            self._send(206, content[first:last + 1], {"Content-Range": f"bytes {first}-{last}/{len(content)}"})
+            return
+
+        if _GfsHandler.range_mode == "multipart_reversed":
+            ranges = ranges[::-1]
+        body = b""
+        for first, last in ranges:
+            body += (f"--{self.boundary}\r\nContent-Type: application/octet-stream\r\n"
+                     f"Content-Range: bytes {first}-{last}/{len(content)}\r\n\r\n").encode("ascii")
+            body += content[first:last + 1] + b"\r\n"
+        body += f"--{self.boundary}--\r\n".encode("ascii")
+        self._send(206, body, {"Content-Type": f"multipart/byteranges; boundary={self.boundary}"})
+
+    def _content(self) -> bytes:
+        return GFS_CONTENT if _GfsHandler.grib_content is None else _GfsHandler.grib_content
+
+    def _send(self, status: int, body: bytes, headers: dict = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _PathConfig:
+
+    def __init__(self, folder):
+        self.GFS_FOLDER_PATH = folder.joinpath("GFS")
+        self.GFS_BACKUP_FOLDER = folder.joinpath("GFS_BACKUP")
+        self.GFS_FOLDER_PATH.mkdir()
+
+
+@pytest.fixture
+def gfs_server():
+    _GfsHandler.failures_left = 0
+    _GfsHandler.range_headers = []
+    _GfsHandler.head_requests = 0
+    _GfsHandler.grib_content = None
+    _GfsHandler.idx_text = None
+    _GfsHandler.range_mode = "multipart"
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _GfsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def downloader(gfs_server, tmp_path):
+    path_config = _PathConfig(tmp_path)
+    return GfsDownloader(path_config, logging.getLogger(__name__), max_workers=2, max_retries=3,
+                         backoff_seconds=0., timeout_seconds=5., base_url=gfs_server,
+                         archive=GfsArchive(path_config.GFS_BACKUP_FOLDER))
+
+
+def test_resumes_partial_download_with_range(downloader):
+    url = downloader.generate_gfs_url(RUN_DATE)
+    archive_key = "2023071712/f000/1p00/full"
+    incoming_path = downloader.archive.incoming_path(archive_key)
+    partial_path = incoming_path.with_name(incoming_path.name + ".part")
+    partial_path.write_bytes(GFS_CONTENT[:1000])
+
+    archived_path = downloader._fetch_into_archive(url, archive_key)
+
+    assert _GfsHandler.range_headers == ["bytes=1000-"]
+    assert archived_path.read_bytes() == GFS_CONTENT
+    assert not partial_path.exists()
+
+
+def test_retries_after_server_error(downloader):
+    _GfsHandler.failures_left = 2
+
+    links = downloader.download(RUN_DATE, RUN_DATE, interval_hours=3)
+
+    assert len(links) == 1
+    assert links[0].read_bytes() == GFS_CONTENT
+    assert _GfsHandler.range_headers == [None]
+
+
+def test_raises_when_a_file_can_not_be_downloaded(downloader):
+    _GfsHandler.failures_left = 100
+
+    with pytest.raises(IOError):
+        downloader.download(RUN_DATE, RUN_DATE, interval_hours=3)
+    assert not list(downloader.path_config.GFS_FOLDER_PATH.iterdir())
+
+
+@pytest.fixture
+def grib_fixture(gfs_server):
+    messages, idx_text = _grib_fixture()
+    _GfsHandler.grib_content = b"".join(messages)
+    _GfsHandler.idx_text = idx_text
+    return messages
+
+
+@pytest.mark.parametrize("range_mode", ["multipart", "multipart_reversed", "coalesced", "ignore"])
+def test_subset_download(downloader, grib_fixture, range_mode):
+    _GfsHandler.range_mode = range_mode
+    # TMP 500 and TMP 850 are not neighbours, two ranges
+    downloader.subset_records = (("TMP", "500 mb|850 mb"),)
+
+    links = downloader.download(RUN_DATE, RUN_DATE, interval_hours=3)
+
+    assert links[0].read_bytes() == grib_fixture[0] + grib_fixture[2]
+    tmp_850_offset = len(grib_fixture[0]) + len(grib_fixture[1])
+    assert _GfsHandler.range_headers == [
+        f"bytes=0-{len(grib_fixture[0]) - 1},{tmp_850_offset}-{tmp_850_offset + len(grib_fixture[2]) - 1}"
+    ]
+    assert _GfsHandler.head_requests == 0
+
+
+def test_subset_with_last_record_uses_head_size(downloader, grib_fixture):
+    downloader.subset_records = (("UGRD", "10 m above ground"), ("PRMSL", "mean sea level"))
+
+    links = downloader.download(RUN_DATE, RUN_DATE, interval_hours=3)
+
+    assert _GfsHandler.head_requests == 1
+    # neighbouring records are fetched as one range up to the end of the file
+    total = sum(len(message) for message in grib_fixture)
+    assert _GfsHandler.range_headers == [f"bytes={total - len(grib_fixture[3]) - len(grib_fixture[4])}-{total - 1}"]
+    assert links[0].read_bytes() == grib_fixture[3] + grib_fixture[4]
+
+
+def test_subset_not_aligned_to_messages_is_rejected(downloader, grib_fixture, tmp_path):
+    # an inventory which does not match the file, the second record does not start with GRIB
+    messages, idx_text = _grib_fixture()
+    lines = idx_text.splitlines()
+    number, offset, *rest = lines[2].split(":")
+    lines[2] = ":".join([number, str(int(offset) + 2)] + rest)
+    _GfsHandler.idx_text = "\n".join(lines) + "\n"
+    downloader.subset_records = (("TMP", "500 mb|850 mb"),)
+
+    with pytest.raises(IOError, match="not aligned"):
+        downloader._stream_subset_to_partial_file(downloader.generate_gfs_url(RUN_DATE),
+                                                  tmp_path.joinpath("subset.part"))
@@ -0,0 +1,52 @@
+import pytest
+
+wrf = pytest.importorskip("wrf")
+np = pytest.importorskip("numpy")
+
+from netCDF4 import Dataset
+
+from library.models.WRFData import WRFData
+
+LEVELS = (850., 700., 500.)
+
+
+@pytest.fixture
+def wrf_data(synthetic_wrfout):
+    ds = Dataset(synthetic_wrfout)
+    yield WRFData(ds)
+    ds.close()
+
+
+def test_interpolation_of_wrf_variables_matches_interplevel(wrf_data):
+    uv = wrf.getvar(wrf_data.ds, "uvmet", timeidx=1)
+    wspd_wdir = wrf.getvar(wrf_data.ds, "uvmet_wspd_wdir", timeidx=1)
+    variables = {
+        "tc": wrf.getvar(wrf_data.ds, "tc", timeidx=1),
+        "uv": uv,
+        "wspd": wspd_wdir[0].drop_vars("wspd_wdir"),
+    }
+    pressure = wrf.getvar(wrf_data.ds, "p", units="hPa", timeidx=1)
+
+    fields = wrf_data.interpolate_to_pressure_levels(variables, LEVELS, timeidx=1)
+
+    assert fields["uv"].dims == ("u_v", "level", "south_north", "west_east")
+    for name, variable in variables.items():
+        for level_idx, level in enumerate(LEVELS):
+            expected = wrf.to_np(wrf.interplevel(variable, pressure, level))
+            actual = fields[name].isel(level=level_idx).values
+            np.testing.assert_allclose(actual, expected, rtol=1e-4, atol=1e-3, equal_nan=True)
+
+
+def test_isobaric_fields_merge_uvmet_components(wrf_data):
+    fields = wrf_data.isobaric_fields(timeidx=0)
+
+    assert set(WRFData.ISOBARIC_VARIABLES) <= set(fields.data_vars)
+    assert "u_v" not in fields.coords and "wspd_wdir" not in fields.coords
+    pressure = wrf.getvar(wrf_data.ds, "p", units="hPa", timeidx=0)
+    uv = wrf.getvar(wrf_data.ds, "uvmet", units="km h-1", timeidx=0)
+    for level_idx, level in enumerate(WRFData.STANDARD_PRESSURE_LEVELS):
+        expected = wrf.to_np(wrf.interplevel(uv, pressure, level))
+        np.testing.assert_allclose(fields["u"].isel(level=level_idx).values, expected[0],
+                                   rtol=1e-4, atol=1e-3, equal_nan=True)
+        np.testing.assert_allclose(fields["v"].isel(level=level_idx).values, expected[1],
+                                   rtol=1e-4, atol=1e-3, equal_nan=True)
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+pytest.importorskip("wrf")
+np = pytest.importorskip("numpy")
+
+from netCDF4 import Dataset
+
+from library.models.WRFData import WRFData
+from library.models.IsobaricStore import write_isobaric_store, open_isobaric_store
+
+
+def test_store_round_trip_matches_interpolation(synthetic_wrfout, tmp_path):
+    store_folder = tmp_path.joinpath("isobaric")
+    store_folder.mkdir()
+    write_isobaric_store(synthetic_wrfout, store_folder)
+
+    store = open_isobaric_store(synthetic_wrfout, store_folder)
+    assert store is not None
+    ds = Dataset(synthetic_wrfout)
+    try:
+        from_store = WRFData(ds, isobaric_store=store)
+        on_the_fly = WRFData(ds)
+        for timeidx in range(len(on_the_fly.available_times)):
+            stored_fields = from_store.isobaric_fields(timeidx=timeidx)
+            fields = on_the_fly.isobaric_fields(timeidx=timeidx)
+            for var_name in WRFData.ISOBARIC_VARIABLES:
+                np.testing.assert_allclose(stored_fields[var_name].values, fields[var_name].values,
+                                           rtol=1e-5, atol=1e-4, equal_nan=True)
+    finally:
+        store.close()
+        ds.close()
+
+
+def test_store_of_an_older_file_is_not_used(synthetic_wrfout, tmp_path):
+    store_folder = tmp_path.joinpath("isobaric")
+    store_folder.mkdir()
+    write_isobaric_store(synthetic_wrfout, store_folder)
+
+    # the wrfout is rewritten after the store, e.g. a new run with the same start date
+    stat = os.stat(synthetic_wrfout)
+    os.utime(synthetic_wrfout, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert open_isobaric_store(synthetic_wrfout, store_folder) is None
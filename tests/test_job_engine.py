@@ -0,0 +1,190 @@
+import os
+import time
+import stat
+
+import pytest
+
+from library.JobEngine import (
+    JobEngine, Stage, run_stages, run_process, PENDING, RUNNING, DONE, FAILED, CANCELLED
+)
+
+
+def write_stub(folder, name: str, seconds: float = 0., exit_code: int = 0):
+    """ Shell script standing in for a WPS/WRF executable, writes its pid next to itself. """
+    stub_path = folder.joinpath(name)
+    stub_path.write_text(
+        "#!/bin/sh\n"
+        f"echo $$ > {stub_path}.pid\n"
+        f"sleep {seconds}\n"
+        f"echo {name} finished\n"
+        f"exit {exit_code}\n"
+    )
+    stub_path.chmod(stub_path.stat().st_mode | stat.S_IEXEC)
+    return stub_path
+
+
+def wait_for(predicate, timeout: float = 10.):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for the job engine.")
+        time.sleep(.02)
+
+
+def _run_executable(path) -> None:
+    completed = run_process([str(path)])
+    if completed.returncode != 0:
+        raise RuntimeError(f"{path.name} did not complete")
+
+
+@pytest.fixture
+def stubs(tmp_path):
+    folder = tmp_path.joinpath("bin")
+    folder.mkdir()
+    return folder
+
+
+@pytest.fixture
+def make_engine(tmp_path, stubs):
+    engines = []
+
+    def make(max_concurrent: int = 1) -> JobEngine:
+        engine = JobEngine(tmp_path.joinpath("jobs"), max_concurrent=max_concurrent)
+
+        # same stage layout as the wps and wrf tasks of app.run_wrf.jobs
+        def wps() -> dict:
+            report = run_stages([
+                Stage("ungrib", lambda: _run_executable(stubs.joinpath("ungrib.exe"))),
+                Stage("geogrid", lambda: _run_executable(stubs.joinpath("geogrid.exe"))),
+                Stage("metgrid", lambda: _run_executable(stubs.joinpath("metgrid.exe")),
+                      depends_on=["ungrib", "geogrid"]),
+            ])
+            return {name: stage["seconds"] for name, stage in report.items()}
+
+        def wrf(name: str = "wrf.exe") -> str:
+            _run_executable(stubs.joinpath(name))
+            return name
+
+        engine.register("wps", wps)
+        engine.register("wrf", wrf)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.shutdown()
+
+
+def write_wps_stubs(stubs, seconds: float = 0., metgrid_exit: int = 0):
+    write_stub(stubs, "ungrib.exe", seconds)
+    write_stub(stubs, "geogrid.exe", seconds)
+    write_stub(stubs, "metgrid.exe", exit_code=metgrid_exit)
+
+
+def test_job_goes_from_pending_to_running_to_done(make_engine, stubs):
+    write_wps_stubs(stubs, seconds=.5)
+    engine = make_engine()
+    job = engine.submit("wps")
+    assert job.state == PENDING
+
+    engine.start()
+    wait_for(lambda: job.state == RUNNING)
+    wait_for(lambda: job.state == DONE)
+
+    assert set(job.result) == {"ungrib", "geogrid", "metgrid"}
+    assert all(stage["state"] == DONE for stage in job.stages.values())
+    assert job.started <= job.finished
+
+
+def test_failing_executable_fails_the_job(make_engine, stubs):
+    write_wps_stubs(stubs, metgrid_exit=1)
+    engine = make_engine()
+    engine.start()
+    job = engine.submit("wps")
+
+    wait_for(lambda: job.state in (DONE, FAILED))
+
+    assert job.state == FAILED
+    assert "metgrid" in job.error
+    assert job.stages["ungrib"]["state"] == DONE and job.stages["metgrid"]["state"] == FAILED
+
+
+def test_state_is_reloaded_after_a_restart(make_engine, stubs, tmp_path):
+    write_stub(stubs, "wrf.exe", seconds=30)
+    write_wps_stubs(stubs)
+    engine = make_engine(max_concurrent=1)
+    engine.start()
+    running_job = engine.submit("wrf")
+    wait_for(lambda: running_job.state == RUNNING)
+    pending_job = engine.submit("wps")
+
+    # a new process reads the same jobs folder while the first one was never shut down cleanly
+    restarted = make_engine(max_concurrent=1)
+    assert restarted.get(running_job.job_id).state == FAILED
+    assert restarted.get(running_job.job_id).error == "Interrupted by a restart."
+    assert restarted.get(pending_job.job_id).state == PENDING
+
+    restarted.start()
+    wait_for(lambda: restarted.get(pending_job.job_id).state == DONE)
+
+
+def test_cancel_kills_the_running_executable(make_engine, stubs):
+    stub_path = write_stub(stubs, "wrf.exe", seconds=60)
+    engine = make_engine()
+    engine.start()
+    job = engine.submit("wrf")
+    wait_for(lambda: job.processes)
+    process = next(iter(job.processes))
+    wait_for(lambda: os.path.exists(f"{stub_path}.pid"))
+
+    assert engine.cancel(job.job_id)
+
+    wait_for(lambda: job.state == CANCELLED, timeout=5)
+    assert process.poll() is not None
+    with open(f"{stub_path}.pid") as pid_file:
+        stub_pid = int(pid_file.read())
+    with pytest.raises(ProcessLookupError):
+        os.kill(stub_pid, 0)
+
+
+def test_wrf_job_waits_for_its_wps_job(make_engine, stubs):
+    write_wps_stubs(stubs, seconds=.5)
+    write_stub(stubs, "wrf.exe")
+    engine = make_engine(max_concurrent=2)
+    wps_job = engine.submit("wps")
+    wrf_job = engine.submit("wrf", depends_on=[wps_job.job_id])
+    engine.start()
+
+    wait_for(lambda: wps_job.state == RUNNING)
+    assert wrf_job.state == PENDING
+    wait_for(lambda: wrf_job.state == DONE)
+    assert wrf_job.started >= wps_job.finished
+
+
+def test_job_depending_on_a_failed_job_is_cancelled(make_engine, stubs):
+    write_wps_stubs(stubs, metgrid_exit=1)
+    write_stub(stubs, "wrf.exe")
+    engine = make_engine(max_concurrent=2)
+    wps_job = engine.submit("wps")
+    wrf_job = engine.submit("wrf", depends_on=[wps_job.job_id])
+    engine.start()
+
+    wait_for(lambda: wrf_job.state in (DONE, FAILED, CANCELLED))
+    assert wps_job.state == FAILED
+    assert wrf_job.state == CANCELLED and wrf_job.started is None
+
+
+def test_concurrency_limit(make_engine, stubs):
+    for i in range(4):
+        write_stub(stubs, f"wrf_{i}.exe", seconds=.5)
+    engine = make_engine(max_concurrent=2)
+    jobs = [engine.submit("wrf", params={"name": f"wrf_{i}.exe"}) for i in range(4)]
+
+    engine.start()
+    wait_for(lambda: sum(job.state == RUNNING for job in jobs) == 2)
+    assert sum(job.state == PENDING for job in jobs) == 2
+    wait_for(lambda: all(job.state == DONE for job in jobs))
+
+    # jobs running when each job started, itself included
+    for job in jobs:
+        assert sum(other.started <= job.started < other.finished for other in jobs) <= 2